@@ -0,0 +1,119 @@
+"""
+The adapter's own metrics (exported on the same `/metrics` endpoint as the emitted ones).
+"""
+from pathlib import Path
+
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+import converter
+import icd
+
+LATENCY_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 1e-2, 1e-1)
+LOKI_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+PACKETS_RECEIVED = Counter("oxemon_adapter_packets_received", "Datagrams received")
+BYTES_RECEIVED = Counter("oxemon_adapter_bytes_received", "Bytes received (in datagrams)")
+DECODE_ERRORS = Counter("oxemon_adapter_decode_errors", "Malformed messages", ["reason"])
+UNKNOWN_IDS = Counter("oxemon_adapter_unknown_ids", "Emits with ids that are not in the dictionary", ["kind"])
+IGNORED_EVENTS = Counter(
+    "oxemon_adapter_ignored_events",
+    "Emits of known modules and events which are not configured in the event registry",
+)
+SHED_DATAGRAMS = Counter(
+    "oxemon_adapter_shed_datagrams", "Datagrams shed since their source was over its rate limit", ["source"]
+)
+SHED_EMITS = Counter(
+    "oxemon_adapter_shed_emits", "Emits shed since their (module, event) was over its rate limit", ["module", "event"]
+)
+STAGE_LATENCY = Histogram(
+    "oxemon_adapter_stage_latency_seconds",
+    "Time spent on every handling stage of a message (sampled)",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+DECODE_LATENCY = STAGE_LATENCY.labels(stage="decode")
+CONVERT_LATENCY = STAGE_LATENCY.labels(stage="convert")
+# Updating the metric of a counter/label (or its coalescer's slot), or enqueuing a log for Loki
+PUSH_LATENCY = STAGE_LATENCY.labels(stage="push")
+
+LOKI_PUSH_LATENCY = Histogram(
+    "oxemon_adapter_loki_push_seconds", "Duration of pushes to Loki", buckets=LOKI_LATENCY_BUCKETS
+)
+LOKI_PUSH_FAILURES = Counter("oxemon_adapter_loki_push_failures", "Pushes to Loki that failed")
+LOKI_DROPPED_LINES = Counter(
+    "oxemon_adapter_loki_dropped_lines", "Log lines dropped since Loki fell behind or rejected them"
+)
+
+REMOTE_WRITE_LATENCY = Histogram(
+    "oxemon_adapter_remote_write_seconds", "Duration of remote-write pushes", buckets=LOKI_LATENCY_BUCKETS
+)
+REMOTE_WRITE_FAILURES = Counter(
+    "oxemon_adapter_remote_write_failures", "Remote-write pushes that failed (after their retries)"
+)
+REMOTE_WRITE_SAMPLES = Counter("oxemon_adapter_remote_write_samples", "Samples pushed with remote-write")
+
+QUEUE_DEPTH = Gauge("oxemon_adapter_queue_depth", "Datagrams waiting in the ingest queue", multiprocess_mode="livesum")
+QUEUE_DROPS = Counter("oxemon_adapter_queue_drops", "Datagrams dropped by the ingest queue's overload policy", ["kind"])
+
+STREAM_SKIPPED_BYTES = Counter(
+    "oxemon_adapter_stream_skipped_bytes", "Corrupt bytes skipped by stream transports to resynchronise"
+)
+STREAM_CONNECTIONS = Gauge(
+    "oxemon_adapter_stream_connections", "Open stream transport connections", multiprocess_mode="livesum"
+)
+
+for _reason in ("truncated_header", "truncated_body", "unknown_event_type", "log_parameters",
+                "unsupported_frame_version", "nested_frame"):
+    DECODE_ERRORS.labels(reason=_reason)
+for _kind in ("module", "event"):
+    UNKNOWN_IDS.labels(kind=_kind)
+for _kind in ("metric", "log"):
+    QUEUE_DROPS.labels(kind=_kind)
+
+
+def count_invalid_message(error: ValueError):
+    if isinstance(error, converter.UnknownIdError):
+        UNKNOWN_IDS.labels(kind=error.kind).inc()
+    elif isinstance(error, icd.DecodeError):
+        DECODE_ERRORS.labels(reason=error.reason).inc()
+    else:
+        DECODE_ERRORS.labels(reason="other").inc()
+
+
+class SocketDropsCollector:
+    """
+    Exports the kernel's drop counter and receive queue size of the UDP sockets bound to some port.
+
+    Read from `/proc/net/udp` (and `udp6`), which covers every socket sharing the port (e.g. all the workers).
+    """
+    PROC_FILES = ("/proc/net/udp", "/proc/net/udp6")
+
+    def __init__(self, port: int):
+        self.port = port
+
+    def read_socket_stats(self):
+        drops = 0
+        queued_bytes = 0
+        for proc_file in self.PROC_FILES:
+            try:
+                lines = Path(proc_file).read_text().splitlines()[1:]
+            except OSError:
+                continue
+            for line in lines:
+                columns = line.split()
+                local_port = int(columns[1].rsplit(":", 1)[1], 16)
+                if local_port != self.port:
+                    continue
+                queued_bytes += int(columns[4].split(":")[1], 16)
+                drops += int(columns[12])
+        return drops, queued_bytes
+
+    def collect(self):
+        drops, queued_bytes = self.read_socket_stats()
+        yield CounterMetricFamily(
+            "oxemon_adapter_socket_drops", "Datagrams dropped by the kernel (receive buffer overflow)", value=drops
+        )
+        yield GaugeMetricFamily(
+            "oxemon_adapter_socket_queued_bytes", "Bytes waiting in the socket receive buffer", value=queued_bytes
+        )
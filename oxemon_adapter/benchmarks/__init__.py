@@ -0,0 +1,5 @@
+"""
+Benchmarks for the adapter's hot paths.
+
+Run from the `oxemon_adapter` directory, e.g. `python -m benchmarks.decode`.
+"""
@@ -0,0 +1,117 @@
+"""
+Checks and times incremental `make config` builds of a large generated metrics configuration.
+
+A cold build is followed by a rebuild without changes, a change of a single entry, and the removal of a module.
+Every build reports how many files it wrote, and it's checked that only the affected dashboards were rewritten,
+that stale dashboards are pruned, and that the adapter's reload logic only sees the changes that were made.
+"""
+import json
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import yaml
+
+import reload
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "utils"))
+import configure  # noqa: E402
+
+
+def build_metrics(entries: int, modules: int) -> dict:
+    return {
+        f"entry {index}": {
+            "type": "counter" if index % 2 else "gauge",
+            "module_id": f"module {index % modules}",
+            "event_id": f"event {index // modules}",
+            "operations": ["sum", "rolling_average"] if index % 2 else ["show_current"],
+        }
+        for index in range(entries)
+    }
+
+
+def build_dictionary(metrics: dict) -> dict:
+    modules = sorted({entry["module_id"] for entry in metrics.values()})
+    events = sorted({entry["event_id"] for entry in metrics.values()})
+    return {
+        "module_ids": [{"string": module, "hash": index} for index, module in enumerate(modules)],
+        "event_ids": [{"string": event, "hash": index, "event_type": "counter"} for index, event in enumerate(events)],
+        "misc_conversions": [],
+        "expected_couplings": [],
+    }
+
+
+def timed_configure(directory: Path, metrics: dict, dictionary: dict) -> tuple:
+    metrics_path, dictionary_path = directory / "metrics.yaml", directory / "oxemon_dictionary.json"
+    metrics_path.write_text(yaml.safe_dump(metrics, sort_keys=False))
+    dictionary_path.write_text(json.dumps(dictionary))
+    start = time.perf_counter()
+    build = configure.configure(dictionary_path, metrics_path, directory / "config")
+    return build, time.perf_counter() - start
+
+
+def watched_signatures(config_directory: Path) -> tuple:
+    manifest_path = str(config_directory / reload.MANIFEST_NAME)
+    metrics_paths = [str(config_directory / name)
+                     for name in ("event_registry.yaml", "oxemon_dictionary.json", "oxemon_dictionary.idx")]
+    return (reload.configuration_signature(metrics_paths, manifest_path),
+            reload.configuration_signature([str(config_directory / "dashboards")], manifest_path))
+
+
+def run(entries: int, modules: int):
+    metrics = build_metrics(entries, modules)
+    dictionary = build_dictionary(metrics)
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        config_directory = directory / "config"
+        config_directory.mkdir()
+
+        def step(name: str, expected_written: int):
+            build, duration = timed_configure(directory, metrics, dictionary)
+            print(f"{name:<20}: {duration * 1000:>8.0f} ms, wrote {len(build.written):>5} files "
+                  f"({build.unchanged} unchanged)")
+            assert len(build.written) == expected_written, f"{name}: wrote {build.written}"
+            return build
+
+        # Every module's dashboard, the adapter health dashboard, the registry, the dictionary (and its index) and
+        # both sources
+        step("cold build", modules + 6)
+        signatures = watched_signatures(config_directory)
+
+        step("no changes", 0)
+        assert watched_signatures(config_directory) == signatures, "An unchanged build triggered a reload"
+
+        metrics["entry 1"]["operations"].append("show_current")
+        # The changed module's dashboard, and the metrics source
+        step("one entry changed", 2)
+        metrics_signature, dashboards_signature = watched_signatures(config_directory)
+        assert metrics_signature == signatures[0], "An unchanged event registry triggered a metrics reload"
+        assert dashboards_signature != signatures[1], "A changed dashboard wasn't noticed"
+
+        removed_module = "module 0"
+        for name in [name for name, entry in metrics.items() if entry["module_id"] == removed_module]:
+            del metrics[name]
+        # The event registry and the metrics source (the dictionary still has the module)
+        build = step("module removed", 2)
+        pruned = config_directory / "dashboards" / configure.dashboard_file_name(removed_module)
+        assert not pruned.exists(), "The removed module's dashboard wasn't pruned"
+        assert len(list((config_directory / "dashboards").iterdir())) == modules, "Unexpected dashboards left"
+        assert build.manifest["artifacts"].keys() == {
+            str(path.relative_to(config_directory)) for path in config_directory.rglob("*")
+            if path.is_file() and path.name != reload.MANIFEST_NAME
+        }, "The manifest doesn't match the configuration folder"
+    print("Checks passed")
+
+
+def parse_args():
+    parser = ArgumentParser(description="Check and time incremental `make config` builds")
+    parser.add_argument("--entries", type=int, default=5000)
+    parser.add_argument("--modules", type=int, default=200)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    run(arguments.entries, arguments.modules)
@@ -0,0 +1,211 @@
+"""
+Checks and times the Grafana provisioning against a local fake Grafana.
+
+The fake implements the endpoints the adapter uses (health, service account tokens, `/api/search` and
+`/api/dashboards/db`), with a configurable latency per request.
+- The API key bootstrap is timed on a cold start, a warm restart (with the saved token) and after the token was
+  revoked.
+- The upload is timed with and without concurrency, and then it's checked that unchanged dashboards are skipped
+  (even by a "restarted" adapter) and that changed ones are re-uploaded in place.
+"""
+import json
+import tempfile
+import threading
+import time
+import uuid
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import grafana_api_handling
+import upload_dashboards
+
+SERVICE_ACCOUNT_ID = 1
+
+
+class FakeGrafana:
+    """
+    Keeps uploaded dashboards in memory, and counts the requests and the connections it got.
+    """
+    def __init__(self, latency: float, boot_time: float = 0):
+        self.latency = latency
+        self.ready_time = time.monotonic() + boot_time  # Health checks fail until then
+        self.dashboards = {}  # By uid
+        self.tokens = {"fake"}
+        self.requests = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+
+        grafana = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, so that connection reuse can be seen
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with grafana._lock:
+                    grafana.connections += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status: int, content):
+                body = json.dumps(content).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _authorized(self) -> bool:
+                authorization = self.headers.get("Authorization", "")
+                return authorization.startswith("Basic ") or authorization[len("Bearer "):] in grafana.tokens
+
+            def do_GET(self):
+                grafana._count()
+                url = urlparse(self.path)
+                if url.path == "/api/health":
+                    if time.monotonic() < grafana.ready_time:
+                        return self._reply(503, {"database": "starting"})
+                    return self._reply(200, {"database": "ok"})
+                if url.path != "/api/search":
+                    return self._reply(404, {"message": "Not found"})
+                if not self._authorized():
+                    return self._reply(401, {"message": "Invalid API key"})
+                params = parse_qs(url.query)
+                limit, page = int(params["limit"][0]), int(params.get("page", ["1"])[0])
+                results = [{"uid": uid, "title": dashboard["title"], "type": "dash-db",
+                            "tags": dashboard.get("tags", [])}
+                           for uid, dashboard in sorted(grafana.dashboards.items())]
+                self._reply(200, results[(page - 1) * limit:page * limit])
+
+            def do_POST(self):
+                grafana._count()
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                path = urlparse(self.path).path
+                if path == "/api/serviceaccounts":
+                    return self._reply(201, {"id": SERVICE_ACCOUNT_ID})
+                if path == f"/api/serviceaccounts/{SERVICE_ACCOUNT_ID}/tokens":
+                    token = uuid.uuid4().hex
+                    grafana.tokens.add(token)
+                    return self._reply(200, {"key": token})
+                if not self._authorized():
+                    return self._reply(401, {"message": "Invalid API key"})
+                dashboard = payload["dashboard"]
+                uid = dashboard.get("uid") or uuid.uuid4().hex
+                with grafana._lock:
+                    if uid not in grafana.dashboards and any(existing["title"] == dashboard["title"]
+                                                             for existing in grafana.dashboards.values()):
+                        return self._reply(412, {"message": "A dashboard with the same name already exists"})
+                    grafana.dashboards[uid] = dict(dashboard, uid=uid)
+                self._reply(200, {"status": "success", "uid": uid})
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def _count(self):
+        with self._lock:
+            self.requests += 1
+        time.sleep(self.latency)
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self._server.shutdown()
+
+    def reset_counters(self):
+        self.requests = self.connections = 0
+
+
+def build_dashboards(count: int, panels: int) -> list:
+    return [
+        {
+            "title": f"module {index}",
+            "tags": ["oxemon"],
+            "panels": [{"id": panel, "title": f"event {panel}", "type": "timeseries",
+                        "targets": [{"expr": f'event_{panel}{{module="module_{index}"}}'}]}
+                       for panel in range(panels)],
+        }
+        for index in range(count)
+    ]
+
+
+def timed_upload(grafana: FakeGrafana, dashboards: list, concurrency: int) -> tuple:
+    grafana.reset_counters()
+    start = time.perf_counter()
+    uploaded, failed = upload_dashboards.upload_module_dashboards(dashboards, concurrency=concurrency,
+                                                                  grafana_api_key="fake")
+    assert not failed, f"Failed to upload {failed}"
+    return uploaded, time.perf_counter() - start
+
+
+def timed_bootstrap(grafana: FakeGrafana) -> tuple:
+    grafana.reset_counters()
+    start = time.perf_counter()
+    api_key = grafana_api_handling.create_grafana_api_key()
+    return api_key, time.perf_counter() - start
+
+
+def run_bootstrap(latency: float):
+    grafana = FakeGrafana(latency)
+    grafana.start()
+    grafana_api_handling.GRAFANA_URL = grafana.url
+    with tempfile.TemporaryDirectory() as directory:
+        grafana_api_handling.TOKEN_PATH = Path(directory) / ".grafana_token"
+
+        for name in ("cold start", "warm restart"):
+            api_key, duration = timed_bootstrap(grafana)
+            assert api_key in grafana.tokens, f"Got an invalid API key on a {name}"
+            print(f"{name:<14}: API key ready in {duration * 1000:.0f} ms ({grafana.requests} requests)")
+        assert grafana.requests == 2, "A warm restart should only check readiness and validate the saved token"
+
+        grafana.tokens.clear()
+        api_key, duration = timed_bootstrap(grafana)
+        assert api_key in grafana.tokens, "The revoked token wasn't replaced"
+        print(f"{'revoked token':<14}: API key ready in {duration * 1000:.0f} ms ({grafana.requests} requests)")
+    grafana.stop()
+
+
+def run(count: int, panels: int, latency: float, concurrency: int):
+    for run_concurrency in (1, concurrency):
+        grafana = FakeGrafana(latency)
+        grafana.start()
+        upload_dashboards.GRAFANA_URL = grafana.url
+        dashboards = build_dashboards(count, panels)
+
+        uploaded, duration = timed_upload(grafana, dashboards, run_concurrency)
+        assert uploaded == count and len(grafana.dashboards) == count, "Not all the dashboards were uploaded"
+        print(f"concurrency {run_concurrency:>3}: uploaded {uploaded} dashboards in {duration:.2f}s "
+              f"({grafana.requests} requests over {grafana.connections} connections)")
+
+        # A restarted adapter (with no memory of what it uploaded) must skip everything
+        uploaded, duration = timed_upload(grafana, build_dashboards(count, panels), run_concurrency)
+        assert uploaded == 0, f"{uploaded} unchanged dashboards were re-uploaded"
+        print(f"concurrency {run_concurrency:>3}: unchanged dashboards skipped in {duration:.2f}s "
+              f"({grafana.requests} requests)")
+
+        changed = build_dashboards(count, panels)
+        changed[0]["panels"].append({"id": panels, "title": "new event", "type": "timeseries"})
+        uploaded, _ = timed_upload(grafana, changed, run_concurrency)
+        assert uploaded == 1 and len(grafana.dashboards) == count, "A changed dashboard wasn't replaced in place"
+        grafana.stop()
+    print("Checks passed")
+
+
+def parse_args():
+    parser = ArgumentParser(description="Check and time the Grafana provisioning against a fake Grafana")
+    parser.add_argument("--dashboards", type=int, default=300)
+    parser.add_argument("--panels", type=int, default=20, help="Panels per dashboard")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Latency of every request to the fake")
+    parser.add_argument("--concurrency", type=int, default=8)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    run_bootstrap(arguments.latency_ms / 1000)
+    run(arguments.dashboards, arguments.panels, arguments.latency_ms / 1000, arguments.concurrency)
@@ -0,0 +1,86 @@
+"""
+Builds realistic emit datagrams (from the `icd` structs) for the ids found in an `oxemon_dictionary.json`.
+"""
+import random
+from typing import List, Optional, Tuple
+
+import icd
+
+# Dictionary event types that are emitted as labels (everything else is a counter)
+LABEL_EVENT_TYPES = {"enum", "gauge"}
+
+
+class DatagramFactory:
+    """
+    Generates a mix of counter, label and log datagrams.
+
+    Args:
+        oxemon_dictionary: The dictionary whose ids are emitted.
+        counter_weight, label_weight, log_weight: Relative share of every kind of emit.
+        param_bits: Log parameters (and counter values) are drawn uniformly from `[0, 2 ** param_bits)`.
+        exact_params: Whether logs carry exactly as many parameters as their placeholders, or a random amount
+            (between 0 and `max_params`).
+        exclude: A `(module_hash, event_hash)` pair that is never generated (e.g. the latency probe).
+        seed: Seed of the random generator, so that runs are reproducible.
+    """
+    def __init__(self, oxemon_dictionary: dict, *, counter_weight: float = 6, label_weight: float = 3,
+                 log_weight: float = 1, param_bits: int = 16, exact_params: bool = True, max_params: int = 8,
+                 exclude: Optional[Tuple[int, int]] = None, seed: int = 0):
+        self.random = random.Random(seed)
+        self.param_bits = param_bits
+        self.exact_params = exact_params
+        self.max_params = max_params
+
+        module_hashes = {module["string"]: module["hash"] for module in oxemon_dictionary["module_ids"]}
+        events = {event["string"]: event for event in oxemon_dictionary["event_ids"]}
+
+        # Prefer the couplings that are known to be emitted, fall back to every module with every event
+        couplings = [
+            (module_hashes[coupling["module_id"]], events[coupling["event_id"]])
+            for coupling in oxemon_dictionary.get("expected_couplings", [])
+            if coupling["module_id"] in module_hashes and coupling["event_id"] in events
+        ] or [(module_hash, event) for module_hash in module_hashes.values() for event in events.values()]
+        couplings = [(module, event) for module, event in couplings if (module, event["hash"]) != exclude]
+
+        self.counters = [(module, event["hash"]) for module, event in couplings
+                         if event.get("event_type") not in LABEL_EVENT_TYPES]
+        self.labels = [(module, event["hash"]) for module, event in couplings
+                       if event.get("event_type") in LABEL_EVENT_TYPES]
+        self.logs = [(module_hash, log["hash"], log["string"].count("{}"))
+                     for module_hash in module_hashes.values()
+                     for log in oxemon_dictionary["misc_conversions"]]
+
+        kinds = [(self._counter, self.counters, counter_weight),
+                 (self._label, self.labels, label_weight),
+                 (self._log, self.logs, log_weight)]
+        kinds = [(builder, weight) for builder, candidates, weight in kinds if candidates and weight > 0]
+        if not kinds:
+            raise ValueError("The dictionary has no ids to emit (with the given weights)")
+        self._builders = [builder for builder, _ in kinds]
+        self._weights = [weight for _, weight in kinds]
+
+    def _value(self) -> int:
+        return self.random.getrandbits(self.param_bits)
+
+    def _counter(self) -> bytes:
+        module_id, event_id = self.random.choice(self.counters)
+        return bytes(icd.EmitHeader(module_id=module_id, event_id=event_id) /
+                     icd.EmitCounter(counter_value=self._value()))
+
+    def _label(self) -> bytes:
+        module_id, event_id = self.random.choice(self.labels)
+        return bytes(icd.EmitHeader(module_id=module_id, event_id=event_id) /
+                     icd.EmitLabel(label=self.random.randrange(8)))
+
+    def _log(self) -> bytes:
+        module_id, event_id, placeholder_count = self.random.choice(self.logs)
+        param_count = placeholder_count if self.exact_params else self.random.randint(0, self.max_params)
+        return bytes(icd.EmitHeader(module_id=module_id, event_id=event_id) /
+                     icd.EmitLog(params=[self._value() for _ in range(param_count)]))
+
+    def build(self, count: int) -> List[bytes]:
+        """
+        Builds `count` datagrams (building with hydration is slow, so build a pool once and reuse it).
+        """
+        builders = self.random.choices(self._builders, weights=self._weights, k=count)
+        return [builder() for builder in builders]
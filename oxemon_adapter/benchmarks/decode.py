@@ -0,0 +1,88 @@
+"""
+Compares the hydration decoder (`icd.read_message`) with the precompiled one (`icd.decode_message`).
+
+The decoders are first checked for parity on a set of messages, and then timed on each message kind.
+"""
+import struct
+import timeit
+from argparse import ArgumentParser
+
+import icd
+
+
+def build_sample_messages() -> dict:
+    """
+    Builds one datagram of each kind (logs with a varying amount of parameters).
+    """
+    messages = {
+        "counter": icd.EmitHeader(module_id=748, event_id=1441) / icd.EmitCounter(counter_value=2 ** 40 + 7),
+        "label": icd.EmitHeader(module_id=946, event_id=1411) / icd.EmitLabel(label=3),
+    }
+    for param_count in (0, 1, 4, 16):
+        params = list(range(1, param_count + 1))
+        messages[f"log[{param_count}]"] = icd.EmitHeader(module_id=298, event_id=972) / icd.EmitLog(params=params)
+
+    return {name: bytes(message) for name, message in messages.items()}
+
+
+def _as_tuple(value):
+    return tuple(value) if isinstance(value, list) else value
+
+
+def hydration_to_record(data: bytes) -> icd.EmitRecord:
+    """
+    Decodes a message with hydration, and converts it to the fast decoder's representation.
+    """
+    message = icd.read_message(data)
+    header, body = message[icd.EmitHeader], message[1]
+    return icd.EmitRecord(
+        module_id=header.module_id.value,
+        event_id=header.event_id.value,
+        body_type=type(body),
+        # hydration leaves empty vectors as lists
+        body=tuple(_as_tuple(getattr(body, name).value) for name in body._field_names),
+    )
+
+
+def check_parity(messages: dict):
+    for name, data in messages.items():
+        expected = hydration_to_record(data)
+        for buffer in (data, bytearray(data), memoryview(data)):
+            actual = icd.decode_message(buffer)
+            assert actual == expected, f"Decoders disagree on {name}: {actual} != {expected}"
+
+        # Both decoders must reject the same malformed inputs
+        for malformed in (data[:icd.HEADER_SIZE - 1], data[:-1]):
+            hydration_rejected = _rejects(hydration_to_record, malformed)
+            fast_rejected = _rejects(icd.decode_message, malformed)
+            assert hydration_rejected == fast_rejected, f"Decoders disagree on a malformed {name}: {malformed}"
+
+
+def _rejects(decode, data) -> bool:
+    try:
+        decode(data)
+    except (ValueError, struct.error):
+        return True
+    return False
+
+
+def parse_args():
+    parser = ArgumentParser(description="Benchmark the hydration decoder against the precompiled decoder")
+    parser.add_argument("-n", "--number", type=int, default=20000, help="Decodes per measurement")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    sample_messages = build_sample_messages()
+    check_parity(sample_messages)
+    print("Parity check passed")
+
+    print(f"{'message':<10} {'hydration':>14} {'precompiled':>14} {'speedup':>9}")
+    for message_name, message_data in sample_messages.items():
+        slow = timeit.timeit(lambda: icd.read_message(message_data), number=arguments.number)
+        fast = timeit.timeit(lambda: icd.decode_message(message_data), number=arguments.number)
+        print(f"{message_name:<10} "
+              f"{slow / arguments.number * 1e6:>11.2f} us "
+              f"{fast / arguments.number * 1e6:>11.2f} us "
+              f"{slow / fast:>8.1f}x")
@@ -0,0 +1,102 @@
+"""
+Compares the adapter's startup with a large dictionary: parsing its JSON vs. memory-mapping its compiled index.
+
+A dictionary of `--entries` ids in every namespace is generated (with a configured metric for a few of its
+(module, event) pairs), and the time it takes to load it and to build the dispatch index is measured for both, along
+with the time of converting a log emit. It's also checked that colliding hashes fail the compilation.
+"""
+import json
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import converter
+import dictionary_index
+import icd
+import main
+from dictionary_index import DictionaryCollisionError, DictionaryIndex
+
+CONFIGURED_PAIRS = 100
+
+
+def build_dictionary(entries: int) -> dict:
+    return {
+        "module_ids": [{"string": f"module {index}", "hash": index} for index in range(entries)],
+        "event_ids": [{"string": f"event {index}", "hash": index, "event_type": "counter"}
+                      for index in range(entries)],
+        "misc_conversions": [{"string": f"log {index} with {{}}", "hash": index} for index in range(entries)],
+        "expected_couplings": [],
+    }
+
+
+def configure_metrics(dictionary: dict):
+    registry = {f"event {index}": {"type": "counter", "modules": [f"module {index}"]}
+                for index in range(CONFIGURED_PAIRS)}
+    main.create_metric_families(registry)
+
+
+def load_json(dictionary_path: Path) -> DictionaryIndex:
+    content = dictionary_path.read_bytes()
+    return DictionaryIndex.from_dictionary(json.loads(content), dictionary_index.dictionary_source_hash(content))
+
+
+def load_index(index_path: Path) -> DictionaryIndex:
+    return DictionaryIndex.open(index_path)
+
+
+def measure(load, path: Path, log_message: bytes) -> tuple:
+    """
+    Returns the time it took to load the dictionary and build the dispatch index, and to convert a log emit.
+    """
+    start = time.perf_counter()
+    dispatch_index = main.create_dispatch_index(load(path))
+    loaded = time.perf_counter()
+    update = converter.convert_incoming_message(message=log_message, conversion_map=dispatch_index.conversion_map)
+    converted = time.perf_counter()
+    assert update.event_name == "log 7 with {3}", f"Wrong log conversion: {update.event_name}"
+    return loaded - start, converted - loaded
+
+
+def check_collisions(dictionary: dict):
+    dictionary["event_ids"].append({"string": "another event", "hash": 0, "event_type": "counter"})
+    try:
+        dictionary_index.compile_dictionary(dictionary)
+    except DictionaryCollisionError as e:
+        assert len(e.collisions) == 1, e.collisions
+    else:
+        raise AssertionError("A hash collision wasn't detected")
+    finally:
+        dictionary["event_ids"].pop()
+
+
+def parse_args():
+    parser = ArgumentParser(description="Compare loading the dictionary's JSON and its compiled index")
+    parser.add_argument("--entries", type=int, default=200000, help="Ids in every namespace")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    main.settings.LOG_PACKETS = False
+    dictionary = build_dictionary(arguments.entries)
+    configure_metrics(dictionary)
+    log_message = bytes(icd.EmitHeader(module_id=1, event_id=7) / icd.EmitLog(params=[3]))
+
+    with tempfile.TemporaryDirectory() as directory:
+        dictionary_path, index_path = Path(directory) / "oxemon_dictionary.json", Path(directory) / "dictionary.idx"
+        content = json.dumps(dictionary).encode()
+        dictionary_path.write_bytes(content)
+        start = time.perf_counter()
+        index_path.write_bytes(dictionary_index.compile_dictionary(
+            dictionary, dictionary_index.dictionary_source_hash(content)
+        ))
+        print(f"{arguments.entries} ids per namespace, compiled into {index_path.stat().st_size / 2 ** 20:.1f} MB "
+              f"(from {len(content) / 2 ** 20:.1f} MB of JSON) in {time.perf_counter() - start:.2f}s")
+
+        for name, load, path in (("json", load_json, dictionary_path), ("index", load_index, index_path)):
+            startup, conversion = measure(load, path, log_message)
+            print(f"{name:<6}: startup {startup * 1000:>8.1f} ms, first log conversion {conversion * 1e6:>6.0f} us")
+
+    check_collisions(dictionary)
+    print("Checks passed")
@@ -0,0 +1,208 @@
+"""
+Checks and times the sketches of `distribution` events.
+
+- Accuracy: the percentiles of `--values` values of several distributions (uniform, exponential, log-normal,
+  bimodal, constant, and one spanning 12 orders of magnitude) must be within `RELATIVE_ACCURACY` of the exact ones,
+  and the maximum exact.
+- Memory: a series must take the same memory after 10 thousand values and after `--values`, and values spanning
+  more than `MAX_BUCKETS` buckets must be bounded by merging the lowest ones (keeping the high percentiles accurate).
+- Merging two sketches must equal sketching all their values (or be bounded like it, when they span too many
+  buckets together), and the percentiles must be of the window only.
+- Through the adapter: distributions are observed even while coalescing, and exported as a summary and a gauge.
+"""
+import gc
+import math
+import random
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from types import SimpleNamespace
+
+from prometheus_client import generate_latest
+
+import main
+import sketch
+from coalescer import UpdateCoalescer
+from dispatch import AGGREGATE_NONE
+from sketch import DDSketch, DistributionSeries, QUANTILES, RELATIVE_ACCURACY, MAX_BUCKETS
+
+CHECKED_QUANTILES = (0.01, 0.25, 0.5, 0.75, 0.9, 0.99, 0.999)
+
+DISTRIBUTIONS = {
+    "uniform": lambda: random.uniform(0, 1000),
+    "exponential": lambda: random.expovariate(1 / 5000),
+    "log-normal": lambda: random.lognormvariate(10, 2),
+    "bimodal": lambda: random.gauss(100, 10) if random.random() < 0.9 else random.gauss(100000, 1000),
+    "constant": lambda: 42,
+    "wide": lambda: 10 ** random.uniform(0, 12),
+}
+
+
+def check_accuracy(values: list, estimates: list, quantiles) -> float:
+    """
+    Returns the worst relative error of the estimates (against the values around every quantile's rank).
+    """
+    ordered = sorted(values)
+    worst = 0
+    for quantile, estimate in zip(quantiles, estimates):
+        rank = quantile * (len(ordered) - 1)
+        low, high = ordered[math.floor(rank)], ordered[math.ceil(rank)]
+        if low <= estimate <= high:
+            continue
+        exact = low if estimate < low else high
+        error = abs(estimate - exact) / exact if exact else estimate
+        assert error <= RELATIVE_ACCURACY + 1e-9, f"p{quantile * 100:g} is {estimate}, expected about {exact}"
+        worst = max(worst, error)
+    return worst
+
+
+def check_distributions(count: int):
+    for name, generate in DISTRIBUTIONS.items():
+        values = [max(generate(), 0) for _ in range(count)]
+        sketched = DDSketch()
+        for value in values:
+            sketched.add(value)
+        worst = check_accuracy(values, sketched.quantiles(CHECKED_QUANTILES), CHECKED_QUANTILES)
+        assert sketched.max == max(values), f"The maximum of {name} isn't exact"
+        print(f"accuracy, {name:<12}: worst relative error {worst * 100:.2f}% in {len(sketched.counts)} buckets")
+
+
+def series_size(series: DistributionSeries) -> int:
+    gc.collect()
+    return sum(len(sketched.counts) * sketched.counts.itemsize for sketched in series._sketches)
+
+
+def check_memory(count: int):
+    series = DistributionSeries(window=0)
+    generate = DISTRIBUTIONS["log-normal"]
+    for _ in range(10000):
+        series.observe(generate())
+    small = series_size(series)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for _ in range(count - 10000):
+        series.observe(generate())
+    grown = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    large = series_size(series)
+    print(f"memory, log-normal  : {small / 1024:.1f} KB after 10k values, {large / 1024:.1f} KB after {count} "
+          f"(grew by {grown / 1024:.1f} KB)")
+    # Only new buckets (of values rarer than the first 10k) may be added
+    assert large <= small * 1.5 and grown < 64 * 1024, "The memory of a series grew with its values"
+
+    # Values spanning more buckets than the bound: the lowest are merged, the high percentiles stay accurate
+    sketched = DDSketch()
+    values = [math.exp(random.uniform(0, 60)) for _ in range(count // 10)]
+    for value in values:
+        sketched.add(value)
+    assert len(sketched.counts) == MAX_BUCKETS, f"{len(sketched.counts)} buckets instead of {MAX_BUCKETS}"
+    high = (0.5, 0.9, 0.99)
+    worst = check_accuracy(values, sketched.quantiles(high), high)
+    print(f"memory, huge span   : bounded to {len(sketched.counts)} buckets, worst relative error "
+          f"{worst * 100:.2f}% (p50 and above)")
+
+
+def check_merge(count: int):
+    first, second, both = DDSketch(), DDSketch(), DDSketch()
+    for index in range(count // 10):
+        value = DISTRIBUTIONS["bimodal" if index % 2 else "wide"]()
+        (first if index % 3 else second).add(value)
+        both.add(value)
+    first.merge(second)
+    assert (first.count, first.zero_count, first.max) == (both.count, both.zero_count, both.max)
+    assert first.quantiles(CHECKED_QUANTILES) == both.quantiles(CHECKED_QUANTILES), "Merging changed the estimates"
+
+    # Together, they span more buckets than the bound
+    low, high = DDSketch(), DDSketch()
+    values = [math.exp(random.uniform(0, 30)) for _ in range(count // 20)]
+    values += [math.exp(random.uniform(30, 60)) for _ in range(count // 20)]
+    for index, value in enumerate(values):
+        (low if index < count // 20 else high).add(value)
+    low.merge(high)
+    assert len(low.counts) == MAX_BUCKETS and low.count == len(values)
+    high_quantiles = (0.5, 0.9, 0.99)
+    check_accuracy(values, low.quantiles(high_quantiles), high_quantiles)
+
+
+def check_window():
+    window = 0.6
+    series = DistributionSeries(window)
+    for _ in range(1000):
+        series.observe(1000000)
+    time.sleep(window + window / sketch.AGE_BUCKETS)
+    for value in range(1, 101):
+        series.observe(value)
+    estimates, maximum, count, total = series.snapshot()
+    assert maximum == 100 and estimates[-1] <= 100, f"Values older than the window are still counted: {estimates}"
+    assert count == 1100 and total == 1000 * 1000000 + 5050, "The count and sum must be of all the values"
+    time.sleep(window + window / sketch.AGE_BUCKETS)
+    assert series.snapshot()[0] is None, "Values older than the window are still counted"
+
+
+def check_adapter():
+    main.settings.LOG_PACKETS = False
+    main.create_metric_families({"request time": {"type": "distribution", "modules": ["server", "client"]},
+                                 "requests": {"type": "counter", "modules": ["server"]}})
+    distribution = main.metric_instances["request_time"]["server"]
+    assert main._updater(distribution) == (distribution.observe, AGGREGATE_NONE)
+
+    # Coalescing sums the counters, while every value of a distribution must be observed
+    observe, observed = main._updater(distribution)
+    inc, summed = main._updater(main.metric_instances["requests"]["server"])
+    index = SimpleNamespace(updaters={1: observe, 2: inc}, aggregations={1: observed, 2: summed})
+    coalescer = UpdateCoalescer(window=60)
+    bound = coalescer.bind(index)
+    for value in range(1, 1001):
+        bound.updaters[1](value)
+        bound.updaters[2](1)
+    coalescer.flush()
+    estimates, maximum, count, _ = distribution.snapshot()
+    assert count == 1000 and maximum == 1000, "A coalesced distribution lost values"
+
+    exposition = generate_latest().decode()
+    for quantile, estimate in zip(QUANTILES, estimates):
+        assert f'request_time{{module="server",quantile="{quantile}"}} {estimate}' in exposition
+    assert 'request_time_count{module="server"} 1000.0' in exposition
+    assert 'request_time_max{module="server"} 1000.0' in exposition
+    # A series without values has no percentiles yet
+    assert 'request_time{module="client"' not in exposition and 'request_time_count{module="client"} 0.0' in exposition
+    names = {sample.name for family in main.collect_emitted_metrics() for sample in family.samples}
+    assert {"request_time", "request_time_max", "request_time_count", "requests_total"} <= names
+
+    # Changing its type (or removing it) unregisters it
+    main.create_metric_families({"request time": {"type": "gauge", "modules": ["server"]}})
+    assert "request_time_max" not in generate_latest().decode()
+
+
+def time_observe(count: int):
+    series = DistributionSeries(window=60)
+    values = [DISTRIBUTIONS["log-normal"]() for _ in range(count)]
+    start = time.perf_counter()
+    for value in values:
+        series.observe(value)
+    duration = time.perf_counter() - start
+    print(f"observe             : {duration / count * 1e9:.0f} ns/value")
+
+    start = time.perf_counter()
+    for _ in range(100):
+        series.snapshot()
+    print(f"snapshot            : {(time.perf_counter() - start) / 100 * 1e6:.0f} us/series (merging "
+          f"{sketch.AGE_BUCKETS} sketches)")
+
+
+def parse_args():
+    parser = ArgumentParser(description="Check the accuracy and the memory of the distributions' sketches")
+    parser.add_argument("--values", type=int, default=200000, help="Amount of values of every checked distribution")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    random.seed(1414)
+    check_distributions(arguments.values)
+    check_memory(arguments.values)
+    check_merge(arguments.values)
+    check_window()
+    check_adapter()
+    time_observe(arguments.values)
+    print("Checks passed")
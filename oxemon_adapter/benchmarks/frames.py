@@ -0,0 +1,141 @@
+"""
+Compares single-emit datagrams with frames (several emits packed into one datagram).
+
+For every frame size, a sender process floods a loopback socket with datagrams as fast as it can, while the
+adapter's batched receiving and handling (`BatchReceiver` and `handle_batch`) run in this process. The handled
+packets/sec and events/sec are reported for every format.
+
+Beforehand, a frame mixing valid emits with emits that can't be handled (unknown ids) is checked to have all its
+valid emits handled, with and without timing, while a malformed frame is rejected as a whole.
+"""
+import json
+import multiprocessing
+import socket
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+from prometheus_client import REGISTRY
+
+import icd
+import main
+from benchmarks.datagrams import DatagramFactory
+from benchmarks.pipeline import DiscardingShipper, EXAMPLE_DICTIONARY_PATH, create_registry
+from dictionary_index import DictionaryIndex
+from receiver import BatchReceiver
+
+RECEIVE_BATCH_SIZE = 256
+MAX_DATAGRAM_SIZE = 65535
+
+
+def build_pool(emits: list, records_per_frame: int) -> list:
+    """
+    Packs the emits into frames of `records_per_frame` records (1 sends every emit as is).
+    """
+    if records_per_frame == 1:
+        return emits
+    return [icd.build_frame(emits[index:index + records_per_frame])
+            for index in range(0, len(emits) - records_per_frame + 1, records_per_frame)]
+
+
+def check_mixed_frame():
+    module, event = {"string": "framed", "hash": 1}, {"string": "frame count", "hash": 2, "event_type": "counter"}
+    main.create_metric_families({event["string"]: {"type": "counter", "modules": [module["string"]]}})
+    main.dispatch_index = main.create_dispatch_index(DictionaryIndex.from_dictionary(
+        {"module_ids": [module], "event_ids": [event], "misc_conversions": [], "expected_couplings": []}
+    ))
+
+    def emit(module_id: int, event_id: int) -> bytes:
+        return bytes(icd.EmitHeader(module_id=module_id, event_id=event_id) / icd.EmitCounter(counter_value=1))
+
+    def counted() -> tuple:
+        return (REGISTRY.get_sample_value("frame_count_total", {"module": "framed"}),
+                REGISTRY.get_sample_value("oxemon_adapter_unknown_ids_total", {"kind": "module"}) or 0,
+                REGISTRY.get_sample_value("oxemon_adapter_unknown_ids_total", {"kind": "event"}) or 0)
+
+    def pushes_timed() -> float:
+        return REGISTRY.get_sample_value("oxemon_adapter_stage_latency_seconds_count", {"stage": "push"}) or 0
+
+    valid = emit(module["hash"], event["hash"])
+    frame = icd.build_frame([valid, emit(99, event["hash"]), valid, emit(module["hash"], 99), valid])
+    for handle in (main.handle_message, main.handle_message_timed):
+        before, timed = counted(), pushes_timed()
+        handle(frame, main.dispatch_index)
+        handled, unknown_modules, unknown_events = (after - start for after, start in zip(counted(), before))
+        assert handled == 3, f"{handle.__name__} handled {handled:.0f} of the 3 valid emits of a mixed frame"
+        assert (unknown_modules, unknown_events) == (1, 1), "The emits with unknown ids weren't counted"
+    # Updating the metrics of the timed frame is timed as its push stage
+    assert pushes_timed() - timed == 3, "The metric updates weren't timed"
+
+    before = counted()
+    try:
+        main.handle_message(frame[:-1], main.dispatch_index)
+        raise AssertionError("A truncated frame was accepted")
+    except icd.DecodeError:
+        pass
+    assert counted() == before, "Emits of a malformed frame were handled"
+
+
+def send(pool: list, port: int, stop_time: float):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sendto = sock.sendto
+    address = ("127.0.0.1", port)
+    while time.monotonic() < stop_time:
+        for data in pool:
+            try:
+                sendto(data, address)
+            except OSError:
+                pass
+
+
+def measure(pool: list, duration: float) -> int:
+    """
+    Returns the amount of packets handled while `pool` is being sent for `duration` seconds.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+    sock.bind(("127.0.0.1", 0))
+    receiver = BatchReceiver(sock, RECEIVE_BATCH_SIZE, 0.001, MAX_DATAGRAM_SIZE)
+    dispatch_index = main.dispatch_index
+
+    stop_time = time.monotonic() + duration
+    sender = multiprocessing.Process(target=send, args=(pool, sock.getsockname()[1], stop_time))
+    sender.start()
+    packets = 0
+    while time.monotonic() < stop_time:
+        batch = receiver.receive(0.01)
+        main.handle_batch(batch, dispatch_index)
+        packets += len(batch)
+    sender.join()
+    sock.close()
+    return packets
+
+
+def parse_args():
+    parser = ArgumentParser(description="Benchmark single-emit datagrams against frames")
+    parser.add_argument("--dictionary", type=Path, default=EXAMPLE_DICTIONARY_PATH)
+    parser.add_argument("--duration", type=float, default=3, help="Seconds of load for every format")
+    parser.add_argument("--frame-sizes", type=int, nargs="+", default=[1, 8, 32, 128],
+                        help="Records per frame (1 for single-emit datagrams)")
+    parser.add_argument("--pool-size", type=int, default=4096, help="Distinct emits to send")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    main.settings.LOG_PACKETS = False
+    check_mixed_frame()
+
+    dictionary = json.loads(arguments.dictionary.read_text())
+    main.create_metric_families(create_registry(dictionary))
+    main.loki_shipper = DiscardingShipper()
+    main.dispatch_index = main.create_dispatch_index(DictionaryIndex.from_dictionary(dictionary))
+
+    # Logs are left out, so that even the largest frames fit in a datagram
+    emits = DatagramFactory(dictionary, log_weight=0).build(arguments.pool_size)
+
+    print(f"{'format':<12} {'packets/sec':>12} {'events/sec':>12}")
+    for frame_size in arguments.frame_sizes:
+        handled = measure(build_pool(emits, frame_size), arguments.duration)
+        name = "single" if frame_size == 1 else f"frame[{frame_size}]"
+        print(f"{name:<12} {handled / arguments.duration:>12.0f} {handled * frame_size / arguments.duration:>12.0f}")
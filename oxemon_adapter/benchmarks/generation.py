@@ -0,0 +1,90 @@
+"""
+Times the dashboard generation of a very large metrics configuration, and checks its time and peak memory.
+
+The dashboards of `--entries` entries spread over `--modules` modules are generated both by building them all in
+memory before saving them, and by the streaming engine (`write_dashboards`, with 1 and `--workers` processes).
+Every run is timed, and then repeated under tracemalloc to measure its peak memory (of the main process). The
+streaming engine must stay within `--max-seconds` and `--max-peak-mb`, and a pool of workers must only be started
+for enough dashboards, and never larger than their chunks.
+"""
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from functools import partial
+from pathlib import Path
+
+from benchmarks.configure import build_metrics
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "utils"))
+import generate_grafana_dashboards_from_input_config as generator  # noqa: E402
+
+
+def generate_in_memory(monitoring_entries: dict, directory: Path):
+    dashboards = generator.convert_monitoring_entries_to_module_dashboards(monitoring_entries)
+    dashboards.append(generator.create_adapter_health_dashboard())
+    generator.save_module_dashboards(dashboards, directory)
+
+
+def generate_streaming(monitoring_entries: dict, directory: Path, workers: int):
+    for _ in generator.write_dashboards(generator.dashboard_jobs(monitoring_entries, directory), workers):
+        pass
+
+
+def measure(generate, monitoring_entries: dict) -> tuple:
+    """
+    Returns the duration (in seconds) and the peak memory (in bytes) of a generation, and the files it wrote.
+    """
+    results = []
+    for traced in (False, True):
+        directory = Path(tempfile.mkdtemp())
+        try:
+            if traced:
+                tracemalloc.start()
+            start = time.perf_counter()
+            generate(monitoring_entries, directory)
+            duration = time.perf_counter() - start
+            if traced:
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                results.append(peak)
+            else:
+                results.append(duration)
+                files = len(list(directory.iterdir()))
+        finally:
+            shutil.rmtree(directory)
+    return results[0], results[1], files
+
+
+def parse_args():
+    parser = ArgumentParser(description="Time the dashboard generation of a very large metrics configuration")
+    parser.add_argument("--entries", type=int, default=50000)
+    parser.add_argument("--modules", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=generator.DEFAULT_WORKERS)
+    parser.add_argument("--max-seconds", type=float, default=5, help="Target of the streaming generation")
+    parser.add_argument("--max-peak-mb", type=float, default=16, help="Target of the streaming generation")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    assert generator.pool_size(generator.POOL_MIN_JOBS - 1, 8) == 1, "A pool was started for a few dashboards"
+    assert generator.pool_size(generator.WORKER_CHUNK_SIZE * 5, 8) == 5, "The pool wasn't capped by the chunks"
+    assert generator.pool_size(100000, 8) == 8
+    metrics = build_metrics(arguments.entries, arguments.modules)
+    runs = {"in memory": generate_in_memory, "streaming, 1 worker": partial(generate_streaming, workers=1)}
+    if arguments.workers > 1:
+        runs[f"streaming, {arguments.workers} workers"] = partial(generate_streaming, workers=arguments.workers)
+
+    print(f"{arguments.entries} entries in {arguments.modules} modules")
+    failed = False
+    for name, generate in runs.items():
+        duration, peak, files = measure(generate, metrics)
+        assert files == arguments.modules + 1, f"{name}: wrote {files} dashboards"
+        print(f"{name:<24} {duration:>6.2f} s {peak / 2 ** 20:>8.1f} MB peak")
+        if name != "in memory" and (duration > arguments.max_seconds or peak > arguments.max_peak_mb * 2 ** 20):
+            print(f"❌ {name} missed its targets ({arguments.max_seconds} s, {arguments.max_peak_mb} MB)")
+            failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,225 @@
+"""
+Synthetic load generator for a running adapter.
+
+Blasts a mix of realistic emits over UDP at a target rate, and reports the sustained throughput, the loss rate
+and the end-to-end latency (from sending an emit until it's visible on the Prometheus `/metrics` endpoint).
+
+The latency is measured with probes: labels carrying a sequence number, sent on a dedicated (module, event) pair
+which must be configured as an `enum` in the adapter's metrics configuration. The endpoint is polled in a tight
+loop, and every probe's latency is the time until the label first shows its sequence number.
+
+Example (against `make start` with the example configuration):
+    python -m benchmarks.loadgen --dictionary ../example/oxemon_dictionary.json --rate 50000 --duration 10
+"""
+import json
+import multiprocessing
+import socket
+import statistics
+import threading
+import time
+import urllib.request
+from argparse import ArgumentParser
+from pathlib import Path
+
+import icd
+from benchmarks.datagrams import DatagramFactory, LABEL_EVENT_TYPES
+
+PACKETS_RECEIVED_SAMPLE = "oxemon_adapter_packets_received_total"
+SEND_INTERVAL = 0.001  # Senders top up their rate every millisecond
+
+
+def replace_whitespace(name):
+    return name.strip().lower().replace(" ", "_")
+
+
+def send(pool, address, rate, stop_time, sent_counter):
+    """
+    Sends datagrams from `pool` (cyclically) at `rate` datagrams/sec (0 for as fast as possible).
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sendto = sock.sendto
+    pool_size = len(pool)
+    index = 0
+    sent = 0
+    start = time.monotonic()
+    now = start
+    while now < stop_time:
+        target = int((now - start) * rate) if rate else sent + 256
+        while sent < target:
+            try:
+                sendto(pool[index], address)
+            except OSError:
+                pass  # The local buffer is full, this is counted as loss
+            sent += 1
+            index = (index + 1) % pool_size
+        if rate:
+            time.sleep(SEND_INTERVAL)
+        now = time.monotonic()
+
+    with sent_counter.get_lock():
+        sent_counter.value += sent
+
+
+def read_samples(metrics_url: str, prefixes: dict) -> dict:
+    """
+    Reads the values of the exposition lines starting with each of the given prefixes.
+    """
+    values = {}
+    with urllib.request.urlopen(metrics_url, timeout=5) as response:
+        for line in response.read().decode().splitlines():
+            for key, prefix in prefixes.items():
+                if line.startswith(prefix):
+                    values[key] = float(line[len(prefix):])
+    return values
+
+
+class LatencyProbe:
+    """
+    Sends sequence-numbered labels and measures when each of them is visible in the exposition.
+    """
+    def __init__(self, address, metrics_url: str, module: dict, event: dict, rate: float):
+        self.address = address
+        self.metrics_url = metrics_url
+        self.module = module
+        self.event = event
+        self.interval = 1 / rate
+        self.sent_times = {}
+        self.latencies = []
+        self.prefixes = {
+            "probe": probe_prefix(module, event),
+            "received": f"{PACKETS_RECEIVED_SAMPLE} ",
+        }
+        self._stopped = threading.Event()
+
+    def _send_probes(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sequence = 1
+        while not self._stopped.wait(self.interval):
+            data = bytes(icd.EmitHeader(module_id=self.module["hash"], event_id=self.event["hash"]) /
+                         icd.EmitLabel(label=sequence))
+            self.sent_times[sequence] = time.monotonic()
+            sock.sendto(data, self.address)
+            sequence += 1
+
+    def _poll(self):
+        last_seen = 0
+        while not self._stopped.is_set():
+            samples = read_samples(self.metrics_url, self.prefixes)
+            now = time.monotonic()
+            seen = int(samples.get("probe", 0))
+            if seen > last_seen and seen in self.sent_times:
+                self.latencies.append(now - self.sent_times[seen])
+                last_seen = seen
+
+    def start(self):
+        self._threads = [threading.Thread(target=self._send_probes, daemon=True),
+                         threading.Thread(target=self._poll, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+
+
+def probe_prefix(module: dict, event: dict) -> str:
+    return f'{replace_whitespace(event["string"])}{{module="{replace_whitespace(module["string"])}"}} '
+
+
+def find_probe_pair(oxemon_dictionary: dict, metrics_url: str, module_name: str, event_name: str):
+    """
+    Finds a (module, event) pair for the latency probe, by default the first label coupling which is configured
+    (that is, its metric is exposed by the adapter).
+    """
+    modules = {module["string"]: module for module in oxemon_dictionary["module_ids"]}
+    events = {event["string"]: event for event in oxemon_dictionary["event_ids"]}
+    if module_name and event_name:
+        return modules[module_name], events[event_name]
+
+    with urllib.request.urlopen(metrics_url, timeout=5) as response:
+        exposition = response.read().decode()
+    for module in modules.values():
+        for event in events.values():
+            if event.get("event_type") in LABEL_EVENT_TYPES and f"\n{probe_prefix(module, event)}" in exposition:
+                return module, event
+    raise ValueError("No configured label found for the latency probe, pass --probe-module and --probe-event")
+
+
+def percentile(values: list, fraction: float) -> float:
+    if len(values) < 2:
+        return values[0] if values else float("nan")
+    return statistics.quantiles(values, n=100, method="inclusive")[round(fraction * 100) - 1]
+
+
+def parse_args():
+    parser = ArgumentParser(description="Blast synthetic emits at an adapter and measure it")
+    parser.add_argument("--dictionary", type=Path, required=True)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1414)
+    parser.add_argument("--metrics-url", default="http://127.0.0.1:8000/metrics")
+    parser.add_argument("--rate", type=float, default=10000, help="Emits/sec (in total), 0 for as fast as possible")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of load")
+    parser.add_argument("--senders", type=int, default=1, help="Amount of sending processes")
+    parser.add_argument("--pool-size", type=int, default=10000, help="Distinct datagrams per sender")
+    parser.add_argument("--counter-weight", type=float, default=6)
+    parser.add_argument("--label-weight", type=float, default=3)
+    parser.add_argument("--log-weight", type=float, default=1)
+    parser.add_argument("--param-bits", type=int, default=16, help="Log parameters are in [0, 2 ** bits)")
+    parser.add_argument("--random-params", action="store_true",
+                        help="Send a random amount of log parameters instead of one per placeholder")
+    parser.add_argument("--probe-module", help="Module of the latency probe (must be configured as enum)")
+    parser.add_argument("--probe-event", help="Event of the latency probe (must be configured as enum)")
+    parser.add_argument("--probe-rate", type=float, default=20, help="Latency probes/sec")
+    parser.add_argument("--drain", type=float, default=2, help="Seconds to wait for the adapter to catch up")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    dictionary = json.loads(arguments.dictionary.read_text())
+    address = (arguments.host, arguments.port)
+    probe_module, probe_event = find_probe_pair(dictionary, arguments.metrics_url,
+                                                arguments.probe_module, arguments.probe_event)
+
+    pools = [
+        DatagramFactory(
+            dictionary,
+            counter_weight=arguments.counter_weight,
+            label_weight=arguments.label_weight,
+            log_weight=arguments.log_weight,
+            param_bits=arguments.param_bits,
+            exact_params=not arguments.random_params,
+            exclude=(probe_module["hash"], probe_event["hash"]),
+            seed=arguments.seed + index,
+        ).build(arguments.pool_size)
+        for index in range(arguments.senders)
+    ]
+
+    probe = LatencyProbe(address, arguments.metrics_url, probe_module, probe_event, arguments.probe_rate)
+    received_before = read_samples(arguments.metrics_url, probe.prefixes).get("received", 0)
+    sent_counter = multiprocessing.Value("q", 0)
+    stop_time = time.monotonic() + arguments.duration
+    senders = [
+        multiprocessing.Process(target=send, args=(pool, address, arguments.rate / arguments.senders, stop_time,
+                                                   sent_counter))
+        for pool in pools
+    ]
+
+    probe.start()
+    for sender in senders:
+        sender.start()
+    for sender in senders:
+        sender.join()
+    time.sleep(arguments.drain)
+    probe.stop()
+
+    received = read_samples(arguments.metrics_url, probe.prefixes).get("received", 0) - received_before
+    sent = sent_counter.value + len(probe.sent_times)
+    print(f"Sent:        {sent} datagrams ({sent / arguments.duration:.0f}/sec)")
+    print(f"Received:    {received:.0f} datagrams ({received / arguments.duration:.0f}/sec sustained)")
+    print(f"Loss:        {max(0.0, 1 - received / sent) * 100:.3f}%")
+    print(f"Latency p50: {percentile(probe.latencies, 0.5) * 1000:.2f} ms "
+          f"(over {len(probe.latencies)} of {len(probe.sent_times)} probes)")
+    print(f"Latency p99: {percentile(probe.latencies, 0.99) * 1000:.2f} ms")
@@ -0,0 +1,45 @@
+"""
+Measures the per-log rendering cost of compiled log templates, against splitting the template on every log
+(as `resolve_log` used to do), for templates with 0-16 parameters.
+"""
+import timeit
+from argparse import ArgumentParser
+
+import converter
+
+
+def render_uncompiled(log: str, params) -> str:
+    """
+    The original rendering: split the template on every call, and concatenate the result piece by piece.
+    """
+    parts = log.split("{}")
+    result = ""
+    for i in range(len(params)):
+        result += parts[i] + f"{{{params[i]}}}"
+    result += parts[-1]
+    return result
+
+
+def parse_args():
+    parser = ArgumentParser(description="Benchmark log template rendering")
+    parser.add_argument("-n", "--number", type=int, default=100000, help="Renders per measurement")
+    parser.add_argument("--max-params", type=int, default=16)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+
+    print(f"{'params':>6} {'uncompiled':>13} {'compiled':>11} {'speedup':>8}")
+    for param_count in range(arguments.max_params + 1):
+        template = "log " + " and ".join(["value {}"] * param_count) + " done"
+        params = tuple(range(1000, 1000 + param_count))
+        compiled = converter.LogTemplate(template)
+        assert compiled.render(params) == render_uncompiled(template, params)
+
+        uncompiled_time = timeit.timeit(lambda: render_uncompiled(template, params), number=arguments.number)
+        compiled_time = timeit.timeit(lambda: compiled.render(params), number=arguments.number)
+        print(f"{param_count:>6} "
+              f"{uncompiled_time / arguments.number * 1e9:>10.0f} ns "
+              f"{compiled_time / arguments.number * 1e9:>8.0f} ns "
+              f"{uncompiled_time / compiled_time:>7.2f}x")
@@ -0,0 +1,126 @@
+"""
+Times the Loki shipper against a local stub Loki (its behaviour is checked by `tests/test_loki_shipper.py`).
+
+- push: the cost of buffering a line, on the receive path.
+- batching: how long a full batch (`--batch-size` lines) waits to be shipped, and a lone line (the flush interval).
+- failures: how many pushes are attempted while Loki is down, with backoff.
+"""
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import loki_shipper
+from loki_shipper import LokiShipper
+
+
+class StubLoki:
+    """
+    A Loki push endpoint, which counts the pushes (accepted and failed), optionally failing its next requests.
+    """
+    def __init__(self):
+        self.accepted = 0
+        self.failures = []  # Statuses to answer the next requests with (instead of accepting them)
+        self.attempts = 0
+        self.updated = threading.Condition()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                with stub.updated:
+                    stub.attempts += 1
+                    status = stub.failures.pop(0) if stub.failures else 204
+                    if status < 300:
+                        stub.accepted += 1
+                    stub.updated.notify_all()
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def wait_for(self, predicate, timeout: float = 10) -> bool:
+        with self.updated:
+            return self.updated.wait_for(predicate, timeout)
+
+
+def time_push(count: int):
+    shipper = LokiShipper("http://127.0.0.1:1", batch_size=count + 1, flush_interval=60, max_pending=count)
+    start = time.perf_counter()
+    for _ in range(count):
+        shipper.push("module", "line")
+    duration = time.perf_counter() - start
+    print(f"push    : {duration / count * 1e9:.0f} ns/line")
+
+
+def time_batching(batch_size: int, interval: float):
+    stub = StubLoki()
+    shipper = LokiShipper(stub.url, batch_size=batch_size, flush_interval=interval, max_pending=batch_size * 10)
+    shipper.start()
+
+    start = time.monotonic()
+    for index in range(batch_size):
+        shipper.push(f"module {index % 3}", f"line {index}")
+    if not stub.wait_for(lambda: stub.accepted == 1):
+        print("❌ A full batch wasn't shipped")
+        sys.exit(1)
+    by_size = time.monotonic() - start
+
+    # Once the shipper has its answer, and waits again
+    time.sleep(interval / 4)
+    start = time.monotonic()
+    shipper.push("module 0", "alone")
+    if not stub.wait_for(lambda: stub.accepted == 2):
+        print("❌ A lone line wasn't shipped")
+        sys.exit(1)
+    by_interval = time.monotonic() - start
+    shipper.stop()
+    stub.server.shutdown()
+    print(f"batching: a full batch shipped after {by_size * 1000:.0f} ms, a lone line after "
+          f"{by_interval * 1000:.0f} ms (flush interval {interval * 1000:.0f} ms)")
+
+
+def time_failures(batch_size: int, interval: float):
+    loki_shipper.INITIAL_RETRY = interval
+    stub = StubLoki()
+    shipper = LokiShipper(stub.url, batch_size=batch_size, flush_interval=interval, max_pending=batch_size * 4)
+    shipper.start()
+
+    stub.failures = [500] * 1000
+    start = time.monotonic()
+    for index in range(batch_size * 6):
+        shipper.push("module", f"down {index}")
+    time.sleep(interval * 8)
+    down = time.monotonic() - start
+    attempts = stub.attempts
+
+    stub.failures.clear()
+    loki_shipper.INITIAL_RETRY = 0.5
+    shipper.stop()
+    stub.server.shutdown()
+    # Without backoff, a push would be attempted every flush interval
+    print(f"failures: {attempts} pushes in {down * 1000:.0f} ms while Loki was down "
+          f"(flush interval {interval * 1000:.0f} ms)")
+
+
+def parse_args():
+    parser = ArgumentParser(description="Time the Loki shipper against a stub Loki")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--interval-ms", type=float, default=200, help="Flush interval of the shipper")
+    parser.add_argument("--lines", type=int, default=1000000, help="Amount of lines of the push timing")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    time_push(arguments.lines)
+    time_batching(arguments.batch_size, arguments.interval_ms / 1000)
+    time_failures(arguments.batch_size, arguments.interval_ms / 1000)
@@ -0,0 +1,118 @@
+"""
+In-process micro-benchmarks of every stage of the adapter's pipeline.
+
+Results can be saved as JSON (`--output`) and compared to an earlier run (`--baseline`), so regressions can be
+tracked over time.
+"""
+import json
+import platform
+import sys
+import timeit
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+from pathlib import Path
+
+import converter
+import icd
+import main
+from coalescer import UpdateCoalescer
+from dictionary_index import DictionaryIndex
+from benchmarks.datagrams import DatagramFactory
+
+EXAMPLE_DICTIONARY_PATH = Path(__file__).resolve().parents[2] / "example" / "oxemon_dictionary.json"
+REGRESSION_THRESHOLD = 1.1
+
+
+class DiscardingShipper:
+    def push(self, module: str, line: str):
+        pass
+
+
+def create_registry(oxemon_dictionary: dict) -> dict:
+    """
+    Configures every expected coupling of the dictionary (as a counter or an enum, by its event type).
+    """
+    events = {event["string"]: event for event in oxemon_dictionary["event_ids"]}
+    registry = {}
+    for coupling in oxemon_dictionary["expected_couplings"]:
+        event_type = "counter" if events[coupling["event_id"]].get("event_type") == "counter" else "enum"
+        # Events whose names only differ in whitespace share a metric
+        entry = registry.setdefault(main.replace_whitespace(coupling["event_id"]), {"type": event_type, "modules": []})
+        entry["modules"].append(coupling["module_id"])
+    return registry
+
+
+def run_benchmarks(oxemon_dictionary: dict, number: int) -> dict:
+    main.create_metric_families(create_registry(oxemon_dictionary))
+    main.loki_shipper = DiscardingShipper()
+    main.settings.LOG_PACKETS = False
+    dispatch_index = main.create_dispatch_index(DictionaryIndex.from_dictionary(oxemon_dictionary))
+    conversion_map = dispatch_index.conversion_map
+
+    datagrams = {
+        kind: DatagramFactory(oxemon_dictionary, counter_weight=kind == "counter", label_weight=kind == "label",
+                              log_weight=kind == "log").build(1)[0]
+        for kind in ("counter", "label", "log")
+    }
+    events = {kind: converter.convert_incoming_message(message=data, conversion_map=conversion_map)
+              for kind, data in datagrams.items()}
+    records = {kind: icd.decode_message(data) for kind, data in datagrams.items()}
+    # The window is never reached during a measurement, so this measures the collecting alone
+    coalesced_index = UpdateCoalescer(window=3600).bind(dispatch_index)
+
+    cases = {}
+    for kind, data in datagrams.items():
+        cases[f"read_message[{kind}]"] = lambda data=data: icd.read_message(data)
+        cases[f"decode_message[{kind}]"] = lambda data=data: icd.decode_message(data)
+        cases[f"convert_incoming_message[{kind}]"] = \
+            lambda data=data: converter.convert_incoming_message(message=data, conversion_map=conversion_map)
+        cases[f"dispatch[{kind}]"] = lambda record=records[kind]: dispatch_index.dispatch(record)
+        cases[f"dispatch_coalesced[{kind}]"] = lambda record=records[kind]: coalesced_index.dispatch(record)
+        cases[f"push_event[{kind}]"] = lambda event=events[kind]: main.push_event(event)
+        cases[f"handle_message[{kind}]"] = lambda data=data: main.handle_message(data, dispatch_index)
+
+    results = {}
+    for name, case in cases.items():
+        # hydration is orders of magnitude slower, so it gets less repetitions
+        case_number = max(1, number // 100) if name.startswith("read_message") else number
+        best = min(timeit.repeat(case, number=case_number, repeat=5))
+        results[name] = best / case_number * 1e9
+    return results
+
+
+def parse_args():
+    parser = ArgumentParser(description="Micro-benchmark the adapter's pipeline stages")
+    parser.add_argument("--dictionary", type=Path, default=EXAMPLE_DICTIONARY_PATH)
+    parser.add_argument("-n", "--number", type=int, default=20000, help="Calls per measurement")
+    parser.add_argument("--output", type=Path, help="Save the results to this JSON file")
+    parser.add_argument("--baseline", type=Path, help="Compare to the results saved in this JSON file")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    results = run_benchmarks(json.loads(arguments.dictionary.read_text()), arguments.number)
+    baseline = json.loads(arguments.baseline.read_text())["results"] if arguments.baseline else {}
+
+    regressions = []
+    print(f"{'benchmark':<36} {'ns/call':>10} {'baseline':>10}")
+    for benchmark_name, nanoseconds in results.items():
+        previous = baseline.get(benchmark_name)
+        comparison = ""
+        if previous:
+            comparison = f"{previous:>10.0f} ({nanoseconds / previous:.2f}x)"
+            if nanoseconds > previous * REGRESSION_THRESHOLD:
+                regressions.append(benchmark_name)
+        print(f"{benchmark_name:<36} {nanoseconds:>10.0f} {comparison}")
+
+    if arguments.output:
+        arguments.output.write_text(json.dumps({
+            "time": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "results": results,
+        }, indent=2))
+
+    if regressions:
+        print(f"Regressions (over {REGRESSION_THRESHOLD:.0%} of the baseline): {', '.join(regressions)}")
+        sys.exit(1)
@@ -0,0 +1,157 @@
+"""
+Checks and times the rate limits of sources and of (module, event) couplings.
+
+- A flooding source sends `--flood` datagrams interleaved with those of `--sources` well-behaved ones, through the
+  batched and the single receive paths. Every datagram of the well-behaved sources must be handled, the flood must
+  be shed down to its limit and counted by its source, and handling the flood must be cheaper than without the
+  limit (its datagrams are shed before they're decoded).
+- A limited coupling is shed down to its limit, while the same event of another module isn't.
+- A token bucket allows its rate (and burst) over time, and the memory of the sources' buckets (and their series of
+  shed datagrams) stays bounded with many source addresses.
+"""
+import time
+from argparse import ArgumentParser
+
+from prometheus_client import REGISTRY
+
+import icd
+import main
+import rate_limits
+from adapter_metrics import SHED_DATAGRAMS
+from coalescer import UpdateCoalescer
+from dictionary_index import DictionaryIndex
+
+MODULES = [{"string": "flood", "hash": 1}, {"string": "good", "hash": 2}]
+EVENT = {"string": "emits", "hash": 10, "event_type": "counter"}
+DICTIONARY = {"module_ids": MODULES, "event_ids": [EVENT], "misc_conversions": [], "expected_couplings": []}
+FLOODER = ("10.0.0.66", 5000)
+SOURCE_LIMIT = {"rate": 1000, "burst": 1000}
+BATCH_SIZE = 256
+
+
+def datagram(module: dict) -> bytes:
+    return bytes(icd.EmitHeader(module_id=module["hash"], event_id=EVENT["hash"]) / icd.EmitCounter(counter_value=1))
+
+
+def configure(registry: dict):
+    main.create_metric_families(registry)
+    main.load_rate_limits(registry)
+    main.dispatch_index = main.create_dispatch_index(DictionaryIndex.from_dictionary(DICTIONARY))
+
+
+def emitted(module: str) -> float:
+    return REGISTRY.get_sample_value("emits_total", {"module": module}) or 0
+
+
+def shed(source: str) -> float:
+    return REGISTRY.get_sample_value("oxemon_adapter_shed_datagrams_total", {"source": source}) or 0
+
+
+def shed_series() -> int:
+    return sum(sample.name.endswith("_total") for sample in SHED_DATAGRAMS.collect()[0].samples)
+
+
+def traffic(flood: int, sources: int) -> list:
+    flood_datagram, good_datagram = datagram(MODULES[0]), datagram(MODULES[1])
+    interval = flood // sources
+    return [(good_datagram, (f"10.0.1.{index // interval}", 6000)) if index % interval == 0 else
+            (flood_datagram, FLOODER) for index in range(flood)]
+
+
+def run_batched(datagrams: list) -> float:
+    coalescer = UpdateCoalescer(0)
+    start = time.perf_counter()
+    for index in range(0, len(datagrams), BATCH_SIZE):
+        batch = main.shed_flooding_sources(datagrams[index:index + BATCH_SIZE])
+        main.handle_batch(batch, coalescer.bind(main.dispatch_index))
+    return time.perf_counter() - start
+
+
+def run_single(datagrams: list) -> float:
+    coalescer = UpdateCoalescer(0)
+    start = time.perf_counter()
+    for data, addr in datagrams:
+        main.handle_datagram(data, addr, coalescer)
+    return time.perf_counter() - start
+
+
+def check_flood(flood: int, sources: int):
+    registry = {EVENT["string"]: {"type": "counter", "modules": [module["string"] for module in MODULES]}}
+    datagrams = traffic(flood, sources)
+    good = sum(1 for _, addr in datagrams if addr != FLOODER)
+
+    for name, run in (("batched", run_batched), ("single", run_single)):
+        configure(registry)
+        flood_before = emitted("flood")
+        unlimited = run(datagrams)
+        assert emitted("flood") - flood_before == flood - good, "Datagrams were shed without limits"
+
+        configure(dict(registry, source_rate_limits={"default": SOURCE_LIMIT}))
+        good_before, flood_before, shed_before = emitted("good"), emitted("flood"), shed(FLOODER[0])
+        duration = run(datagrams)
+        flood_handled = emitted("flood") - flood_before
+        flood_shed = shed(FLOODER[0]) - shed_before
+        assert emitted("good") - good_before == good, "Datagrams of well-behaved sources were shed"
+        assert flood_handled + flood_shed == flood - good, "Flood datagrams were neither handled nor shed"
+        limit = SOURCE_LIMIT["burst"] + SOURCE_LIMIT["rate"] * duration
+        assert flood_handled <= limit + 1, f"The flood wasn't limited ({flood_handled:.0f} handled)"
+        assert duration < unlimited, "Shedding wasn't cheaper than handling"
+        print(f"{name:<7}: {flood / unlimited:>8.0f} datagrams/sec without limits, {flood / duration:>8.0f} with "
+              f"({flood_handled:.0f} of the flood handled and {flood_shed:.0f} shed, all {good} others handled)")
+
+
+def check_coupling(emits: int):
+    registry = {EVENT["string"]: {"type": "counter", "modules": ["flood", "good"],
+                                  "rate_limits": {"flood": {"rate": 100, "burst": 50}}}}
+    configure(registry)
+    records = icd.decode_messages(datagram(MODULES[0])) * emits + icd.decode_messages(datagram(MODULES[1])) * emits
+    flood_before, good_before = emitted("flood"), emitted("good")
+    start = time.perf_counter()
+    for record in records:
+        main.dispatch_index.dispatch(record)
+    duration = time.perf_counter() - start
+    handled = emitted("flood") - flood_before
+    assert handled <= 50 + 100 * duration + 1, f"The coupling wasn't limited ({handled:.0f} handled)"
+    assert emitted("good") - good_before == emits, "Another module of the event was limited"
+    shed_emits = REGISTRY.get_sample_value("oxemon_adapter_shed_emits_total", {"module": "flood", "event": "emits"})
+    assert handled + shed_emits >= emits, "Emits were neither handled nor counted as shed"
+    print(f"coupling limit: {handled:.0f} of {emits} handled, the other module's all handled, "
+          f"{duration / len(records) * 1e9:.0f} ns/emit")
+
+
+def check_bucket():
+    bucket = rate_limits.TokenBucket(1000, 10, SHED_DATAGRAMS, {"source": "bucket"})
+    allowed = 0
+    start = time.monotonic()
+    while time.monotonic() - start < 0.5:
+        allowed += bucket.take()
+        time.sleep(0.0001)
+    expected = 10 + 1000 * (time.monotonic() - start)
+    assert abs(allowed - expected) <= 0.05 * expected, f"Allowed {allowed} instead of {expected:.0f}"
+
+    # Every source sends over its burst, so that each has a series of shed datagrams
+    limiter = rate_limits.SourceLimiter({"default": {"rate": 1, "burst": 1}})
+    before = shed_series()
+    for index in range(rate_limits.MAX_TRACKED_SOURCES * 3):
+        addr = (f"10.{index >> 16}.{index >> 8 & 255}.{index & 255}", 1)
+        limiter.allow(addr)
+        limiter.allow(addr)
+    assert len(limiter._buckets) <= rate_limits.MAX_TRACKED_SOURCES, "The sources' buckets weren't bounded"
+    series = shed_series() - before
+    assert series <= rate_limits.MAX_TRACKED_SOURCES, f"{series} series of shed datagrams for tracked sources"
+
+
+def parse_args():
+    parser = ArgumentParser(description="Check and time the rate limits of sources and couplings")
+    parser.add_argument("--flood", type=int, default=200000, help="Datagrams of the flooding source")
+    parser.add_argument("--sources", type=int, default=50, help="Amount of well-behaved sources")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    main.settings.LOG_PACKETS = False
+    check_flood(arguments.flood, arguments.sources)
+    check_coupling(arguments.flood // 10)
+    check_bucket()
+    print("Checks passed")
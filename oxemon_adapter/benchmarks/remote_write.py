@@ -0,0 +1,241 @@
+"""
+Checks and times the remote-write sink against a local stub receiver.
+
+The stub decodes every `WriteRequest` (snappy and protobuf, independently of the sink's encoders) and keeps the
+latest value of every series, optionally failing its first requests.
+- The snappy encoder is checked to round-trip payloads (a generated `WriteRequest`, random and repetitive data),
+  and its ratio and speed are reported.
+- The sink pushes the metrics of `--events` x `--modules` couplings: first all of them, then only the changed ones,
+  over a single (reused) connection, and the time from an update until the stub has it is measured.
+- Overloaded pushes (503) are retried with backoff, while rejected ones (400) wait for the next flush.
+"""
+import os
+import struct
+import threading
+import time
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import main
+import remote_write
+from remote_write import RemoteWriteSink
+
+
+def snappy_decompress(data: bytes) -> bytes:
+    length, position = _read_varint(data, 0)
+    output = bytearray()
+    while position < len(data):
+        tag = data[position]
+        kind = tag & 3
+        if kind == 0:
+            size = tag >> 2
+            position += 1
+            if size >= 60:
+                extra = size - 59
+                size = int.from_bytes(data[position:position + extra], "little")
+                position += extra
+            size += 1
+            output += data[position:position + size]
+            position += size
+            continue
+        if kind == 1:
+            size, offset = 4 + (tag >> 2 & 7), (tag >> 5) << 8 | data[position + 1]
+            position += 2
+        elif kind == 2:
+            size, offset = (tag >> 2) + 1, struct.unpack_from("<H", data, position + 1)[0]
+            position += 3
+        else:
+            size, offset = (tag >> 2) + 1, struct.unpack_from("<I", data, position + 1)[0]
+            position += 5
+        assert 0 < offset <= len(output), f"Invalid copy offset {offset}"
+        for _ in range(size):
+            output.append(output[-offset])
+    assert len(output) == length, f"Decompressed {len(output)} bytes instead of {length}"
+    return bytes(output)
+
+
+def _read_varint(data: bytes, position: int) -> tuple:
+    value = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if byte < 0x80:
+            return value, position
+
+
+def _fields(data: bytes):
+    """
+    Yields the `(field number, value)` of a protobuf message (only the wire types remote-write uses).
+    """
+    position = 0
+    while position < len(data):
+        key, position = _read_varint(data, position)
+        wire_type = key & 7
+        if wire_type == 0:
+            value, position = _read_varint(data, position)
+        elif wire_type == 1:
+            value, position = data[position:position + 8], position + 8
+        elif wire_type == 2:
+            size, position = _read_varint(data, position)
+            value, position = data[position:position + size], position + size
+        else:
+            raise ValueError(f"Unexpected wire type {wire_type}")
+        yield key >> 3, value
+
+
+def decode_write_request(data: bytes) -> list:
+    """
+    Returns `(labels, value, timestamp)` of every sample.
+    """
+    samples = []
+    for _, series in _fields(data):
+        labels, series_samples = {}, []
+        for field, value in _fields(series):
+            if field == 1:
+                label = dict(_fields(value))
+                labels[label[1].decode()] = label[2].decode()
+            else:
+                sample = dict(_fields(value))
+                series_samples.append((struct.unpack("<d", sample[1])[0], sample[2]))
+        assert list(labels) == sorted(labels), f"Labels aren't sorted: {list(labels)}"
+        samples.extend((labels, value, timestamp) for value, timestamp in series_samples)
+    return samples
+
+
+class StubReceiver:
+    """
+    A remote-write receiver, which keeps the latest value of every series.
+    """
+    def __init__(self):
+        self.values = {}
+        self.requests = []  # The amount of samples in every accepted request
+        self.connections = 0
+        self.failures = []  # Statuses to answer the next requests with (instead of accepting them)
+        self.attempts = 0
+        self.updated = threading.Condition()
+
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, so that connection reuse can be seen
+
+            def setup(self):
+                super().setup()
+                receiver.connections += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status: int):
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                receiver.attempts += 1
+                if receiver.failures:
+                    return self._reply(receiver.failures.pop(0))
+                assert self.headers["Content-Encoding"] == "snappy"
+                assert self.headers["Content-Type"] == "application/x-protobuf"
+                samples = decode_write_request(snappy_decompress(body))
+                with receiver.updated:
+                    for labels, value, _ in samples:
+                        receiver.values[tuple(sorted(labels.items()))] = value
+                    receiver.requests.append(len(samples))
+                    receiver.updated.notify_all()
+                self._reply(204)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/api/v1/write"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def wait_for(self, predicate, timeout: float = 10) -> bool:
+        with self.updated:
+            return self.updated.wait_for(predicate, timeout)
+
+    def value(self, name: str, module: str):
+        return self.values.get((("__name__", name), ("module", module)))
+
+
+def check_snappy(events: int, modules: int):
+    series = [(remote_write.encode_labels((f"event_{event}_total", (("module", f"module_{module}"),))), event)
+              for event in range(events) for module in range(modules)]
+    payloads = {
+        "write request": remote_write.encode_write_request(series, int(time.time() * 1000)),
+        "random": os.urandom(100000),
+        "repetitive": b"abcd" * 50000 + bytes(range(256)) * 100,
+        "short": b"abc",
+        "empty": b"",
+    }
+    for name, payload in payloads.items():
+        start = time.perf_counter()
+        compressed = remote_write.snappy_block_compress(payload)
+        duration = time.perf_counter() - start
+        assert snappy_decompress(compressed) == payload, f"The {name} payload didn't round-trip"
+        if len(payload) > 1000:
+            print(f"snappy, {name:<14}: {len(payload) / 1024:>7.0f} KB -> {len(compressed) / 1024:>6.0f} KB "
+                  f"in {duration * 1000:>6.1f} ms")
+
+
+def check_sink(events: int, modules: int, interval: float):
+    main.create_metric_families({
+        f"event {event}": {"type": "counter" if event % 2 else "gauge",
+                           "modules": [f"module {module}" for module in range(modules)]}
+        for event in range(events)
+    })
+    receiver = StubReceiver()
+    sink = RemoteWriteSink(receiver.url, main.collect_emitted_metrics, flush_interval=interval, max_retries=3)
+    series = events * modules
+    start = time.perf_counter()
+    sink.start()
+    assert receiver.wait_for(lambda: len(receiver.values) == series), "Not every series was pushed"
+    print(f"sink, first push      : {series} series in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    latencies = []
+    for round_number in range(1, 11):
+        main.metric_instances["event_1"]["module_0"].inc()
+        main.metric_instances["event_0"]["module_1"].set(round_number)
+        start = time.perf_counter()
+        assert receiver.wait_for(lambda: receiver.value("event_1_total", "module_0") == round_number
+                                 and receiver.value("event_0", "module_1") == round_number), "An update wasn't pushed"
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    print(f"sink, update latency  : median {latencies[len(latencies) // 2] * 1000:.0f} ms, "
+          f"max {latencies[-1] * 1000:.0f} ms (flush interval {interval * 1000:.0f} ms)")
+    assert max(receiver.requests[1:]) <= 2, f"Unchanged series were pushed again: {receiver.requests}"
+    assert receiver.connections == 1, f"The sink opened {receiver.connections} connections"
+
+    # Overload is retried, until it succeeds
+    remote_write.INITIAL_RETRY = 0.01
+    receiver.failures = [503, 503, 429]
+    main.metric_instances["event_1"]["module_0"].inc()
+    assert receiver.wait_for(lambda: receiver.value("event_1_total", "module_0") == 11), "A retried push was lost"
+    assert not receiver.failures
+
+    # A rejected push isn't retried, but its series are pushed again on the next flush
+    receiver.failures = [400]
+    attempts = receiver.attempts
+    main.metric_instances["event_1"]["module_0"].inc()
+    assert receiver.wait_for(lambda: receiver.value("event_1_total", "module_0") == 12), "A rejected update was lost"
+    assert receiver.attempts == attempts + 2, f"A rejected push was retried ({receiver.attempts - attempts} pushes)"
+    sink.stop()
+    receiver.server.shutdown()
+
+
+def parse_args():
+    parser = ArgumentParser(description="Check and time the remote-write sink against a stub receiver")
+    parser.add_argument("--events", type=int, default=100)
+    parser.add_argument("--modules", type=int, default=100)
+    parser.add_argument("--interval-ms", type=float, default=100, help="Flush interval of the sink")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    main.settings.LOG_PACKETS = False
+    check_snappy(arguments.events, arguments.modules)
+    check_sink(arguments.events, arguments.modules, arguments.interval_ms / 1000)
+    print("Checks passed")
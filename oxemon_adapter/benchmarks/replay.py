@@ -0,0 +1,197 @@
+"""
+Checks and times capturing datagrams and replaying them.
+
+A capture of realistic datagrams (spread over `--span` seconds, from a few sources) is written, and it's checked
+that it reads back exactly, that a capture which was cut mid-record is read (and appended to) up to its last
+complete record, and that datagrams received in the same batch keep their own arrival times. It's then replayed
+in-process at max speed (through the adapter's pipeline), and over UDP to a local socket at max speed and
+`--speed` times faster than it was captured, where every datagram must arrive in order and the paced replay must
+take `span / speed`.
+"""
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import dictionary_index
+import main
+import replay
+import yaml
+from benchmarks.datagrams import DatagramFactory
+from benchmarks.pipeline import EXAMPLE_DICTIONARY_PATH, create_registry
+from capture import CaptureReader, CaptureWriter, RECORD_HEADER
+from receiver import BatchReceiver
+
+BATCH_SIZE = 256
+SOURCES = [("10.0.0.1", 5000), ("10.0.0.2", 5001), ("::1", 6000)]
+PACING_TOLERANCE = 0.1  # Of the expected duration
+
+
+def build_capture(path: Path, datagrams: list, span: float) -> list:
+    """
+    Captures the datagrams (in batches, evenly spread over `span` seconds), returns the expected records and
+    prints the capturing overhead.
+    """
+    records = []
+    base = time.time_ns()
+    step = int(span * 1e9 / len(datagrams))
+    writer = CaptureWriter(path, max_bytes=2 ** 40)
+    start = time.perf_counter()
+    for index in range(0, len(datagrams), BATCH_SIZE):
+        batch = [(data, SOURCES[(index + offset) % len(SOURCES)])
+                 for offset, data in enumerate(datagrams[index:index + BATCH_SIZE])]
+        timestamps = [base + (index + offset) * step for offset in range(len(batch))]
+        writer.write_batch(batch, timestamps)
+        records.extend((timestamp, addr, data) for (data, addr), timestamp in zip(batch, timestamps))
+    writer.close()
+    duration = time.perf_counter() - start
+    print(f"captured {len(datagrams)} datagrams ({path.stat().st_size / 2 ** 20:.1f} MB) in {duration:.2f}s, "
+          f"{duration / len(datagrams) * 1e9:.0f} ns/datagram")
+    return records
+
+
+def check_read_back(path: Path, records: list):
+    with CaptureReader(path) as reader:
+        read = [(timestamp, addr, bytes(data)) for timestamp, addr, data in reader]
+    assert read == records, "The capture didn't read back as it was written"
+
+
+def check_truncated(path: Path, records: list):
+    truncated = path.with_name("truncated.oxcap")
+    content = path.read_bytes()
+    truncated.write_bytes(content[:len(content) - len(records[-1][2]) // 2 - 1])
+    with CaptureReader(truncated) as reader:
+        assert sum(1 for _ in reader) == len(records) - 1, "A truncated capture wasn't read up to its last record"
+
+    timestamp, addr, data = records[-1]
+    writer = CaptureWriter(truncated, max_bytes=2 ** 40)
+    writer.write(data, addr, timestamp)
+    writer.close()
+    assert truncated.read_bytes() == content, "Appending to a truncated capture didn't continue from its last record"
+
+    writer = CaptureWriter(truncated, max_bytes=len(content) + RECORD_HEADER.size)
+    writer.write(data, addr, timestamp)
+    assert writer.full and os.path.getsize(truncated) == len(content), "The capture grew beyond its maximal size"
+    writer.close()
+
+
+def check_arrival_times(path: Path, datagrams: list):
+    """
+    Datagrams sent a few milliseconds apart, and received in a single batch, are captured with their own arrival
+    times.
+    """
+    gap = 0.005
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    burst = datagrams[:5]
+    receiver = BatchReceiver(sock, len(burst), max_latency=1, max_datagram_size=65535, timestamps=True)
+
+    def send():
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+            for data in burst:
+                sender.sendto(data, sock.getsockname())
+                time.sleep(gap)
+
+    sender = threading.Thread(target=send)
+    sender.start()
+    batch = receiver.receive(timeout=1)
+    sender.join()
+    assert len(batch) == len(burst) and len(receiver.timestamps) == len(burst), "The burst wasn't one batch"
+
+    writer = CaptureWriter(path, max_bytes=2 ** 40)
+    writer.write_batch(batch, receiver.timestamps)
+    writer.close()
+    sock.close()
+    with CaptureReader(path) as reader:
+        timestamps = [timestamp for timestamp, _, _ in reader]
+    gaps = [(later - earlier) / 1e9 for earlier, later in zip(timestamps, timestamps[1:])]
+    assert min(gaps) >= gap * 0.8, f"The datagrams of a batch weren't captured with their arrival times: {gaps}"
+
+
+def write_config(directory: Path, oxemon_dictionary: dict):
+    content = json.dumps(oxemon_dictionary).encode()
+    (directory / "oxemon_dictionary.json").write_bytes(content)
+    (directory / "oxemon_dictionary.idx").write_bytes(
+        dictionary_index.compile_dictionary(oxemon_dictionary, dictionary_index.dictionary_source_hash(content)))
+    (directory / "event_registry.yaml").write_text(yaml.safe_dump(create_registry(oxemon_dictionary)))
+
+
+def replay_to_socket(path: Path, speed: float, expected: list) -> float:
+    """
+    Replays the capture over UDP to a local socket, and checks that every datagram arrived, in order.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 2 ** 26)
+    sock.bind(("127.0.0.1", 0))
+    sock.settimeout(1)
+    received = []
+
+    def receive():
+        try:
+            while len(received) < len(expected):
+                received.append(sock.recv(65535))
+        except socket.timeout:
+            pass
+
+    receiver = threading.Thread(target=receive)
+    receiver.start()
+    with CaptureReader(path) as reader:
+        start = time.perf_counter()
+        replay.replay_udp(reader, speed, sock.getsockname())
+        duration = time.perf_counter() - start
+    receiver.join()
+    sock.close()
+    assert received == expected, f"{len(received)} of {len(expected)} datagrams arrived (or out of order)"
+    return duration
+
+
+def parse_args():
+    parser = ArgumentParser(description="Check and time capturing datagrams and replaying them")
+    parser.add_argument("--datagrams", type=int, default=200000)
+    parser.add_argument("--span", type=float, default=20, help="Seconds over which the datagrams were captured")
+    parser.add_argument("--speed", type=float, default=10, help="Speed of the paced replay")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    main.settings.LOG_PACKETS = False
+    oxemon_dictionary = json.loads(EXAMPLE_DICTIONARY_PATH.read_text())
+    datagrams = DatagramFactory(oxemon_dictionary).build(arguments.datagrams)
+
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        capture_path = directory / "capture.oxcap"
+        records = build_capture(capture_path, datagrams, arguments.span)
+        check_read_back(capture_path, records)
+        check_truncated(capture_path, records)
+        check_arrival_times(directory / "burst.oxcap", datagrams)
+
+        write_config(directory, oxemon_dictionary)
+        with CaptureReader(capture_path) as capture_reader:
+            start = time.perf_counter()
+            handled = replay.replay_in_process(capture_reader, 0, directory)
+            duration = time.perf_counter() - start
+        assert handled == len(datagrams), f"Handled {handled} of {len(datagrams)} datagrams"
+        print(f"in-process, max speed : {duration:.2f}s ({handled / duration:.0f} datagrams/sec)")
+
+        # Loopback may drop a flood, so the UDP replays are checked with a small part of the capture
+        udp_count = min(len(datagrams), 20000)
+        udp_span = arguments.span * udp_count / len(datagrams)
+        udp_path = directory / "udp.oxcap"
+        udp_records = build_capture(udp_path, datagrams[:udp_count], udp_span)
+        expected = [data for _, _, data in udp_records]
+
+        duration = replay_to_socket(udp_path, 0, expected)
+        print(f"udp, max speed        : {duration:.2f}s ({udp_count / duration:.0f} datagrams/sec)")
+
+        duration = replay_to_socket(udp_path, arguments.speed, expected)
+        # The last batch is sent at (span - its own share) / speed
+        expected_duration = (udp_records[-1][0] - udp_records[0][0]) / 1e9 / arguments.speed
+        print(f"udp, {arguments.speed:g}x{'':<14}: {duration:.2f}s (expected {expected_duration:.2f}s)")
+        assert abs(duration - expected_duration) <= PACING_TOLERANCE * expected_duration, "The replay wasn't paced"
+    print("Checks passed")
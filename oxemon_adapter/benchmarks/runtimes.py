@@ -0,0 +1,124 @@
+"""
+Compares the adapter's runtimes (`OXEMON_RUNTIME`): the threaded receive loops (`single` and `batched`) and asyncio.
+
+Every runtime runs the whole adapter in a subprocess (as `benchmarks.startup` does, against a fake Grafana), and is
+measured for:
+- Latency: the time from sending a counter until its new value is visible on `/metrics` (median and p99 of
+  `--probes` probes, one at a time).
+- Idle wakeups: the context switches of all the adapter's threads per second, while no traffic arrives.
+- Stop: the time from SIGTERM until the process exited.
+
+With workers (`OXEMON_WORKERS`), the supervising process must not have started any thread (it forks the workers),
+and only its own wakeups are counted.
+"""
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import icd
+from benchmarks.dashboards import FakeGrafana
+from benchmarks.startup import ADAPTER_DIRECTORY, EVENT, METRIC_SAMPLE, MODULE, free_port, read, write_configuration
+
+RUNTIMES = {
+    "threads, single": {"OXEMON_RUNTIME": "threads", "OXEMON_RECEIVE_MODE": "single"},
+    "threads, batched": {"OXEMON_RUNTIME": "threads", "OXEMON_RECEIVE_MODE": "batched"},
+    "asyncio": {"OXEMON_RUNTIME": "asyncio"},
+    "threads, 2 workers": {"OXEMON_RUNTIME": "threads", "OXEMON_RECEIVE_MODE": "batched", "OXEMON_WORKERS": "2"},
+}
+READY_TIMEOUT = 30
+
+
+def counter_value(metrics_url: str) -> float:
+    exposition = read(f"{metrics_url}/metrics") or ""
+    if METRIC_SAMPLE not in exposition:
+        return 0
+    return float(exposition.split(METRIC_SAMPLE)[1].split()[0])
+
+
+def context_switches(pid: int) -> int:
+    switches = 0
+    for task in Path(f"/proc/{pid}/task").iterdir():
+        try:
+            status = (task / "status").read_text()
+        except FileNotFoundError:
+            continue  # The thread exited
+        # Both the voluntary and the nonvoluntary ones
+        switches += sum(int(line.split()[1]) for line in status.splitlines() if "ctxt_switches:" in line)
+    return switches
+
+
+def measure(environment: dict, probes: int, idle: float) -> dict:
+    grafana = FakeGrafana(latency=0)
+    grafana.start()
+    port, metrics_port = free_port(socket.SOCK_DGRAM), free_port(socket.SOCK_STREAM)
+    metrics_url = f"http://127.0.0.1:{metrics_port}"
+    data = bytes(icd.EmitHeader(module_id=MODULE["hash"], event_id=EVENT["hash"]) / icd.EmitCounter(counter_value=1))
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        write_configuration(Path(directory) / "config")
+        adapter = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.startup", "--serve", "--port", str(port),
+             "--metrics-port", str(metrics_port), "--grafana-url", grafana.url],
+            cwd=directory,
+            env=dict(os.environ, PYTHONPATH=str(ADAPTER_DIRECTORY), **environment),
+            stdout=subprocess.DEVNULL,
+        )
+        try:
+            deadline = time.monotonic() + READY_TIMEOUT
+            while '"ready": true' not in (read(f"{metrics_url}/ready") or ""):
+                assert time.monotonic() < deadline and adapter.poll() is None, "The adapter didn't become ready"
+                time.sleep(0.05)
+            if int(environment.get("OXEMON_WORKERS", 1)) > 1:
+                threads = len(list(Path(f"/proc/{adapter.pid}/task").iterdir()))
+                assert threads == 1, f"The supervising process forks its workers with {threads} threads"
+
+            latencies = []
+            for expected in range(1, probes + 1):
+                start = time.perf_counter()
+                sock.sendto(data, ("127.0.0.1", port))
+                while counter_value(metrics_url) < expected:
+                    assert time.perf_counter() - start < 5, "A probe wasn't handled"
+                latencies.append(time.perf_counter() - start)
+            latencies.sort()
+            results["latency p50 (ms)"] = statistics.median(latencies) * 1000
+            results["latency p99 (ms)"] = latencies[int(len(latencies) * 0.99)] * 1000
+
+            before = context_switches(adapter.pid)
+            time.sleep(idle)
+            results["idle wakeups/sec"] = (context_switches(adapter.pid) - before) / idle
+
+            start = time.perf_counter()
+            adapter.send_signal(signal.SIGTERM)
+            adapter.wait(timeout=30)
+            results["stop (ms)"] = (time.perf_counter() - start) * 1000
+        finally:
+            if adapter.poll() is None:
+                adapter.kill()
+                adapter.wait()
+            grafana.stop()
+    return results
+
+
+def parse_args():
+    parser = ArgumentParser(description="Compare the latency, idle wakeups and stop time of the adapter's runtimes")
+    parser.add_argument("--probes", type=int, default=200)
+    parser.add_argument("--idle", type=float, default=5, help="Seconds without traffic to count wakeups over")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    rows = {name: measure(environment, arguments.probes, arguments.idle) for name, environment in RUNTIMES.items()}
+    columns = list(next(iter(rows.values())))
+    print(f"{'':<18}" + "".join(f"{column:>20}" for column in columns))
+    for name, results in rows.items():
+        print(f"{name:<18}" + "".join(f"{results[column]:>20.1f}" for column in columns))
@@ -0,0 +1,112 @@
+"""
+Compares the memory and the scrape latency of the metric stores (`OXEMON_METRICS_STORE`) with many series.
+
+For every series count, the series are spread over families of `--modules-per-event` modules each (like the
+metrics generated from an event registry), every series gets a value, and then the memory they take and the time
+it takes to render the text exposition are measured.
+
+Beforehand, the compact store's exposition is checked to be the same as prometheus_client's (but its `_created`
+samples), including for counters whose names already end with `_total` and for labels that must be escaped.
+"""
+import gc
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, generate_latest
+
+from compact_metrics import CompactCounter, CompactGauge, CompactMetricStore
+
+
+def create_prometheus_client_series(event_count: int, modules: list):
+    registry = CollectorRegistry()
+    children = []
+    for index in range(event_count):
+        if index % 2:
+            family = Counter(f"event_{index}", f"event {index}", ["module"], registry=registry)
+        else:
+            family = Gauge(f"event_{index}", f"event {index}", ["module"], registry=registry)
+        children.extend(family.labels(module=module) for module in modules)
+    return (lambda: generate_latest(registry)), children
+
+
+def create_compact_series(event_count: int, modules: list):
+    store = CompactMetricStore()
+    children = []
+    for index in range(event_count):
+        family_class = CompactCounter if index % 2 else CompactGauge
+        family = family_class(f"event_{index}", f"event {index}", store)
+        children.extend(family.labels(module=module) for module in modules)
+    return (lambda: store.render().encode()), children
+
+
+STORES = {
+    "prometheus_client": create_prometheus_client_series,
+    "compact": create_compact_series,
+}
+
+
+def check_exposition():
+    registry, store = CollectorRegistry(), CompactMetricStore()
+    families = [("requests", "Requests", "counter"), ("errors_total", "Errors", "counter"),
+                ("temperature", "Temperature\nin \\ degrees", "gauge")]
+    modules = ["server", 'quoted "module"', "back\\slash"]
+    for name, documentation, kind in families:
+        metric_class, compact_class = (Counter, CompactCounter) if kind == "counter" else (Gauge, CompactGauge)
+        metric = metric_class(name, documentation, ["module"], registry=registry)
+        compact = compact_class(name, documentation, store)
+        for value, module in enumerate(modules):
+            for family in (metric, compact):
+                child = family.labels(module=module)
+                child.inc(value + 0.5) if kind == "counter" else child.set(value - 0.25)
+    expected = "".join(line + "\n" for line in generate_latest(registry).decode().splitlines()
+                       if "_created" not in line)
+    rendered = store.render()
+    assert rendered == expected, f"The compact exposition differs:\n{rendered}\ninstead of:\n{expected}"
+    assert "errors_total_total" not in rendered
+
+
+def measure(create_series, series_count: int, modules_per_event: int, repeat: int) -> tuple:
+    """
+    Returns the memory the series take (in bytes), the best scrape time (in seconds) and the exposition's size.
+    """
+    modules = [f"module_{index}" for index in range(modules_per_event)]
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    render, children = create_series(series_count // modules_per_event, modules)
+    for value, child in enumerate(children):
+        if hasattr(child, "inc"):
+            child.inc(value)
+        else:
+            child.set(value)
+    gc.collect()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        exposition = render()
+        durations.append(time.perf_counter() - start)
+    return after - before, min(durations), len(exposition)
+
+
+def parse_args():
+    parser = ArgumentParser(description="Benchmark the memory and scrape latency of the metric stores")
+    parser.add_argument("--series", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--modules-per-event", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5, help="Scrapes per measurement (the best is shown)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    check_exposition()
+    print(f"{'store':<18} {'series':>7} {'memory':>10} {'per series':>11} {'scrape':>10} {'exposition':>11}")
+    for series in arguments.series:
+        for store_name, create in STORES.items():
+            memory, scrape, size = measure(create, series, arguments.modules_per_event, arguments.repeat)
+            print(f"{store_name:<18} {series:>7} {memory / 2 ** 20:>7.1f} MB {memory / series:>9.0f} B "
+                  f"{scrape * 1000:>7.1f} ms {size / 2 ** 20:>8.1f} MB")
+    print("Checks passed")
@@ -0,0 +1,141 @@
+"""
+Measures how soon a starting adapter accepts packets, while Grafana is still booting.
+
+The adapter is started in a subprocess (with a temporary configuration, and a fake Grafana which only becomes
+healthy after `--grafana-boot` seconds), while a sender emits a counter every few milliseconds. The timeline since
+the adapter's process was spawned is reported: the first accepted packet (visible on `/metrics`), the readiness of
+ingestion (`/ready`) and the end of the dashboards' provisioning.
+"""
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from argparse import ArgumentParser
+from pathlib import Path
+
+import icd
+from benchmarks.dashboards import FakeGrafana
+
+ADAPTER_DIRECTORY = Path(__file__).resolve().parent.parent
+MODULE = {"string": "startup", "hash": 1}
+EVENT = {"string": "startup counter", "hash": 2, "event_type": "counter"}
+METRIC_SAMPLE = 'startup_counter_total{module="startup"} '
+SEND_INTERVAL = 0.002
+POLL_INTERVAL = 0.005
+INTERNAL_HELP = "Internal, used to run the adapter under test"
+
+
+def serve(port: int, metrics_port: int, grafana_url: str):
+    """
+    Runs the whole adapter (from a directory with a configuration), against the given Grafana.
+    """
+    os.environ["OXEMON_LOG_PACKETS"] = "0"
+    import grafana_api_handling
+    import main
+    import upload_dashboards
+
+    main.LISTEN_PORT = port
+    main.METRICS_PORT = metrics_port
+    grafana_api_handling.GRAFANA_URL = upload_dashboards.GRAFANA_URL = grafana_url
+    main.run_adapter()
+
+
+def write_configuration(config_directory: Path):
+    config_directory.mkdir()
+    (config_directory / "oxemon_dictionary.json").write_text(json.dumps(
+        {"module_ids": [MODULE], "event_ids": [EVENT], "misc_conversions": [], "expected_couplings": []}
+    ))
+    (config_directory / "event_registry.yaml").write_text(
+        f"{EVENT['string']}:\n  type: counter\n  modules:\n  - {MODULE['string']}\n"
+    )
+    (config_directory / "dashboards").mkdir()
+    (config_directory / "dashboards" / "startup.json").write_text(json.dumps({"title": "startup", "panels": []}))
+
+
+def free_port(kind: int) -> int:
+    with socket.socket(socket.AF_INET, kind) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def read(url: str):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.read().decode()
+    except urllib.error.HTTPError as e:
+        return e.read().decode()
+    except OSError:
+        return None
+
+
+def measure(grafana_boot: float, timeout: float) -> dict:
+    grafana = FakeGrafana(latency=0, boot_time=grafana_boot)
+    grafana.start()
+    port, metrics_port = free_port(socket.SOCK_DGRAM), free_port(socket.SOCK_STREAM)
+    metrics_url = f"http://127.0.0.1:{metrics_port}"
+    data = bytes(icd.EmitHeader(module_id=MODULE["hash"], event_id=EVENT["hash"]) / icd.EmitCounter(counter_value=1))
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    timeline = {}
+    with tempfile.TemporaryDirectory() as directory:
+        write_configuration(Path(directory) / "config")
+        start = time.monotonic()
+        adapter = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.startup", "--serve", "--port", str(port),
+             "--metrics-port", str(metrics_port), "--grafana-url", grafana.url],
+            cwd=directory,
+            env=dict(os.environ, PYTHONPATH=str(ADAPTER_DIRECTORY)),
+            stdout=subprocess.DEVNULL,
+        )
+        try:
+            next_poll = start
+            while len(timeline) < 3 and time.monotonic() - start < timeout:
+                sock.sendto(data, ("127.0.0.1", port))
+                time.sleep(SEND_INTERVAL)
+                if time.monotonic() < next_poll:
+                    continue
+                next_poll = time.monotonic() + POLL_INTERVAL
+
+                now = time.monotonic() - start
+                exposition = read(f"{metrics_url}/metrics") or ""
+                if METRIC_SAMPLE in exposition and float(exposition.split(METRIC_SAMPLE)[1].split()[0]) > 0:
+                    timeline.setdefault("first packet accepted", now)
+                report = read(f"{metrics_url}/ready")
+                if report:
+                    report = json.loads(report)
+                    if report["ready"]:
+                        timeline.setdefault("ready (ingestion)", now)
+                    if report["phases"]["dashboards"]["state"] == "ready":
+                        timeline.setdefault("dashboards provisioned", now)
+        finally:
+            adapter.terminate()
+            adapter.wait()
+            grafana.stop()
+    return timeline
+
+
+def parse_args():
+    parser = ArgumentParser(description="Measure the time until a starting adapter accepts packets")
+    parser.add_argument("--grafana-boot", type=float, default=5, help="Seconds until the fake Grafana is healthy")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--serve", action="store_true", help=INTERNAL_HELP)
+    parser.add_argument("--port", type=int, help=INTERNAL_HELP)
+    parser.add_argument("--metrics-port", type=int, help=INTERNAL_HELP)
+    parser.add_argument("--grafana-url", help=INTERNAL_HELP)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    if arguments.serve:
+        serve(arguments.port, arguments.metrics_port, arguments.grafana_url)
+        sys.exit(0)
+
+    print(f"Grafana becomes healthy after {arguments.grafana_boot:.1f} s")
+    for event, seconds in sorted(measure(arguments.grafana_boot, arguments.timeout).items(), key=lambda x: x[1]):
+        print(f"{event:<24} {seconds * 1000:>8.0f} ms")
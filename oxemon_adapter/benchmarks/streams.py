@@ -0,0 +1,297 @@
+"""
+Checks the stream framer and the stream transports (serial and TCP), and measures the framer's throughput.
+
+- Reads of every size (down to a byte, and with a buffer barely larger than an emit) decode every emit of a stream,
+  and a frame split at any offset between two reads decodes all its records.
+- After a corrupt event type or a corrupt log length (a parameter count that is too high or too low), the framer
+  skips bytes until it finds emits again, and counts them: every emit after the corrupt region is decoded.
+- Emits written to a pty are received by `serve_serial`, and those sent over several TCP loopback connections
+  (in pieces that interleave between the connections) by `serve_tcp`.
+- A stream of realistic emits is fed to a `StreamFramer` in chunks of several sizes (as reads would return it),
+  and the decoded MB/sec and emits/sec are reported. Some of the runs insert corrupt bytes between the emits, to
+  measure the cost of resynchronising.
+"""
+import json
+import os
+import random
+import socket
+import threading
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+from prometheus_client import REGISTRY
+
+import icd
+import transports
+from benchmarks.datagrams import DatagramFactory
+from benchmarks.pipeline import EXAMPLE_DICTIONARY_PATH
+from stream_framer import StreamFramer
+
+# Ids that no corrupt byte of the checks' streams looks like
+MODULE_ID = 0x5A17C0DE
+EVENT_IDS = (0x0BADCAFE, 0x0DDBA115, 0x1CEB00DA)
+
+
+def build_stream(emits: list, corrupt_every: int, seed: int) -> bytes:
+    """
+    Concatenates the emits, with a few random bytes after every `corrupt_every` emits (0 for a clean stream).
+    """
+    generator = random.Random(seed)
+    parts = []
+    for index, emit in enumerate(emits, start=1):
+        parts.append(emit)
+        if corrupt_every and index % corrupt_every == 0:
+            parts.append(bytes(generator.getrandbits(8) for _ in range(generator.randint(1, 16))))
+    return b"".join(parts)
+
+
+def measure(stream: bytes, chunk_size: int, is_known) -> tuple:
+    """
+    Returns the seconds it took to frame the whole stream, and the amount of decoded emits.
+    """
+    framer = StreamFramer(is_known=is_known)
+    source = memoryview(stream)
+    decoded = 0
+    start = time.perf_counter()
+    offset = 0
+    while offset < len(stream):
+        # Same as a `recv_into` the framer's buffer
+        writable = framer.writable()
+        size = min(chunk_size, len(writable), len(stream) - offset)
+        writable[:size] = source[offset:offset + size]
+        framer.commit(size)
+        offset += size
+        decoded += len(framer.records())
+    return time.perf_counter() - start, decoded
+
+
+def expected_records(emits: list) -> list:
+    return [record for emit in emits for record in icd.decode_messages(emit)]
+
+
+def is_checked_id(module_id: int, event_id: int) -> bool:
+    return module_id == MODULE_ID and event_id in EVENT_IDS
+
+
+def checked_emits(count: int, seed: int = 0, event_ids=EVENT_IDS) -> list:
+    """
+    Counters, labels and logs (with 0-8 parameters) of the checks' ids.
+    """
+    generator = random.Random(seed)
+    emits = []
+    for index in range(count):
+        header = icd.EmitHeader(module_id=MODULE_ID, event_id=event_ids[index % len(event_ids)])
+        kind = index % 3
+        if kind == 0:
+            body = icd.EmitCounter(counter_value=generator.getrandbits(16))
+        elif kind == 1:
+            body = icd.EmitLabel(label=generator.getrandbits(16))
+        else:
+            params = [generator.getrandbits(16) for _ in range(generator.randint(0, 8))]
+            body = icd.EmitLog(param_count=len(params), params=params)
+        emits.append(bytes(header / body))
+    return emits
+
+
+def frame(stream: bytes, chunk_sizes, capacity: int = 4096) -> tuple:
+    """
+    Feeds the stream to a framer in reads of the given sizes (cycling), returns the decoded emits and the skipped
+    bytes.
+    """
+    framer = StreamFramer(capacity, is_known=is_checked_id)
+    records = []
+    offset, reads = 0, 0
+    while offset < len(stream):
+        writable = framer.writable()
+        size = min(chunk_sizes[reads % len(chunk_sizes)], len(writable), len(stream) - offset)
+        writable[:size] = stream[offset:offset + size]
+        framer.commit(size)
+        offset += size
+        reads += 1
+        records += framer.records()
+    return records, framer.skipped_bytes
+
+
+def check_partial_reads():
+    emits = checked_emits(3000)
+    stream = b"".join(emits)
+    expected = expected_records(emits)
+    largest = max(len(emit) for emit in emits)
+    for chunk_sizes, capacity in (([1], 4096), ([2, 3, 5, 7, 11, 13], 4096), ([4096], 4096),
+                                  ([1, largest, 3], largest + 1), ([largest + 1], largest + 1)):
+        records, skipped = frame(stream, chunk_sizes, capacity)
+        assert records == expected, f"Reads of {chunk_sizes} bytes (buffer of {capacity}) decoded other emits"
+        assert not skipped, f"{skipped} bytes of a clean stream were skipped"
+
+    frame_emits = checked_emits(20, seed=1)
+    framed = icd.build_frame(frame_emits)
+    stream = emits[0] + framed + emits[1]
+    expected = expected_records([emits[0]] + frame_emits + [emits[1]])
+    for split in range(1, len(stream)):
+        records, skipped = frame(stream, [split, len(stream)])
+        assert records == expected and not skipped, f"A frame split after {split} bytes wasn't decoded"
+    print(f"partial reads: every emit decoded in reads of 1 to {largest + 1} bytes, and a frame split at any of its "
+          f"{len(framed)} bytes")
+
+
+def check_resync():
+    emits = checked_emits(600, seed=2)
+    log_index = next(index for index in range(300, 600) if emits[index][icd.HEADER_SIZE - 1] == 2
+                     and emits[index][icd.HEADER_SIZE] > 1)
+    log = emits[log_index]
+    corruptions = {
+        # An event type that doesn't exist: the whole emit is skipped
+        "event type": log[:icd.HEADER_SIZE - 1] + b"\x7f" + log[icd.HEADER_SIZE:],
+        # A parameter count too high: the following emits are read as its parameters
+        "long length": log[:icd.HEADER_SIZE] + b"\xff" + log[icd.HEADER_SIZE + 1:],
+        # A parameter count too low: its last parameters are read as the next emits
+        "short length": log[:icd.HEADER_SIZE] + bytes([log[icd.HEADER_SIZE] - 1]) + log[icd.HEADER_SIZE + 1:],
+    }
+    before, after = emits[:log_index], emits[log_index + 1:]
+    for name, corrupt in corruptions.items():
+        skipped_before = REGISTRY.get_sample_value("oxemon_adapter_stream_skipped_bytes_total")
+        for chunk_sizes in ([1], [64], [4096]):
+            records, skipped = frame(b"".join(before) + corrupt + b"".join(after), chunk_sizes)
+            assert records[:len(before)] == expected_records(before), f"Emits before a corrupt {name} were lost"
+            # A too long log swallows up to 255 parameters of the following emits, the others lose none
+            swallowed = (255 * 8 // min(len(emit) for emit in after) + 1) if name == "long length" else 0
+            tail = expected_records(after[swallowed:])
+            assert records[-len(tail):] == tail, f"Emits after a corrupt {name} weren't decoded ({chunk_sizes})"
+            assert skipped, f"The corrupt {name} wasn't skipped"
+            if name == "event type":
+                assert records == expected_records(before + after) and skipped == len(corrupt)
+        assert REGISTRY.get_sample_value("oxemon_adapter_stream_skipped_bytes_total") > skipped_before
+        print(f"resync, corrupt {name:<12}: {skipped:>2} bytes skipped, the last {len(tail)} of the {len(after)} "
+              f"following emits decoded")
+
+
+class Collector:
+    """
+    A `handle_records` of the transports, which keeps the received emits.
+    """
+    def __init__(self):
+        self.records = []
+        self.updated = threading.Condition()
+        self.stopped = False
+
+    def __call__(self, records: list):
+        with self.updated:
+            self.records.extend(records)
+            self.updated.notify_all()
+
+    def wait_for(self, count: int, timeout: float = 10) -> bool:
+        with self.updated:
+            return self.updated.wait_for(lambda: len(self.records) >= count, timeout)
+
+    def should_stop(self) -> bool:
+        return self.stopped
+
+
+def wait_for_connections(count: int):
+    deadline = time.monotonic() + 10
+    while REGISTRY.get_sample_value("oxemon_adapter_stream_connections") != count:
+        assert time.monotonic() < deadline, "The transport didn't open its stream"
+        time.sleep(0.01)
+
+
+def check_pty():
+    transports.POLL_INTERVAL = 0.05
+    controller, device = os.openpty()
+    collector = Collector()
+    thread = threading.Thread(target=transports.serve_serial,
+                              args=(os.ttyname(device), 115200, is_checked_id, collector, collector.should_stop))
+    thread.start()
+    try:
+        wait_for_connections(1)
+        emits = checked_emits(2000, seed=3)
+        stream = b"".join(emits)
+        for offset in range(0, len(stream), 1000):
+            os.write(controller, stream[offset:offset + 1000])
+        assert collector.wait_for(len(emits)), f"{len(collector.records)} of {len(emits)} emits received"
+        assert collector.records == expected_records(emits), "The pty's emits weren't received as sent"
+    finally:
+        collector.stopped = True
+        thread.join()
+        os.close(controller)
+        os.close(device)
+    print(f"pty: {len(emits)} emits ({len(stream)} bytes) received")
+
+
+def check_tcp():
+    transports.POLL_INTERVAL = 0.05
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind(("127.0.0.1", 0))
+        address = probe.getsockname()
+    collector = Collector()
+    thread = threading.Thread(target=transports.serve_tcp,
+                              args=(address, is_checked_id, collector, collector.should_stop))
+    thread.start()
+    connections = []
+    try:
+        deadline = time.monotonic() + 10
+        while len(connections) < len(EVENT_IDS):
+            try:
+                connections.append(socket.create_connection(address))
+            except ConnectionRefusedError:
+                assert time.monotonic() < deadline, "The TCP transport didn't listen"
+                time.sleep(0.01)
+        wait_for_connections(len(connections))
+
+        # Every connection sends the emits of its own event id
+        streams = [checked_emits(500, seed=4, event_ids=(event_id,)) for event_id in EVENT_IDS]
+        data = [b"".join(emits) for emits in streams]
+        # Pieces that cut emits, interleaved between the connections
+        for offset in range(0, max(len(stream) for stream in data), 7):
+            for connection, stream in zip(connections, data):
+                if offset < len(stream):
+                    connection.sendall(stream[offset:offset + 7])
+        total = sum(len(emits) for emits in streams)
+        assert collector.wait_for(total), f"{len(collector.records)} of {total} emits received"
+        for event_id, emits in zip(EVENT_IDS, streams):
+            received = [record for record in collector.records if record.event_id == event_id]
+            assert received == expected_records(emits), "A connection's emits weren't received as sent"
+    finally:
+        for connection in connections:
+            connection.close()
+        collector.stopped = True
+        thread.join()
+    wait_for_connections(0)
+    print(f"tcp: {total} emits received over {len(connections)} connections")
+
+
+def parse_args():
+    parser = ArgumentParser(description="Benchmark the stream framer")
+    parser.add_argument("--dictionary", type=Path, default=EXAMPLE_DICTIONARY_PATH)
+    parser.add_argument("--emits", type=int, default=200000, help="Emits in the stream")
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[64, 1024, 65536], help="Bytes per read")
+    parser.add_argument("--corrupt-every", type=int, default=1000, help="Emits between corrupt bytes")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    check_partial_reads()
+    check_resync()
+    check_pty()
+    check_tcp()
+
+    dictionary = json.loads(arguments.dictionary.read_text())
+    module_ids = {module["hash"] for module in dictionary["module_ids"]}
+    event_ids = {event["hash"] for event in dictionary["event_ids"]} | \
+        {log["hash"] for log in dictionary["misc_conversions"]}
+
+    def is_known(module_id: int, event_id: int) -> bool:
+        return module_id in module_ids and event_id in event_ids
+
+    pool = DatagramFactory(dictionary).build(4096)
+    emits = [pool[index % len(pool)] for index in range(arguments.emits)]
+
+    print(f"{'stream':<10} {'chunk':>7} {'MB/sec':>9} {'emits/sec':>11} {'decoded':>9}")
+    for name, corrupt_every in (("clean", 0), ("corrupt", arguments.corrupt_every)):
+        stream = build_stream(emits, corrupt_every, seed=0)
+        for chunk_size in arguments.chunk_sizes:
+            duration, decoded = measure(stream, chunk_size, is_known)
+            print(f"{name:<10} {chunk_size:>7} {len(stream) / duration / 1e6:>9.1f} {decoded / duration:>11.0f} "
+                  f"{decoded:>9}")
+    print("Checks passed")
@@ -0,0 +1,141 @@
+"""
+Load test of the multi-process ingestion (OXEMON_WORKERS).
+
+For every worker count, an adapter is started in a subprocess (with a temporary configuration), a few sender
+processes flood it with counter emits over loopback, and the processed packets/sec are read back from the
+aggregated Prometheus metrics. Scaling is only expected up to the amount of available cores.
+"""
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import icd
+
+ADAPTER_DIRECTORY = Path(__file__).resolve().parent.parent
+MODULE = {"string": "benchmark", "hash": 1}
+EVENT = {"string": "benchmark counter", "hash": 2, "event_type": "counter"}
+METRIC_NAME = "benchmark_counter_total"
+INTERNAL_HELP = "Internal, used to run the adapter under test"
+
+
+def serve(worker_count: int, port: int):
+    """
+    Runs the adapter's receivers (without Grafana/Loki), from a directory with a configuration.
+    """
+    os.environ.update({
+        "OXEMON_WORKERS": str(worker_count),
+        "OXEMON_RECEIVE_MODE": "batched",
+        "OXEMON_LOG_PACKETS": "0",
+    })
+    import main
+    import workers
+
+    signal.signal(signal.SIGTERM, main.handle_signal)
+    main.LISTEN_PORT = port
+    main.create_metric_families({EVENT["string"]: {"type": "counter", "modules": [MODULE["string"]]}})
+    if worker_count > 1:
+        workers.run_workers(worker_count, main.run_receiver, should_stop=lambda: main.shutdown)
+    else:
+        main.run_receiver()
+
+
+def send(port: int, stop_time: float, socket_count: int):
+    """
+    Floods the adapter with counter emits, from several source ports (so SO_REUSEPORT spreads them).
+    """
+    data = bytes(icd.EmitHeader(module_id=MODULE["hash"], event_id=EVENT["hash"]) / icd.EmitCounter(counter_value=1))
+    sockets = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in range(socket_count)]
+    address = ("127.0.0.1", port)
+    while time.monotonic() < stop_time:
+        for sock in sockets:
+            for _ in range(64):
+                try:
+                    sock.sendto(data, address)
+                except OSError:
+                    pass
+
+
+def read_processed(metrics_directory: str) -> float:
+    from prometheus_client import CollectorRegistry
+    from prometheus_client.multiprocess import MultiProcessCollector
+
+    registry = CollectorRegistry()
+    MultiProcessCollector(registry, path=metrics_directory)
+    return registry.get_sample_value(METRIC_NAME, {"module": MODULE["string"]}) or 0
+
+
+def free_udp_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure(worker_count: int, sender_count: int, duration: float, warmup: float) -> float:
+    with tempfile.TemporaryDirectory() as directory:
+        config_directory = Path(directory) / "config"
+        config_directory.mkdir()
+        (config_directory / "oxemon_dictionary.json").write_text(json.dumps(
+            {"module_ids": [MODULE], "event_ids": [EVENT], "misc_conversions": [], "expected_couplings": []}
+        ))
+        metrics_directory = str(Path(directory) / "metrics")
+
+        port = free_udp_port()
+        adapter = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.workers", "--serve", str(worker_count), "--port", str(port)],
+            cwd=directory,
+            env=dict(os.environ, PYTHONPATH=str(ADAPTER_DIRECTORY), PROMETHEUS_MULTIPROC_DIR=metrics_directory),
+            stdout=subprocess.DEVNULL,
+        )
+        try:
+            time.sleep(1)  # Let the workers bind
+            stop_time = time.monotonic() + warmup + duration
+            senders = [multiprocessing.Process(target=send, args=(port, stop_time, 8)) for _ in range(sender_count)]
+            for sender in senders:
+                sender.start()
+
+            time.sleep(warmup)
+            start_count, start_time = read_processed(metrics_directory), time.monotonic()
+            time.sleep(duration)
+            end_count, end_time = read_processed(metrics_directory), time.monotonic()
+
+            for sender in senders:
+                sender.join()
+        finally:
+            adapter.terminate()
+            adapter.wait()
+
+    return (end_count - start_count) / (end_time - start_time)
+
+
+def parse_args():
+    parser = ArgumentParser(description="Measure packets/sec as receiver workers are added")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--senders", type=int, default=2, help="Amount of sending processes")
+    parser.add_argument("--duration", type=float, default=5, help="Measurement time (seconds) per worker count")
+    parser.add_argument("--warmup", type=float, default=1)
+    parser.add_argument("--serve", type=int, help=INTERNAL_HELP)
+    parser.add_argument("--port", type=int, help=INTERNAL_HELP)
+    return parser.parse_args()
+
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    if arguments.serve:
+        serve(arguments.serve, arguments.port)
+        sys.exit(0)
+
+    print(f"{'workers':>7} {'packets/sec':>12} {'scaling':>8}")
+    baseline = None
+    for workers_count in range(1, arguments.max_workers + 1):
+        rate = measure(workers_count, arguments.senders, arguments.duration, arguments.warmup)
+        baseline = baseline or rate
+        print(f"{workers_count:>7} {rate:>12.0f} {rate / baseline:>7.2f}x")
@@ -0,0 +1,173 @@
+"""
+Capture files of raw emit traffic: every received datagram, with its arrival time and source address.
+
+A capture is a single append-only file, which can be memory-mapped and read while it's still being written, and
+which is replayed by `replay.py`. A capture that was cut short (e.g. the adapter was killed) is valid up to its last
+complete record, and appending to it continues from there.
+
+Layout (little-endian):
+- Header: magic, version and a reserved UInt16.
+- Records, one after the other: the arrival time (nanoseconds since the epoch), the length of the datagram (a
+  UInt16, so at most `MAX_LENGTH` bytes), the source port and the source IP (16 bytes, IPv4 addresses are
+  IPv4-mapped), followed by the datagram itself.
+"""
+import mmap
+import os
+import socket
+import struct
+from typing import Iterator, List, Tuple
+
+MAGIC = b"OXCP"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHH")  # magic, version, reserved
+RECORD_HEADER = struct.Struct("<QHH16s")  # arrival time in ns, length, source port, source IP
+MAX_LENGTH = 2 ** 16 - 1
+
+WRITE_BUFFER_SIZE = 2 ** 20
+_IPV4_MAPPED_PREFIX = bytes(10) + b"\xff\xff"
+_MAX_CACHED_ADDRESSES = 4096
+
+
+def encode_address(addr: tuple) -> Tuple[int, bytes]:
+    """
+    The source port and the 16 bytes of the source IP of a `recvfrom` address.
+    """
+    ip, port = addr[0], addr[1]
+    try:
+        return port, _IPV4_MAPPED_PREFIX + socket.inet_pton(socket.AF_INET, ip)
+    except OSError:
+        return port, socket.inet_pton(socket.AF_INET6, ip)
+
+
+def decode_address(port: int, ip: bytes) -> tuple:
+    if ip.startswith(_IPV4_MAPPED_PREFIX):
+        return socket.inet_ntop(socket.AF_INET, ip[12:]), port
+    return socket.inet_ntop(socket.AF_INET6, ip), port
+
+
+def _check_header(buffer):
+    if len(buffer) < HEADER.size:
+        raise ValueError("Not a capture file (too short)")
+    magic, version, _ = HEADER.unpack_from(buffer)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Not a capture file (version {VERSION})")
+
+
+def _records_end(buffer) -> int:
+    """
+    The offset right after the last complete record.
+    """
+    offset, size = HEADER.size, len(buffer)
+    while offset + RECORD_HEADER.size <= size:
+        _, length, _, _ = RECORD_HEADER.unpack_from(buffer, offset)
+        end = offset + RECORD_HEADER.size + length
+        if end > size:
+            break
+        offset = end
+    return offset
+
+
+class CaptureWriter:
+    """
+    Appends datagrams to a capture file (creating it if needed).
+
+    Once the file reaches `max_bytes`, capturing stops (the adapter keeps receiving as usual).
+    """
+    def __init__(self, path, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.full = False
+        self._addresses = {}
+
+        existing = os.path.exists(path) and os.path.getsize(path) > 0
+        if existing:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                _check_header(buffer)
+                size, file_size = _records_end(buffer), len(buffer)
+            if size != file_size:
+                print(f"❌ {path} ends with an incomplete record, it's dropped")
+                os.truncate(path, size)
+        self._file = open(path, "ab", buffering=WRITE_BUFFER_SIZE)
+        if not existing:
+            self._file.write(HEADER.pack(MAGIC, VERSION, 0))
+        self.size = self._file.tell()
+
+    def _encoded_address(self, addr: tuple) -> Tuple[int, bytes]:
+        encoded = self._addresses.get(addr)
+        if encoded is None:
+            if len(self._addresses) >= _MAX_CACHED_ADDRESSES:
+                self._addresses.clear()
+            encoded = self._addresses[addr] = encode_address(addr)
+        return encoded
+
+    def write(self, data, addr: tuple, timestamp: int):
+        """
+        Appends a datagram that arrived at `timestamp` (as returned by `time.time_ns`).
+        """
+        self.write_batch([(data, addr)], [timestamp])
+
+    def write_batch(self, batch: List[tuple], timestamps: List[int]):
+        """
+        Appends a batch of `(data, addr)` datagrams, which arrived at their `timestamps`.
+        """
+        if self.full:
+            return
+        write, pack = self._file.write, RECORD_HEADER.pack
+        for (data, addr), timestamp in zip(batch, timestamps):
+            length = len(data)
+            if length > MAX_LENGTH:
+                raise ValueError(f"A datagram of {length} bytes can't be captured (at most {MAX_LENGTH})")
+            if self.size + RECORD_HEADER.size + length > self.max_bytes:
+                self.full = True
+                print(f"❌ The capture {self.path} reached its maximal size ({self.max_bytes} bytes), "
+                      f"capturing stopped")
+                return
+            port, ip = self._encoded_address(addr)
+            write(pack(timestamp, length, port, ip))
+            write(data)
+            self.size += RECORD_HEADER.size + length
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class CaptureReader:
+    """
+    Reads a capture file (memory-mapped). Iterating it yields `(timestamp, addr, data)` for every complete record,
+    where `data` is a memoryview into the file, only valid until the reader is closed.
+    """
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _check_header(self._buffer)
+        self.size = _records_end(self._buffer)
+
+    def __iter__(self) -> Iterator[Tuple[int, tuple, memoryview]]:
+        buffer = memoryview(self._buffer)
+        unpack_from, header_size = RECORD_HEADER.unpack_from, RECORD_HEADER.size
+        addresses = {}
+        offset, end = HEADER.size, self.size
+        while offset < end:
+            timestamp, length, port, ip = unpack_from(buffer, offset)
+            addr = addresses.get((port, ip))
+            if addr is None:
+                addr = addresses[(port, ip)] = decode_address(port, ip)
+            offset += header_size
+            yield timestamp, addr, buffer[offset:offset + length]
+            offset += length
+
+    def close(self):
+        try:
+            self._buffer.close()
+        except BufferError:
+            pass  # Records are still referenced, the file is unmapped once they're released
+
+    def __enter__(self) -> "CaptureReader":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
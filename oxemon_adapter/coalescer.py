@@ -0,0 +1,118 @@
+"""
+Pre-aggregation of metric updates.
+
+Every update of a prometheus_client metric takes a lock (and with several workers, writes to a shared file), while
+Prometheus only scrapes every few seconds. The coalescer sums counter deltas and keeps the last value of labels
+for a short window, and applies them to the metrics all at once. Every value of a distribution is needed, so they're
+observed right away.
+"""
+import copy
+import time
+from typing import Callable, List
+
+from dispatch import AGGREGATE_NONE, AGGREGATE_SUM, DispatchIndex
+
+
+class _CounterSlot:
+    __slots__ = ("apply", "delta", "pending", "dirty")
+
+    def __init__(self, apply: Callable[[float], None], dirty: list):
+        self.apply = apply
+        self.delta = 0
+        self.pending = False
+        self.dirty = dirty
+
+    def add(self, value: int):
+        self.delta += value
+        if not self.pending:
+            self.pending = True
+            self.dirty.append(self)
+
+    def flush(self):
+        self.apply(self.delta)
+        self.delta = 0
+        self.pending = False
+
+
+class _LabelSlot:
+    __slots__ = ("apply", "value", "pending", "dirty")
+
+    def __init__(self, apply: Callable[[float], None], dirty: list):
+        self.apply = apply
+        self.value = None
+        self.pending = False
+        self.dirty = dirty
+
+    def set(self, value: int):
+        self.value = value
+        if not self.pending:
+            self.pending = True
+            self.dirty.append(self)
+
+    def flush(self):
+        self.apply(self.value)
+        self.pending = False
+
+
+class UpdateCoalescer:
+    """
+    Collects the counter/label updates of a dispatch index, and applies them once every `window` seconds.
+
+    A coalescer isn't thread-safe: every thread that dispatches creates its own one, dispatches through
+    `bind(dispatch_index)` and calls `maybe_flush` regularly (also when idle). A `window` of 0 disables it,
+    so updates are applied immediately.
+    """
+    def __init__(self, window: float):
+        self.window = window
+        self._source = None
+        self._bound = None
+        self._dirty: List = []
+        self._deadline = time.monotonic() + window
+
+    def bind(self, dispatch_index: DispatchIndex) -> DispatchIndex:
+        """
+        Returns a copy of `dispatch_index` whose counter/label updates are collected by this coalescer.
+
+        The copy is kept until the index is swapped (by a reload), so this is cheap to call for every batch.
+        """
+        if not self.window:
+            return dispatch_index
+        if dispatch_index is not self._source:
+            # Updates collected for the previous index go to its metrics
+            self.flush()
+            slots = {}
+            updaters = {}
+            for key, updater in dispatch_index.updaters.items():
+                aggregation = dispatch_index.aggregations[key]
+                if aggregation == AGGREGATE_NONE:
+                    updaters[key] = updater
+                    continue
+                slot = slots.get(updater)
+                if slot is None:
+                    if aggregation == AGGREGATE_SUM:
+                        slot = slots[updater] = _CounterSlot(updater, self._dirty)
+                    else:
+                        slot = slots[updater] = _LabelSlot(updater, self._dirty)
+                updaters[key] = slot.add if isinstance(slot, _CounterSlot) else slot.set
+
+            self._bound = copy.copy(dispatch_index)
+            self._bound.updaters = updaters
+            self._source = dispatch_index
+        return self._bound
+
+    def flush(self):
+        """
+        Applies all the collected updates.
+        """
+        dirty = self._dirty
+        for slot in dirty:
+            slot.flush()
+        dirty.clear()
+        self._deadline = time.monotonic() + self.window
+
+    def maybe_flush(self):
+        """
+        Applies the collected updates if the window has passed.
+        """
+        if self._dirty and time.monotonic() >= self._deadline:
+            self.flush()
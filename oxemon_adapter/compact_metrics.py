@@ -0,0 +1,165 @@
+"""
+A compact store for the emitted metrics (the `OXEMON_METRICS_STORE=compact` option).
+
+prometheus_client keeps a full object (with its own lock and value wrapper) for every (event, module) pair, which
+is heavy on memory and slow to scrape with thousands of couplings. This store keeps all the values in one flat
+array, indexed by slot, and renders their text exposition directly from it.
+"""
+import threading
+from array import array
+from typing import Dict, List, Tuple
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+INITIAL_CAPACITY = 1024
+
+
+class CounterSlot:
+    """
+    The value of one (event, module) counter, like a prometheus_client `Counter` child.
+    """
+    __slots__ = ("_store", "slot")
+
+    def __init__(self, store: "CompactMetricStore", slot: int):
+        self._store = store
+        self.slot = slot
+
+    def inc(self, amount: float = 1):
+        store = self._store
+        # Unlike setting, adding isn't atomic, and several threads might update the same counter
+        with store.lock:
+            store.values[self.slot] += amount
+
+
+class GaugeSlot:
+    """
+    The value of one (event, module) gauge or enum, like a prometheus_client `Gauge` child.
+    """
+    __slots__ = ("_store", "slot")
+
+    def __init__(self, store: "CompactMetricStore", slot: int):
+        self._store = store
+        self.slot = slot
+
+    def set(self, value: float):
+        self._store.values[self.slot] = value
+
+
+class _CompactFamily:
+    """
+    A family of slots which differ by their "module" label (the same interface as prometheus_client's metrics).
+    """
+    slot_class = None
+    metric_type = None
+    sample_suffix = ""
+
+    def __init__(self, name: str, documentation: str, store: "CompactMetricStore"):
+        # Like prometheus_client, a name that already ends with the suffix isn't suffixed twice
+        if self.sample_suffix and name.endswith(self.sample_suffix):
+            name = name[:-len(self.sample_suffix)]
+        self.name = name
+        self.documentation = documentation
+        self.sample_name = name + self.sample_suffix
+        escaped_documentation = documentation.replace("\\", r"\\").replace("\n", r"\n")
+        self.header = (f"# HELP {self.sample_name} {escaped_documentation}\n"
+                       f"# TYPE {self.sample_name} {self.metric_type}\n")
+        self._store = store
+        self._children: Dict[str, object] = {}
+        # `(sample prefix, slot)` of every child, in the order they're rendered
+        self.samples: List[Tuple[str, int]] = []
+        store.register(self)
+
+    def labels(self, module: str):
+        child = self._children.get(module)
+        if child is None:
+            child = self._children[module] = self.slot_class(self._store, self._store.allocate())
+            escaped_module = module.replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+            self.samples.append((f'{self.sample_name}{{module="{escaped_module}"}} ', child.slot))
+        return child
+
+    def remove(self, module: str):
+        child = self._children.pop(module)
+        removed_slot = child.slot
+        # Replaced rather than modified, since it might be rendered at the same time
+        self.samples = [(prefix, slot) for prefix, slot in self.samples if slot != removed_slot]
+        self._store.release(child)
+
+    def unregister(self):
+        for module in list(self._children):
+            self.remove(module)
+        self._store.unregister(self)
+
+
+class CompactCounter(_CompactFamily):
+    slot_class = CounterSlot
+    metric_type = "counter"
+    sample_suffix = "_total"
+
+
+class CompactGauge(_CompactFamily):
+    slot_class = GaugeSlot
+    metric_type = "gauge"
+
+
+class CompactMetricStore:
+    """
+    Holds the values of all the compact metric families, in a single array that grows as slots are allocated.
+
+    It's also a collector (for any prometheus_client registry), but `render` is much faster.
+    """
+    def __init__(self, capacity: int = INITIAL_CAPACITY):
+        self.values = array("d", bytes(8 * capacity))
+        self.lock = threading.Lock()
+        self._free_slots = list(range(capacity - 1, -1, -1))
+        self._families: Dict[str, _CompactFamily] = {}
+        # Never rendered: removed children are pointed at it, since the updaters of an old dispatch index (or a
+        # coalescer, until it flushes) may still update them once their slot is reused by another series
+        self.dead_slot = self.allocate()
+
+    def register(self, family: _CompactFamily):
+        if family.name in self._families:
+            raise ValueError(f"Duplicated timeseries in CompactMetricStore: {family.name}")
+        self._families[family.name] = family
+
+    def unregister(self, family: _CompactFamily):
+        del self._families[family.name]
+
+    def allocate(self) -> int:
+        with self.lock:
+            if not self._free_slots:
+                capacity = len(self.values)
+                self.values.extend(array("d", bytes(8 * capacity)))
+                self._free_slots = list(range(2 * capacity - 1, capacity - 1, -1))
+            slot = self._free_slots.pop()
+            self.values[slot] = 0
+            return slot
+
+    def release(self, child):
+        """
+        Frees the slot of a removed child, which is pointed at the dead slot (under the lock that counters update
+        their slot with).
+        """
+        with self.lock:
+            slot = child.slot
+            child.slot = self.dead_slot
+            self._free_slots.append(slot)
+
+    def render(self) -> str:
+        """
+        Renders the text exposition of all the families.
+        """
+        values = self.values.tolist()
+        output = []
+        for family in list(self._families.values()):
+            output.append(family.header)
+            output.extend([f"{prefix}{values[slot]!r}\n" for prefix, slot in family.samples])
+        return "".join(output)
+
+    def collect(self):
+        values = self.values.tolist()
+        for family in list(self._families.values()):
+            metric_class = CounterMetricFamily if family.metric_type == "counter" else GaugeMetricFamily
+            metric = metric_class(family.name, family.documentation, labels=["module"])
+            for module, child in list(family._children.items()):
+                metric.add_metric([module], values[child.slot])
+            yield metric
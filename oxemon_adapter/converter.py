@@ -1,35 +1,96 @@
-from typing import List, Dict
+from typing import List, Dict, Mapping, Optional, Sequence
 import icd
 from dataclasses import dataclass
+from functools import lru_cache
+from dictionary_index import DictionaryIndex
 
-def _create_map(conversion_list: List[dict]) -> Dict[int, str]:
-    return {
-        str(obj["hash"]): obj["string"]
-        for obj in conversion_list
-    }
+# The strings of the dictionary by their hash, in separate namespaces: `modules`, `events` and `logs`
+ConversionMap = DictionaryIndex
 
-# TODO: Handle duplicates
-def create_conversion_map(oxemon_dictionary: dict) -> Dict[str, str]:
-    module_id_map = _create_map(oxemon_dictionary["module_ids"])
-    event_id_map = _create_map(oxemon_dictionary["event_ids"])
-    misc_map = _create_map(oxemon_dictionary["misc_conversions"])
 
-    return dict(**module_id_map, **event_id_map, **misc_map)
+def create_conversion_map(oxemon_dictionary: dict) -> ConversionMap:
+    """
+    Creates the conversion map of a dictionary (as parsed from its JSON).
 
+    Raises a `DictionaryCollisionError` if different strings of a namespace have the same hash.
+    """
+    return DictionaryIndex.from_dictionary(oxemon_dictionary)
 
-def resolve_log(log: str, params: List[int]) -> str:
-    parts = log.split("{}")
-    if len(parts) - 1 < len(params):
-        raise ValueError("Number of placeholders does not match number of values.")
-    elif len(parts) - 1 > len(params):
-        # Padding with question marks
-        params += ['?'] * len(parts) - 1 - len(params)
 
-    result = ""
-    for i in range(len(params)):
-        result += parts[i] + f"{{{params[i]}}}"
-    result += parts[-1]
-    return result
+class UnknownIdError(ValueError):
+    """
+    Raised for ids that are not found in the dictionary, `kind` is either "module" or "event".
+    """
+    def __init__(self, kind: str):
+        super().__init__(f"Unknown {kind} id")
+        self.kind = kind
+
+
+class LogTemplate:
+    """
+    A log string, compiled once into a format string so that rendering it is a single `str.format` call.
+    """
+    __slots__ = ("template", "format_string", "placeholder_count")
+
+    PADDING = "?"
+
+    def __init__(self, template: str):
+        self.template = template
+        self.placeholder_count = template.count("{}")
+        # Escape the braces of the log itself, and then turn every (escaped) placeholder into a braced field,
+        # so that a parameter `5` is rendered as `{5}`
+        escaped = template.replace("{", "{{").replace("}", "}}")
+        self.format_string = escaped.replace("{{}}", "{{{}}}")
+
+    def render(self, params: Sequence[int]) -> str:
+        """
+        Fills the placeholders with the given parameters (missing parameters are shown as question marks).
+        """
+        missing = self.placeholder_count - len(params)
+        if missing < 0:
+            raise icd.DecodeError("Number of placeholders does not match number of values.", "log_parameters")
+        if missing:
+            params = tuple(params) + (self.PADDING,) * missing
+
+        return self.format_string.format(*params)
+
+
+# Logs which are not found in the dictionary are compiled on demand (and cached)
+compile_log_template = lru_cache(maxsize=4096)(LogTemplate)
+
+
+class LogTemplates(dict):
+    """
+    The log templates of the dictionary, by hash. Every log is compiled on its first use (so that even a large
+    dictionary loads at once), and then cached.
+    """
+    def __init__(self, logs: Mapping[int, str]):
+        super().__init__()
+        self.logs = logs
+
+    def __missing__(self, log_hash: int) -> LogTemplate:
+        template = self[log_hash] = LogTemplate(self.logs[log_hash])
+        return template
+
+    def get(self, log_hash: int, default=None) -> Optional[LogTemplate]:
+        try:
+            return self[log_hash]
+        except KeyError:
+            return default
+
+    def __contains__(self, log_hash) -> bool:
+        return dict.__contains__(self, log_hash) or log_hash in self.logs
+
+
+def create_log_templates(conversion_map: ConversionMap) -> LogTemplates:
+    """
+    The log templates of all the log strings of the dictionary, by their hash.
+    """
+    return LogTemplates(conversion_map.logs)
+
+
+def resolve_log(log: str, params: Sequence[int]) -> str:
+    return compile_log_template(log).render(params)
 
 
 @dataclass
@@ -40,29 +101,39 @@ class EventUpdate:
     value: int
 
 
-def convert_incoming_message(*, message: bytes, conversion_map: Dict[str, str]) -> EventUpdate:
-    message = icd.read_message(message)
+# Index of the interesting value in each decoded body (see `icd.EmitRecord`)
+_COUNTER_VALUE_INDEX = icd.EmitCounter._field_names.index("counter_value")
+_LABEL_INDEX = icd.EmitLabel._field_names.index("label")
+_LOG_PARAMS_INDEX = icd.EmitLog._field_names.index("params")
+
 
+def convert_record(message: icd.EmitRecord, conversion_map: ConversionMap,
+                   log_templates: Optional[Dict[int, LogTemplate]] = None) -> EventUpdate:
     try:
-        module_name = conversion_map[str(message[icd.EmitHeader].module_id.value)]
+        module_name = conversion_map.modules[message.module_id]
     except KeyError as e:
-        raise ValueError("Unknown module id") from e
-    
+        raise UnknownIdError("module") from e
+
+    body_type = message.body_type
+    # Logs are emitted with the hash of their string as their event id
+    event_names = conversion_map.logs if body_type is icd.EmitLog else conversion_map.events
     try:
-        event_name = conversion_map[str(message[icd.EmitHeader].event_id.value)]
+        event_name = event_names[message.event_id]
     except KeyError as e:
-        raise ValueError("Unknown event id") from e
-    
-    body = message[1]
-    if isinstance(body, icd.EmitCounter):
+        raise UnknownIdError("event") from e
+
+    if body_type is icd.EmitCounter:
         event_type = "counter"
-        value = body.counter_value.value
-    elif isinstance(body, icd.EmitLabel):
+        value = message.body[_COUNTER_VALUE_INDEX]
+    elif body_type is icd.EmitLabel:
         event_type = "label"
-        value = body.label.value
-    elif isinstance(body, icd.EmitLog):
+        value = message.body[_LABEL_INDEX]
+    elif body_type is icd.EmitLog:
         event_type = "log"
-        event_name = resolve_log(log=event_name, params=body.params.value)
+        template = log_templates.get(message.event_id) if log_templates is not None else None
+        if template is None:
+            template = compile_log_template(event_name)
+        event_name = template.render(message.body[_LOG_PARAMS_INDEX])
         value = 0
 
     return EventUpdate(
@@ -72,3 +143,13 @@ def convert_incoming_message(*, message: bytes, conversion_map: Dict[str, str])
         value=value,
     )
 
+
+def convert_incoming_message(*, message: bytes, conversion_map: ConversionMap) -> EventUpdate:
+    return convert_record(icd.decode_message(message), conversion_map)
+
+
+def convert_incoming_messages(*, message: bytes, conversion_map: ConversionMap) -> List[EventUpdate]:
+    """
+    Like `convert_incoming_message`, but also accepts frames (returning an update for every record in them).
+    """
+    return [convert_record(record, conversion_map) for record in icd.decode_messages(message)]
@@ -0,0 +1,225 @@
+"""
+A compiled, binary form of the oxemon dictionary, which the adapter memory-maps instead of parsing the JSON.
+
+`make config` compiles it (`oxemon_dictionary.idx`, next to the dictionary). Every namespace (module ids, event ids
+and log strings) has its own sorted array of UInt32 hashes, so hashes of different namespaces can't overwrite each
+other, and the strings are interned into a single table. Opening it costs nothing: ids are only looked up (by
+binary search) and decoded when they're needed.
+
+Layout (little-endian, every array aligned to 4 bytes):
+- Header: magic, version, the SHA-256 of the source JSON, the amount of strings and the offset of their table.
+- For every namespace: its amount of keys, the offset of its sorted keys and of their values (string indices), and
+  the offset of its "by name" section: the positions of its keys sorted by their normalized strings, and the string
+  indices of those normalized strings (so that the ids of a name are found without decoding all the strings).
+- The string table: `count + 1` offsets into the UTF-8 data which follows them.
+"""
+import mmap
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from hashlib import sha256
+from typing import Dict, Iterator, List
+
+MAGIC = b"OXDI"
+VERSION = 1
+# The dictionary's keys, in their order in the index
+NAMESPACES = ("module_ids", "event_ids", "misc_conversions")
+MAX_HASH = 2 ** 32 - 1  # The ids are UInt32 in the ICD
+
+HEADER = struct.Struct("<4sHH32sII")  # magic, version, namespace count, source hash, string count, strings offset
+NAMESPACE_HEADER = struct.Struct("<IIIII")  # key count, keys, values, positions by name and names offsets
+
+
+# Same as `replace_whitespace` in `main.py`, which is how the event registry refers to modules and events
+def normalize_name(name: str) -> str:
+    return name.strip().lower().replace(" ", "_")
+
+
+class DictionaryCollisionError(ValueError):
+    """
+    Raised when compiling a dictionary in which different strings of the same namespace have the same hash (or a
+    hash isn't a UInt32). `collisions` describes every one of them.
+    """
+    def __init__(self, collisions: List[str]):
+        super().__init__(f"Invalid dictionary ({len(collisions)} hash errors):\n" + "\n".join(collisions))
+        self.collisions = collisions
+
+
+def _u32_array(buffer, offset: int, count: int):
+    view = memoryview(buffer)[offset:offset + 4 * count].cast("I")
+    if sys.byteorder == "little":
+        return view
+    values = array("I", view)
+    values.byteswap()
+    return values
+
+
+class StringTable:
+    __slots__ = ("_offsets", "_data")
+
+    def __init__(self, buffer, offset: int, count: int):
+        self._offsets = _u32_array(buffer, offset, count + 1)
+        self._data = memoryview(buffer)[offset + 4 * (count + 1):]
+
+    def __getitem__(self, index: int) -> str:
+        return str(self._data[self._offsets[index]:self._offsets[index + 1]], "utf-8")
+
+
+class _SortedNames:
+    """
+    The (sorted) normalized names of a namespace, as a sequence that `bisect` can search.
+    """
+    __slots__ = ("_names", "_strings")
+
+    def __init__(self, names, strings: StringTable):
+        self._names = names
+        self._strings = strings
+
+    def __getitem__(self, position: int) -> str:
+        return self._strings[self._names[position]]
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+
+class Namespace(dict):
+    """
+    The strings of one namespace by their hash. A string is decoded on its first lookup, and then it's cached in
+    the dict itself (so that later lookups are plain dict lookups).
+
+    Only `[]`, `get`, `in`, iteration, `len` and `items` are supported.
+    """
+    def __init__(self, keys, values, name_positions, names, strings: StringTable):
+        super().__init__()
+        self._keys = keys
+        self._values = values
+        self._strings = strings
+        self._name_positions = name_positions
+        self._names = _SortedNames(names, strings)
+
+    def _find(self, key) -> int:
+        keys = self._keys
+        position = bisect_left(keys, key)
+        if position == len(keys) or keys[position] != key:
+            raise KeyError(key)
+        return position
+
+    def __missing__(self, key) -> str:
+        string = self[key] = self._strings[self._values[self._find(key)]]
+        return string
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except (KeyError, TypeError):
+            return default
+
+    def __contains__(self, key) -> bool:
+        if dict.__contains__(self, key):
+            return True
+        try:
+            self._find(key)
+        except (KeyError, TypeError):
+            return False
+        return True
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._keys.tolist())
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def items(self) -> List[tuple]:
+        strings = self._strings
+        return [(key, strings[value]) for key, value in zip(self._keys.tolist(), self._values.tolist())]
+
+    def hashes_of(self, name: str) -> List[int]:
+        """
+        The hashes of all the strings whose normalized form (see `normalize_name`) is `name`.
+        """
+        start = bisect_left(self._names, name)
+        end = bisect_right(self._names, name, start)
+        return [self._keys[self._name_positions[position]] for position in range(start, end)]
+
+
+class DictionaryIndex:
+    """
+    The namespaces of a compiled dictionary: `modules`, `events` and `logs` (the misc conversions).
+    """
+    def __init__(self, buffer):
+        self._buffer = buffer  # Kept open for as long as the index is used
+        magic, version, namespace_count, self.source_hash, string_count, strings_offset = HEADER.unpack_from(buffer)
+        if magic != MAGIC or version != VERSION or namespace_count != len(NAMESPACES):
+            raise ValueError(f"Not a dictionary index (version {VERSION})")
+
+        strings = StringTable(buffer, strings_offset, string_count)
+        namespaces = []
+        for position in range(len(NAMESPACES)):
+            count, *offsets = NAMESPACE_HEADER.unpack_from(buffer, HEADER.size + position * NAMESPACE_HEADER.size)
+            namespaces.append(Namespace(*(_u32_array(buffer, offset, count) for offset in offsets), strings))
+        self.modules, self.events, self.logs = namespaces
+
+    @classmethod
+    def open(cls, path) -> "DictionaryIndex":
+        with open(path, "rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    @classmethod
+    def from_dictionary(cls, oxemon_dictionary: dict, source_hash: bytes = bytes(32)) -> "DictionaryIndex":
+        return cls(compile_dictionary(oxemon_dictionary, source_hash))
+
+
+def dictionary_source_hash(dictionary_content: bytes) -> bytes:
+    """
+    The hash of the dictionary's JSON, which an index records to tell whether it's up to date.
+    """
+    return sha256(dictionary_content).digest()
+
+
+def compile_dictionary(oxemon_dictionary: dict, source_hash: bytes = bytes(32)) -> bytes:
+    """
+    Compiles a dictionary (as parsed from its JSON) into an index.
+
+    Raises a `DictionaryCollisionError` if different strings of a namespace have the same hash.
+    """
+    interned: Dict[str, int] = {}
+    collisions = []
+    namespaces = []
+    for namespace in NAMESPACES:
+        strings_by_hash: Dict[int, str] = {}
+        for obj in oxemon_dictionary[namespace]:
+            obj_hash, string = obj["hash"], obj["string"]
+            if not (isinstance(obj_hash, int) and 0 <= obj_hash <= MAX_HASH):
+                collisions.append(f"{namespace}: the hash of {string!r} isn't a UInt32 ({obj_hash!r})")
+                continue
+            existing = strings_by_hash.setdefault(obj_hash, string)
+            if existing != string:
+                collisions.append(f"{namespace}: {existing!r} and {string!r} have the same hash ({obj_hash})")
+        keys = sorted(strings_by_hash)
+        values = [interned.setdefault(strings_by_hash[key], len(interned)) for key in keys]
+        names = [normalize_name(strings_by_hash[key]) for key in keys]
+        name_positions = sorted(range(len(keys)), key=names.__getitem__)
+        sorted_names = [interned.setdefault(names[position], len(interned)) for position in name_positions]
+        namespaces.append((keys, values, name_positions, sorted_names))
+    if collisions:
+        raise DictionaryCollisionError(collisions)
+
+    sections = []
+    offset = HEADER.size + len(NAMESPACES) * NAMESPACE_HEADER.size
+    namespace_headers = []
+    for arrays in namespaces:
+        count = len(arrays[0])
+        namespace_headers.append(NAMESPACE_HEADER.pack(count, *(offset + 4 * count * index for index in range(4))))
+        sections.append(struct.pack(f"<{4 * count}I", *(value for values in arrays for value in values)))
+        offset += 16 * count
+
+    encoded = [string.encode() for string in interned]
+    string_offsets = [0]
+    for string in encoded:
+        string_offsets.append(string_offsets[-1] + len(string))
+    sections.append(struct.pack(f"<{len(string_offsets)}I", *string_offsets))
+    sections.extend(encoded)
+
+    header = HEADER.pack(MAGIC, VERSION, len(NAMESPACES), source_hash, len(encoded), offset)
+    return b"".join([header, *namespace_headers, *sections])
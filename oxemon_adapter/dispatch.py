@@ -0,0 +1,90 @@
+from typing import Callable, Dict, Iterable, Optional
+
+import converter
+import icd
+from adapter_metrics import IGNORED_EVENTS
+from rate_limits import TokenBucket
+
+# Counters and labels both carry a single value (see `icd.EmitCounter` and `icd.EmitLabel`)
+_VALUE_INDEX = 0
+
+# How the updates of a coupling are aggregated while coalescing (see `coalescer.UpdateCoalescer`)
+AGGREGATE_SUM = "sum"  # Counters: their deltas are summed
+AGGREGATE_LAST = "last"  # Gauges and enums: only their last value is applied
+AGGREGATE_NONE = "none"  # Distributions: every value counts, so they're applied right away
+
+
+def dispatch_key(module_id: int, event_id: int) -> int:
+    """
+    Packs a `(module_id, event_id)` pair (both are UInt32 in the ICD) into a single integer key.
+    """
+    return (module_id << 32) | event_id
+
+
+class DispatchIndex:
+    """
+    Routes decoded emits straight from their raw ids to the metric that should be updated.
+
+    Built once (at startup) from the dictionary and the event registry, so routing a counter/label takes a single
+    dict lookup without any string work. Logs still need their strings, so they are converted to `EventUpdate`s.
+    """
+    def __init__(self, conversion_map: converter.ConversionMap, log_templates: Dict[int, converter.LogTemplate],
+                 updaters: Dict[int, Callable[[int], None]], aggregations: Dict[int, str], module_ids: Iterable[int],
+                 event_ids: Iterable[int], limits: Optional[Dict[int, TokenBucket]] = None):
+        self.conversion_map = conversion_map
+        self.log_templates = log_templates
+        self.updaters = updaters
+        # The `AGGREGATE_*` of every updater's coupling
+        self.aggregations = aggregations
+        # The rate limits of (some of) the updaters' couplings, shared by every thread that dispatches
+        self.limits = limits or {}
+        self.module_ids = frozenset(module_ids)
+        self.event_ids = frozenset(event_ids)
+
+    def is_known(self, module_id: int, event_id: int) -> bool:
+        """
+        Whether both ids are in the dictionary (stream transports use it to find emit boundaries).
+        """
+        return module_id in self.module_ids and (event_id in self.event_ids or event_id in self.log_templates)
+
+    def ignore(self, record: icd.EmitRecord):
+        """
+        Handles an emit that has no configured metric (known ids) or raises for unknown ids.
+        """
+        if record.module_id not in self.module_ids:
+            raise converter.UnknownIdError("module")
+        if record.event_id not in self.event_ids:
+            raise converter.UnknownIdError("event")
+        IGNORED_EVENTS.inc()
+
+    def dispatch(self, record: icd.EmitRecord) -> Optional[converter.EventUpdate]:
+        """
+        Updates the metric of a counter/label emit, or returns the `EventUpdate` of a log emit.
+        """
+        if record.body_type is icd.EmitLog:
+            return converter.convert_record(record, self.conversion_map, self.log_templates)
+
+        key = dispatch_key(record.module_id, record.event_id)
+        updater = self.updaters.get(key)
+        if updater is None:
+            self.ignore(record)
+        elif not self.limits or self._within_limit(key):
+            updater(record.body[_VALUE_INDEX])
+        return None
+
+    def route(self, record: icd.EmitRecord) -> Optional[Callable[[int], None]]:
+        """
+        Same as `dispatch` for a counter/label emit, without updating its metric: returns the metric's updater, or
+        `None` when the emit is ignored or shed (so that the routing and the update can be timed apart).
+        """
+        key = dispatch_key(record.module_id, record.event_id)
+        updater = self.updaters.get(key)
+        if updater is None:
+            self.ignore(record)
+        elif not self.limits or self._within_limit(key):
+            return updater
+        return None
+
+    def _within_limit(self, key: int) -> bool:
+        bucket = self.limits.get(key)
+        return bucket is None or bucket.allow()
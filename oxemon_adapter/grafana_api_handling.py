@@ -1,7 +1,9 @@
+import os
 import requests
 import time
 import json
 import re
+from pathlib import Path
 
 GRAFANA_URL = "http://grafana:3000"
 ADMIN_USER = "admin"
@@ -9,19 +11,64 @@ ADMIN_PASSWORD = "admin"
 SERVICE_ACCOUNT_NAME = "my-service-account"
 TOKEN_NAME = "my-service-token"
 
+# The token is kept in the (mounted) configuration folder, so that restarts reuse it instead of minting a new one
+TOKEN_PATH = Path("config/.grafana_token")
+
+# Readiness is polled with exponential backoff, starting fast (for warm restarts) and giving up at the deadline
+READY_INITIAL_DELAY = 0.05
+READY_MAX_DELAY = 2
+READY_DEADLINE = 120
+
 auth = (ADMIN_USER, ADMIN_PASSWORD)
 headers = {"Content-Type": "application/json"}
 
-def wait_for_grafana():
+
+def is_grafana_ready() -> bool:
+    try:
+        r = requests.get(f"{GRAFANA_URL}/api/health", timeout=2)
+        return r.status_code == 200 and r.json().get("database") == "ok"
+    except Exception:
+        return False
+
+
+def wait_for_grafana(deadline: float = READY_DEADLINE):
     print("Waiting for Grafana to be ready...")
+    give_up_time = time.monotonic() + deadline
+    delay = READY_INITIAL_DELAY
     while True:
-        try:
-            r = requests.get(f"{GRAFANA_URL}/api/health", auth=auth)
-            if r.status_code == 200 and r.json().get("database") == "ok":
-                break
-        except Exception:
-            pass
-        time.sleep(2)
+        if is_grafana_ready():
+            return
+        if time.monotonic() + delay > give_up_time:
+            raise TimeoutError(f"Grafana wasn't ready within {deadline} seconds")
+        time.sleep(delay)
+        delay = min(delay * 2, READY_MAX_DELAY)
+
+
+def load_token():
+    try:
+        return TOKEN_PATH.read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def save_token(api_token: str):
+    """
+    Saves the token for the next starts (only readable by its owner, and replaced atomically).
+    """
+    temporary_path = TOKEN_PATH.with_name(TOKEN_PATH.name + ".tmp")
+    file_descriptor = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(file_descriptor, "w") as f:
+        f.write(api_token)
+    os.replace(temporary_path, TOKEN_PATH)
+
+
+def is_token_valid(api_token: str) -> bool:
+    """
+    Checks the token with a single cheap call (which also needs the permissions the adapter uses).
+    """
+    response = requests.get(f"{GRAFANA_URL}/api/search", params={"limit": 1},
+                            headers={"Authorization": f"Bearer {api_token}"}, timeout=5)
+    return response.status_code == 200
 
 
 def get_service_account_id_by_name(name):
@@ -67,9 +114,7 @@ def create_service_account():
     
     # Unknown error
     else:
-        print("Failed to create service account.")
-        print(response.status_code, response.text)
-        exit(1)    
+        raise RuntimeError(f"Failed to create service account: {response.status_code} {response.text}")
 
 
 def create_token(service_account_id):
@@ -91,12 +136,23 @@ def create_token(service_account_id):
         delete_existing_tokens(service_account_id)
         return create_token(service_account_id)
     else:
-        print("Failed to create token.")
-        print(response.status_code, response.text)
-        exit(1)
+        raise RuntimeError(f"Failed to create token: {response.status_code} {response.text}")
 
 
 def create_grafana_api_key():
+    """
+    Returns the saved token if it's still valid, and otherwise creates (and saves) a new one.
+    """
     wait_for_grafana()
+    api_token = load_token()
+    if api_token is not None and is_token_valid(api_token):
+        return api_token
+
+    print("No valid saved Grafana token, creating a new one")
     sa_id = create_service_account()
-    return create_token(sa_id)
+    api_token = create_token(sa_id)
+    try:
+        save_token(api_token)
+    except OSError as e:
+        print(f"❌ Failed to save the Grafana token (it will be created again on the next start): {e}")
+    return api_token
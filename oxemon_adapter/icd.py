@@ -1,4 +1,7 @@
-from hydration import Struct, UInt8, UInt32, UInt64, Enum, OpcodeField, Endianness, Vector
+import struct
+from typing import List
+from hydration import Struct, UInt8, UInt16, UInt32, UInt64, Enum, OpcodeField, Endianness, Vector
+from hydration.scalars import Scalar
 
 
 class EmitCounter(Struct):
@@ -14,11 +17,24 @@ class EmitLog(Struct):
     params = Vector("param_count", UInt64)
 
 
+class EmitFrame(Struct):
+    """
+    A container of several emits: followed by `record_count` back-to-back emits (each is an `EmitHeader` and its body).
+    Its own header's module and event ids are unused (0).
+    """
+    version = UInt8
+    record_count = UInt16
+
+
+FRAME_VERSION = 1
+
 OPCODE_DICTIONARY = {
     EmitCounter: 0,
     EmitLabel: 1,
     EmitLog: 2,
+    EmitFrame: 3,
 }
+FRAME_OPCODE = OPCODE_DICTIONARY[EmitFrame]
 
 
 class EmitHeader(Struct, endianness=Endianness.NativeEndian):
@@ -27,13 +43,194 @@ class EmitHeader(Struct, endianness=Endianness.NativeEndian):
     event_type = OpcodeField(UInt8, OPCODE_DICTIONARY)
 
 
+OPCODE_TO_STRUCT = {value: struct_class for (struct_class, value) in OPCODE_DICTIONARY.items()}
+
+
 def read_message(data: bytes):
     header = EmitHeader.from_bytes(data)
 
-    opposite_map = {value: struct for (struct, value) in OPCODE_DICTIONARY.items()}
-    if header.event_type.value not in opposite_map:
+    if header.event_type.value not in OPCODE_TO_STRUCT:
         raise ValueError(f"Unexpected event type: {header.event_type}")
     
-    body = opposite_map[header.event_type.value].from_bytes(data[len(header):])
+    body = OPCODE_TO_STRUCT[header.event_type.value].from_bytes(data[len(header):])
 
     return header / body
+
+
+class DecodeError(ValueError):
+    """
+    Raised for malformed messages, `reason` is a short machine-readable description (used for metrics).
+    """
+    def __init__(self, message: str, reason: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+# -- Precompiled fast path --------------------------------------------------------------------------------------------
+# `read_message` above builds hydration objects for every datagram, which is too slow for the packet rates we see.
+# The layouts below are generated once (at import time) from the very same struct definitions, so the ICD is still
+# defined in a single place.
+
+class EmitRecord:
+    """
+    A lightweight decoded emit.
+
+    `body` holds the body's field values in definition order (vectors are decoded as tuples), e.g. `(counter_value,)`
+    for `EmitCounter` or `(param_count, params)` for `EmitLog`.
+    """
+    __slots__ = ("module_id", "event_id", "body_type", "body")
+
+    def __init__(self, module_id: int, event_id: int, body_type: type, body: tuple):
+        self.module_id = module_id
+        self.event_id = event_id
+        self.body_type = body_type
+        self.body = body
+
+    def __eq__(self, other):
+        return (isinstance(other, EmitRecord) and
+                (self.module_id, self.event_id, self.body_type, self.body) ==
+                (other.module_id, other.event_id, other.body_type, other.body))
+
+    def __repr__(self):
+        return (f"EmitRecord(module_id={self.module_id}, event_id={self.event_id}, "
+                f"body_type={self.body_type.__name__}, body={self.body})")
+
+
+def _field_format(field) -> str:
+    """
+    Returns the `struct` format character of a hydration scalar (or opcode) field.
+    """
+    field = getattr(field, "data_field", field)  # OpcodeField wraps its scalar
+    if not isinstance(field, Scalar):
+        raise NotImplementedError(f"Unsupported field for the fast decoder: {field!r}")
+    return field.scalar_format
+
+
+def _field_endianness(field) -> str:
+    field = getattr(field, "data_field", field)
+    # The default endianness ('') also implies native alignment, which hydration never applies (it packs every
+    # scalar on its own). '=' keeps the native byte order without the padding.
+    return field.endianness_format or Endianness.NativeEndian.value
+
+
+def _scalars_layout(struct_class, fields) -> struct.Struct:
+    endianness = {_field_endianness(field) for field in fields}
+    if len(endianness) > 1:
+        raise NotImplementedError(f"Mixed endianness is not supported by the fast decoder ({struct_class.__name__})")
+    endianness = endianness.pop() if endianness else Endianness.NativeEndian.value
+
+    return struct.Struct(endianness + "".join(_field_format(field) for field in fields))
+
+
+def _compile_struct(struct_class):
+    """
+    Compiles a hydration struct into a decoding function `(buffer, offset) -> (values, new_offset)`.
+
+    Supports structs made of scalars, optionally ending with a single `Vector` whose length is given by a
+    preceding scalar field (which is what the ICD uses).
+    """
+    fields = [getattr(struct_class, name) for name in struct_class._field_names]
+
+    vector = None
+    if fields and isinstance(fields[-1], Vector):
+        vector = fields.pop()
+
+    layout = _scalars_layout(struct_class, fields)
+    unpack_from = layout.unpack_from
+    size = layout.size
+
+    if vector is None:
+        def decode(buffer, offset):
+            return unpack_from(buffer, offset), offset + size
+        return decode
+
+    length_index = struct_class._field_names.index(vector.length_field_name)
+    item_format = _field_format(vector.type)
+    item_endianness = _field_endianness(vector.type)
+    item_size = struct.calcsize(item_endianness + item_format)
+    vector_layouts = {}
+
+    def decode(buffer, offset):
+        values = unpack_from(buffer, offset)
+        count = values[length_index]
+        try:
+            vector_layout = vector_layouts[count]
+        except KeyError:
+            vector_layout = vector_layouts[count] = struct.Struct(f"{item_endianness}{count}{item_format}")
+        offset += size
+        return values + (vector_layout.unpack_from(buffer, offset),), offset + count * item_size
+
+    return decode
+
+
+HEADER_LAYOUT = _scalars_layout(EmitHeader, [getattr(EmitHeader, name) for name in EmitHeader._field_names])
+HEADER_SIZE = HEADER_LAYOUT.size
+
+# Opcode -> (body struct, body decoder), built once
+DECODERS = {
+    opcode: (struct_class, _compile_struct(struct_class))
+    for (struct_class, opcode) in OPCODE_DICTIONARY.items()
+}
+
+
+def _decode_record(data, offset: int):
+    """
+    Decodes the emit at `offset`, returns it and the offset right after it.
+    """
+    try:
+        module_id, event_id, event_type = HEADER_LAYOUT.unpack_from(data, offset)
+    except struct.error as e:
+        raise DecodeError("Truncated message header", "truncated_header") from e
+
+    try:
+        body_type, decode_body = DECODERS[event_type]
+    except KeyError:
+        raise DecodeError(f"Unexpected event type: {event_type}", "unknown_event_type") from None
+
+    try:
+        body, end = decode_body(data, offset + HEADER_SIZE)
+    except struct.error as e:
+        raise DecodeError(f"Truncated {body_type.__name__} body", "truncated_body") from e
+
+    return EmitRecord(module_id, event_id, body_type, body), end
+
+
+def decode_message(data, offset: int = 0) -> EmitRecord:
+    """
+    Decodes a single emit from `data` (bytes, bytearray or memoryview) without copying it.
+
+    Equivalent to `read_message`, but returns an `EmitRecord` (and raises `DecodeError` for malformed messages).
+    """
+    record, _ = _decode_record(data, offset)
+    return record
+
+
+def decode_messages(data) -> List[EmitRecord]:
+    """
+    Decodes all the emits of a datagram, which is either a single emit or an `EmitFrame`.
+
+    A frame is all-or-nothing: if any of its records is malformed, the whole frame is rejected.
+    """
+    record, offset = _decode_record(data, 0)
+    if record.body_type is not EmitFrame:
+        return [record]
+
+    version, record_count = record.body
+    if version != FRAME_VERSION:
+        raise DecodeError(f"Unsupported frame version: {version}", "unsupported_frame_version")
+
+    records = []
+    for _ in range(record_count):
+        record, offset = _decode_record(data, offset)
+        if record.body_type is EmitFrame:
+            raise DecodeError("Frames can't be nested", "nested_frame")
+        records.append(record)
+    return records
+
+
+def build_frame(messages: List[bytes]) -> bytes:
+    """
+    Packs several encoded emits into a single frame datagram (this is how an agent batches its emits).
+    """
+    frame = EmitHeader(module_id=0, event_id=0) / EmitFrame(version=FRAME_VERSION, record_count=len(messages))
+    return bytes(frame) + b"".join(messages)
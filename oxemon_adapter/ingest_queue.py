@@ -0,0 +1,114 @@
+import threading
+from collections import deque
+from typing import List, Tuple
+
+import icd
+from adapter_metrics import QUEUE_DEPTH, QUEUE_DROPS
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+PRIORITIZE_METRICS = "prioritize_metrics"
+POLICIES = {DROP_OLDEST, DROP_NEWEST, PRIORITIZE_METRICS}
+
+# The opcode is the last field of the header, so the kind of an emit is known without decoding it
+_EVENT_TYPE_OFFSET = icd.HEADER_SIZE - 1
+_LOG_OPCODE = icd.OPCODE_DICTIONARY[icd.EmitLog]
+
+_METRIC_DROPS = QUEUE_DROPS.labels(kind="metric")
+_LOG_DROPS = QUEUE_DROPS.labels(kind="log")
+
+
+def _is_log(data: bytes) -> bool:
+    return len(data) > _EVENT_TYPE_OFFSET and data[_EVENT_TYPE_OFFSET] == _LOG_OPCODE
+
+
+class IngestQueue:
+    """
+    A bounded queue of received `(data, addr)` datagrams, between the receiving thread and the sink threads.
+
+    When full, the overload `policy` decides what is dropped:
+    - `drop_oldest`: The oldest queued datagram.
+    - `drop_newest`: The datagram being added.
+    - `prioritize_metrics`: Logs are dropped before counters/labels (the oldest log, or the new one if it's a log),
+        and counters/labels are handled before logs.
+    """
+    def __init__(self, capacity: int, policy: str):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue policy {policy}, expected one of {POLICIES}")
+        self.capacity = capacity
+        self.policy = policy
+        self._metrics = deque()
+        self._logs = deque()  # Only used with `prioritize_metrics`
+        self._closed = False
+        self._not_empty = threading.Condition(threading.Lock())
+
+    def __len__(self):
+        return len(self._metrics) + len(self._logs)
+
+    def _drop_one(self, data) -> bool:
+        """
+        Makes room for `data` in a full queue, returns whether `data` should be added.
+        """
+        if self.policy == DROP_NEWEST:
+            (_LOG_DROPS if _is_log(data) else _METRIC_DROPS).inc()
+            return False
+
+        if self.policy == PRIORITIZE_METRICS:
+            if self._logs:
+                self._logs.popleft()
+                _LOG_DROPS.inc()
+                return True
+            if _is_log(data):
+                _LOG_DROPS.inc()
+                return False
+
+        dropped, _ = self._metrics.popleft()
+        (_LOG_DROPS if _is_log(dropped) else _METRIC_DROPS).inc()
+        return True
+
+    def put_many(self, items: List[Tuple[bytes, tuple]]):
+        """
+        Adds datagrams to the queue (never blocks, drops according to the policy instead).
+        """
+        prioritize = self.policy == PRIORITIZE_METRICS
+        with self._not_empty:
+            for item in items:
+                if len(self) >= self.capacity and not self._drop_one(item[0]):
+                    continue
+                if prioritize and _is_log(item[0]):
+                    self._logs.append(item)
+                else:
+                    self._metrics.append(item)
+            QUEUE_DEPTH.set(len(self))
+            self._not_empty.notify()
+
+    def get_many(self, max_items: int, timeout: float) -> List[Tuple[bytes, tuple]]:
+        """
+        Takes up to `max_items` datagrams (counters/labels first), waiting up to `timeout` seconds for the first.
+
+        Returns an empty list on timeout, or once the queue is closed and empty.
+        """
+        with self._not_empty:
+            if not len(self) and not self._closed:
+                self._not_empty.wait(timeout)
+
+            items = []
+            for source in (self._metrics, self._logs):
+                while source and len(items) < max_items:
+                    items.append(source.popleft())
+            QUEUE_DEPTH.set(len(self))
+            if len(self):
+                self._not_empty.notify()
+            return items
+
+    def close(self):
+        """
+        Wakes up all the consumers, which drain what's left and stop.
+        """
+        with self._not_empty:
+            self._closed = True
+            self._not_empty.notify_all()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
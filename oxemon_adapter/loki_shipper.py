@@ -0,0 +1,179 @@
+import asyncio
+import gzip
+import json
+import threading
+import time
+from collections import deque, defaultdict
+from concurrent.futures import Executor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from adapter_metrics import LOKI_PUSH_LATENCY, LOKI_PUSH_FAILURES, LOKI_DROPPED_LINES
+from loop_event import LoopEvent
+
+LOKI_PUSH_PATH = "/loki/api/v1/push"
+LOG_LEVEL = "info"
+
+# After a failed push, the next one waits with exponential backoff (in seconds)
+INITIAL_RETRY = 0.5
+MAX_RETRY = 30
+
+
+class LokiShipper:
+    """
+    Ships log lines to Loki from a background thread.
+
+    `push` only appends to an in-memory buffer, so the receive loop never waits for Loki.
+    The buffer is flushed (as one request, with one stream per module) once it holds `batch_size` lines,
+    or every `flush_interval` seconds. A batch that failed is put back at the front of the buffer and pushed again
+    after a backoff, and while Loki is down or falls behind, the oldest lines beyond `max_pending` are dropped.
+    The buffer is shared by the pushing threads and the shipping one, which change it under `_lock`.
+    """
+    def __init__(self, base_url: str, *, batch_size: int, flush_interval: float, max_pending: int,
+                 timeout: float = 5):
+        self.push_url = f"{base_url}{LOKI_PUSH_PATH}"
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.max_pending = max_pending
+
+        self._lock = threading.Lock()
+        self._pending = deque()
+        self._retry_delay = INITIAL_RETRY
+        self._retry_at = 0
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="loki-shipper", daemon=True)
+
+        self._session = requests.Session()
+        self._session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self._session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self._session.headers.update({"Content-Type": "application/json", "Content-Encoding": "gzip"})
+
+    def start(self):
+        self._thread.start()
+
+    def request_stop(self):
+        """
+        Makes the shipping (thread or task) flush whatever is still pending, and return.
+        """
+        self._stopped.set()
+        self._wakeup.set()
+
+    def stop(self):
+        """
+        Stops the shipping thread, after flushing whatever is still pending.
+        """
+        self.request_stop()
+        self._thread.join()
+        self._session.close()
+
+    async def run_async(self, executor: Executor):
+        """
+        Ships from an asyncio task instead of the shipping thread (with the pushes running in `executor`), until
+        `request_stop` is called.
+        """
+        loop = asyncio.get_running_loop()
+        wakeup = self._wakeup = LoopEvent(loop)
+        while not self._stopped.is_set():
+            await wakeup.wait(self.flush_interval)
+            wakeup.clear()
+            if self._pending:
+                await loop.run_in_executor(executor, self.flush)
+        await loop.run_in_executor(executor, self.flush)
+        self._session.close()
+
+    def push(self, module: str, line: str):
+        entry = (module, str(time.time_ns()), line)
+        pending = self._pending
+        with self._lock:
+            full = len(pending) >= self.max_pending
+            if full:
+                pending.popleft()
+            pending.append(entry)
+            pending_count = len(pending)
+        if full:
+            LOKI_DROPPED_LINES.inc()
+        if pending_count >= self.batch_size:
+            self._wakeup.set()
+
+    def _take_pending(self, limit: int) -> list:
+        pending = self._pending
+        with self._lock:
+            return [pending.popleft() for _ in range(min(len(pending), limit))]
+
+    @staticmethod
+    def build_payload(lines: list) -> dict:
+        """
+        Groups `(module, timestamp, line)` tuples into one Loki stream per module.
+        """
+        streams = defaultdict(list)
+        for module, timestamp, line in lines:
+            streams[module].append([timestamp, line])
+
+        return {
+            "streams": [
+                {"stream": {"module": module, "level": LOG_LEVEL}, "values": values}
+                for module, values in streams.items()
+            ]
+        }
+
+    def flush(self):
+        """
+        Ships the pending lines, unless a failed push is still backing off (then nothing is shipped, except when
+        stopping, which tries once more).
+        """
+        if time.monotonic() < self._retry_at and not self._stopped.is_set():
+            return
+        while self._pending:
+            lines = self._take_pending(self.batch_size)
+            if not self._ship(lines):
+                self._put_back(lines)
+                self._retry_at = time.monotonic() + self._retry_delay
+                self._retry_delay = min(self._retry_delay * 2, MAX_RETRY)
+                return
+        self._retry_delay = INITIAL_RETRY
+
+    def _put_back(self, lines: list):
+        """
+        Puts the lines of a failed push back at the front of the buffer, dropping the oldest ones that don't fit.
+        """
+        pending = self._pending
+        with self._lock:
+            # The lines of the batch are older than those pushed since, so they're the ones dropped
+            overflow = max(0, len(lines) - (self.max_pending - len(pending)))
+            pending.extendleft(reversed(lines[overflow:]))
+        if overflow:
+            LOKI_DROPPED_LINES.inc(overflow)
+
+    def _ship(self, lines: list) -> bool:
+        """
+        Pushes the lines, returning whether they're done with (False when they should be pushed again).
+        """
+        body = gzip.compress(json.dumps(self.build_payload(lines)).encode(), compresslevel=1)
+        try:
+            with LOKI_PUSH_LATENCY.time():
+                response = self._session.post(self.push_url, data=body, timeout=self.timeout)
+        except requests.RequestException as e:
+            error = str(e)
+        else:
+            if response.status_code < 300:
+                return True
+            error = f"{response.status_code} {response.text}"
+            # Loki rejects these for good (e.g. out of order or too old entries), only overload is retried
+            if response.status_code < 500 and response.status_code != 429:
+                LOKI_PUSH_FAILURES.inc()
+                LOKI_DROPPED_LINES.inc(len(lines))
+                print(f"❌ Loki rejected {len(lines)} log lines (dropped): {error}")
+                return True
+        LOKI_PUSH_FAILURES.inc()
+        print(f"❌ Failed to push {len(lines)} log lines to Loki (kept to retry): {error}")
+        return False
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+        self.flush()
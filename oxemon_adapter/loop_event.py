@@ -0,0 +1,41 @@
+"""
+Waking up asyncio tasks from any thread (for the `asyncio` runtime, see `OXEMON_RUNTIME`).
+"""
+import asyncio
+import threading
+from typing import Optional
+
+
+class LoopEvent:
+    """
+    An asyncio event that can be set from any thread, like a `threading.Event` (e.g. by a stream transport's thread).
+    It must be created on the event loop's thread.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._loop_thread = threading.get_ident()
+        self._event = asyncio.Event()
+
+    def set(self):
+        if self._event.is_set():
+            return
+        if threading.get_ident() == self._loop_thread:
+            self._event.set()
+        else:
+            self._loop.call_soon_threadsafe(self._event.set)
+
+    def clear(self):
+        self._event.clear()
+
+    def is_set(self) -> bool:
+        return self._event.is_set()
+
+    async def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until the event is set, or for `timeout` seconds. Returns whether it's set.
+        """
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self._event.is_set()
@@ -1,35 +1,82 @@
-import time
+# `settings` must be imported before `prometheus_client` (it may turn on the multiprocess mode)
+import settings
 import yaml
-from prometheus_client import start_http_server, Counter, Gauge
+from prometheus_client import Counter, Gauge, REGISTRY
+import asyncio
 import signal
-import requests
+import threading
+import time
 
 import socket
 import json
+from pathlib import Path
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+import adapter_metrics
 import converter
-from upload_dashboards import upload_module_dashboards, load_module_dashboards
+import grafana_api_handling
+import rate_limits
+import readiness
+import icd
+import transports
+import workers
+from receiver import BatchReceiver
+from capture import CaptureWriter
+from ingest_queue import IngestQueue
+from loki_shipper import LokiShipper
+from loop_event import LoopEvent
+from remote_write import RemoteWriteSink
+from sketch import DistributionFamily, DistributionSeries
+import dictionary_index
+from dictionary_index import DictionaryIndex
+from dispatch import AGGREGATE_LAST, AGGREGATE_NONE, AGGREGATE_SUM, DispatchIndex, dispatch_key
+from coalescer import UpdateCoalescer
+from compact_metrics import CompactCounter, CompactGauge, CompactMetricStore, CounterSlot
+from metrics_server import start_http_server
+import reload
+from reload import ConfigWatcher
+from upload_dashboards import upload_module_dashboards, load_dashboard, dashboard_content_hash
 
 
 EVENT_REGISTRY_PATH = "config/event_registry.yaml"
 DICTIONARY_PATH = "config/oxemon_dictionary.json"
+DICTIONARY_INDEX_PATH = "config/oxemon_dictionary.idx"
 DASHBOARDS_PATH = "config/dashboards/"
+MANIFEST_PATH = f"config/{reload.MANIFEST_NAME}"
 
 LISTEN_IP = "0.0.0.0"
 LISTEN_PORT = 1414
+METRICS_PORT = 8000
+
+# Dashboard provisioning is retried with exponential backoff (in seconds) until Grafana is reachable
+PROVISION_INITIAL_RETRY = 1
+PROVISION_MAX_RETRY = 60
 
 LOKI_BASE_URL = "http://loki:3100"
-LOKI_LOG_MESSAGE_TEMPLATE = {
-    "streams": [{
-        "stream": {
-            "module": "module",
-            "level": "info"
-        },
-        "values": [["", "message"]]
-    }]
-}
 
+# Threads running the blocking requests of the sinks and of the provisioning (`asyncio` runtime)
+ASYNC_IO_THREADS = 4
+
+metric_families = {}
 metric_instances = {}
+# Holds the emitted metrics instead of prometheus_client, when OXEMON_METRICS_STORE is "compact"
+compact_store = CompactMetricStore()
+dispatch_index = None
+loki_shipper = None
+remote_write_sink = None
+# Appends every received datagram to a capture file, when OXEMON_CAPTURE_PATH is set
+capture_writer = None
+# Sheds the datagrams of sources over their rate limit, when the event registry has `source_rate_limits`
+source_limiter = None
+# The rate limits of (module, event) couplings in the event registry, by `(event name, module name)`
+emit_limits = {}
 shutdown = False
+messages_until_latency_sample = 0
+
+
+metrics_watcher = None
+dashboards_watcher = None
+uploaded_dashboard_hashes = {}
 
 
 def handle_signal(signum, frame):
@@ -38,40 +85,106 @@ def handle_signal(signum, frame):
     shutdown = True
 
 
+def handle_reload_signal(signum, frame):
+    for watcher in (metrics_watcher, dashboards_watcher):
+        if watcher is not None:
+            watcher.request_reload()
+    workers.signal_workers(signum)
+
+
 # Very basic sanitization for Prometheus metric names (same as in `generate_grafana_dashboards_from_input_config.py`)
 def replace_whitespace(name):
     return name.strip().lower().replace(" ", "_")
 
 
-def get_string_of_current_time():
-    return str(int(time.time() * 1e9))
-
-
 def load_registry(path):
     with open(path, "r") as f:
         return yaml.safe_load(f)
 
 
-def create_metric_families(registry_data):
-    for event_id, event_data in registry_data.items():
-        metric_family_name = replace_whitespace(event_id)
-        metric_type = event_data["type"]
+def _metric_class(metric_type):
+    compact = settings.METRICS_STORE == "compact"
+    if metric_type == "counter":
+        return CompactCounter if compact else Counter
+    elif metric_type == "gauge" or metric_type == "enum":
+        return CompactGauge if compact else Gauge
+    elif metric_type == "distribution":
+        if settings.WORKERS > 1:
+            raise ValueError("Distributions are sketched by a single process, OXEMON_WORKERS must be 1")
+        return DistributionFamily
+    raise ValueError(f"Unsupported metric type: {metric_type}")
 
-        if metric_type == "counter":
-            metric_family = Counter(metric_family_name, event_id, ["module"])
 
-        elif metric_type == "gauge" or metric_type == "enum":
-            metric_family = Gauge(metric_family_name, event_id, ["module"])
+def _is_counter(metric) -> bool:
+    return isinstance(metric, (Counter, CounterSlot))
 
-        else:
-            raise ValueError(f"Unsupported metric type: {metric_type}")
 
-        metric_instances[metric_family_name] = {}
+def _updater(metric) -> tuple:
+    """
+    The method that applies an emitted value to `metric`, and how its updates are coalesced: counters are increased
+    by it (summed), distributions observe it (every value), and gauges (and enums) are set to it (the last value).
+    """
+    if _is_counter(metric):
+        return metric.inc, AGGREGATE_SUM
+    if isinstance(metric, DistributionSeries):
+        return metric.observe, AGGREGATE_NONE
+    return metric.set, AGGREGATE_LAST
+
 
-        for module_id in event_data["modules"]:
-            module_name = replace_whitespace(module_id)
-            metric_instance = metric_family.labels(module=module_name)
-            metric_instances[metric_family_name][module_name] = metric_instance
+def create_metric_families(registry_data):
+    """
+    Creates the metric families of the given registry (or updates the existing ones to match it).
+
+    Only families that were removed or changed their type are unregistered, and only modules that were removed
+    from a family are removed from it. Everything else (and its value) is left untouched.
+    """
+    wanted_families = {replace_whitespace(event_id): (event_id, event_data)
+                       for event_id, event_data in registry_data.items()
+                       if event_id != rate_limits.SOURCE_RATE_LIMITS_KEY}
+    wanted_classes = {name: _metric_class(event_data["type"]) for name, (_, event_data) in wanted_families.items()}
+
+    for metric_family_name, metric_family in list(metric_families.items()):
+        if wanted_classes.get(metric_family_name) is not type(metric_family):
+            if isinstance(metric_family, (CompactCounter, CompactGauge)):
+                metric_family.unregister()
+            else:
+                REGISTRY.unregister(metric_family)
+            del metric_families[metric_family_name]
+            del metric_instances[metric_family_name]
+
+    for metric_family_name, (event_id, event_data) in wanted_families.items():
+        metric_family = metric_families.get(metric_family_name)
+        if metric_family is None:
+            if wanted_classes[metric_family_name] in (CompactCounter, CompactGauge):
+                metric_family = wanted_classes[metric_family_name](metric_family_name, event_id, compact_store)
+            elif wanted_classes[metric_family_name] is DistributionFamily:
+                metric_family = DistributionFamily(metric_family_name, event_id, settings.DISTRIBUTION_WINDOW)
+            elif wanted_classes[metric_family_name] is Counter:
+                metric_family = Counter(metric_family_name, event_id, ["module"])
+            else:
+                # With several workers, the value shown is the one set most recently (by any worker)
+                metric_family = Gauge(metric_family_name, event_id, ["module"], multiprocess_mode="mostrecent")
+            metric_families[metric_family_name] = metric_family
+            metric_instances[metric_family_name] = {}
+
+        module_instances = metric_instances[metric_family_name]
+        module_names = {replace_whitespace(module_id) for module_id in event_data["modules"]}
+        for module_name in set(module_instances) - module_names:
+            metric_family.remove(module_name)
+            del module_instances[module_name]
+
+        for module_name in module_names - set(module_instances):
+            module_instances[module_name] = metric_family.labels(module=module_name)
+
+
+def load_rate_limits(registry_data):
+    """
+    Replaces the rate limits with those of the given registry (their buckets start over).
+    """
+    global source_limiter, emit_limits
+    emit_limits = {(replace_whitespace(event_id), replace_whitespace(module_id)): limit
+                   for (event_id, module_id), limit in rate_limits.emit_rate_limits(registry_data).items()}
+    source_limiter = rate_limits.create_source_limiter(registry_data)
 
 
 def push_event(event: converter.EventUpdate):
@@ -79,73 +192,663 @@ def push_event(event: converter.EventUpdate):
     event_name = replace_whitespace(event.event_name)
 
     if event.event_type == "log":
-        log_message = LOKI_LOG_MESSAGE_TEMPLATE
-        log_message["streams"][0]["stream"]["module"] = module_name
-        log_message["streams"][0]["values"] = [[get_string_of_current_time(), event.event_name]]
-        requests.post(f"{LOKI_BASE_URL}/loki/api/v1/push", json=log_message, timeout = 5)
+        loki_shipper.push(module_name, event.event_name)
         return
 
     try:
         metric = metric_instances[event_name][module_name]
-        if isinstance(metric, Counter):
-            print(f"setting counter {metric} to {event.value}")
+        if _is_counter(metric):
+            if settings.LOG_PACKETS:
+                print(f"setting counter {metric} to {event.value}")
             metric.inc(event.value)
+        elif isinstance(metric, DistributionSeries):
+            if settings.LOG_PACKETS:
+                print(f"observing {event.value} in distribution {metric}")
+            metric.observe(event.value)
         else:
-            print(f"setting enum {metric} to {event.value}")
+            if settings.LOG_PACKETS:
+                print(f"setting enum {metric} to {event.value}")
             metric.set(event.value)
     except KeyError:
         pass
 
 
-def main_metric_updates():
-    global shutdown
-    with open(DICTIONARY_PATH, "r") as f:
-        hash_converter = converter.create_conversion_map(json.load(f))
+def load_dictionary() -> DictionaryIndex:
+    """
+    Loads the dictionary: memory-maps its index (compiled by `make config`), unless it's missing or doesn't match
+    the dictionary (e.g. a dictionary that was copied by hand), in which case the dictionary is compiled in memory.
+    """
+    with open(DICTIONARY_PATH, "rb") as f:
+        content = f.read()
+    source_hash = dictionary_index.dictionary_source_hash(content)
+    try:
+        index = DictionaryIndex.open(DICTIONARY_INDEX_PATH)
+        if index.source_hash == source_hash:
+            return index
+        print(f"❌ {DICTIONARY_INDEX_PATH} doesn't match {DICTIONARY_PATH} (re-run `make config`), compiling it")
+    except (OSError, ValueError):
+        pass
+    return DictionaryIndex.from_dictionary(json.loads(content), source_hash)
+
+
+def create_dispatch_index(oxemon_dictionary: DictionaryIndex) -> DispatchIndex:
+    """
+    Binds the raw ids of every configured (module, event) pair to the update method of its metric (and to its rate
+    limit, if it has one).
+    """
+    updaters = {}
+    aggregations = {}
+    limits = {}
+    for event_name, module_metrics in metric_instances.items():
+        event_hashes = oxemon_dictionary.events.hashes_of(event_name)
+        for module_name, metric in module_metrics.items():
+            updater, aggregation = _updater(metric)
+            limit = emit_limits.get((event_name, module_name))
+            bucket = None if limit is None else rate_limits.create_emit_bucket(limit, event_name, module_name)
+            for event_hash in event_hashes:
+                for module_hash in oxemon_dictionary.modules.hashes_of(module_name):
+                    key = dispatch_key(module_hash, event_hash)
+                    updaters[key] = updater
+                    aggregations[key] = aggregation
+                    if bucket is not None:
+                        limits[key] = bucket
+
+    return DispatchIndex(
+        conversion_map=oxemon_dictionary,
+        log_templates=converter.create_log_templates(oxemon_dictionary),
+        updaters=updaters,
+        aggregations=aggregations,
+        module_ids=oxemon_dictionary.modules,
+        event_ids=oxemon_dictionary.events,
+        limits=limits,
+    )
+
+
+def handle_message_timed(data, dispatch_index: DispatchIndex):
+    """
+    Same as `handle_message`, while measuring the latency of every stage.
+    """
+    start = time.perf_counter()
+    records = icd.decode_messages(data)
+    decoded = time.perf_counter()
+    adapter_metrics.DECODE_LATENCY.observe(decoded - start)
+
+    for record in records:
+        if settings.LOG_PACKETS:
+            print(record)
+
+        start = time.perf_counter()
+        try:
+            if record.body_type is icd.EmitLog:
+                event, update = dispatch_index.dispatch(record), None
+            else:
+                event, update = None, dispatch_index.route(record)
+        except ValueError as e:
+            count_invalid_emit(e)
+            continue
+        converted = time.perf_counter()
+        adapter_metrics.CONVERT_LATENCY.observe(converted - start)
+
+        # Pushing is updating the metric of a counter/label (or its coalescer's slot), or enqueuing a log
+        if update is not None:
+            update(record.body[0])
+            adapter_metrics.PUSH_LATENCY.observe(time.perf_counter() - converted)
+        elif event is not None:
+            push_event(event)
+            adapter_metrics.PUSH_LATENCY.observe(time.perf_counter() - converted)
+
+
+def count_invalid_emit(error: ValueError):
+    adapter_metrics.count_invalid_message(error)
+    print("Got invalid emit: ", error)
+
+
+def handle_message(data, dispatch_index: DispatchIndex):
+    """
+    Handles the emits of a datagram. A malformed datagram (or frame) raises before any of its emits is handled,
+    while an emit that can't be handled (e.g. unknown ids) is counted and skipped, without the others of its frame.
+    """
+    global messages_until_latency_sample
+    if not messages_until_latency_sample:
+        # Timing every message is too expensive, so only one in every `LATENCY_SAMPLE_INTERVAL` is timed
+        messages_until_latency_sample = settings.LATENCY_SAMPLE_INTERVAL - 1
+        handle_message_timed(data, dispatch_index)
+        return
+    messages_until_latency_sample -= 1
+
+    for record in icd.decode_messages(data):
+        if settings.LOG_PACKETS:
+            print(record)
+
+        try:
+            event = dispatch_index.dispatch(record)
+        except ValueError as e:
+            count_invalid_emit(e)
+            continue
+        if event is not None:
+            push_event(event)
+
+
+def handle_batch(batch, dispatch_index: DispatchIndex):
+    """
+    Handles a whole batch of received datagrams.
+    """
+    for data, addr in batch:
+        try:
+            handle_message(data, dispatch_index)
+        except ValueError as e:
+            adapter_metrics.count_invalid_message(e)
+            print(f"Got invalid message from {addr}: ", e)
+
+
+def handle_records(records, coalescer: UpdateCoalescer):
+    """
+    Handles emits that were received from a stream transport.
+    """
+    index = coalescer.bind(dispatch_index)
+    for record in records:
+        if settings.LOG_PACKETS:
+            print(record)
+        try:
+            event = index.dispatch(record)
+        except ValueError as e:
+            adapter_metrics.count_invalid_message(e)
+            print("Got invalid emit from a stream: ", e)
+            continue
+        if event is not None:
+            push_event(event)
+    coalescer.maybe_flush()
+
+
+def is_shutting_down() -> bool:
+    return shutdown
+
+
+def is_known_ids(module_id: int, event_id: int) -> bool:
+    # The index is looked up on every call, since it might be swapped by a reload
+    return dispatch_index.is_known(module_id, event_id)
+
+
+def run_stream_transport(serve, *args):
+    """
+    Runs a stream transport (in its own thread) with its own coalescer.
+    """
+    coalescer = UpdateCoalescer(settings.COALESCE_WINDOW)
+    try:
+        serve(*args, is_known=is_known_ids, handle_records=partial(handle_records, coalescer=coalescer),
+              should_stop=is_shutting_down)
+    finally:
+        coalescer.flush()
+
+
+def start_stream_transports(reuse_port=False) -> list:
+    """
+    Starts the configured stream transports (serial, TCP), each in its own thread.
+    """
+    threads = []
+    if settings.SERIAL_DEVICE:
+        threads.append(threading.Thread(
+            target=run_stream_transport, name="serial",
+            args=(transports.serve_serial, settings.SERIAL_DEVICE, settings.SERIAL_BAUDRATE),
+        ))
+    if settings.TCP_PORT:
+        threads.append(threading.Thread(
+            target=run_stream_transport, name="tcp",
+            args=(partial(transports.serve_tcp, reuse_port=reuse_port), (LISTEN_IP, settings.TCP_PORT)),
+        ))
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def shed_flooding_sources(batch) -> list:
+    """
+    The datagrams of a batch without those of sources that are over their rate limit (before they're decoded).
+    """
+    # The limiter is looked up on every call, since it might be swapped by a reload
+    limiter = source_limiter
+    return batch if limiter is None else limiter.filter(batch)
+
+
+def create_batch_receiver(sock) -> BatchReceiver:
+    # The arrival time of every datagram is only needed to capture it
+    return BatchReceiver(sock, settings.BATCH_SIZE, settings.BATCH_MAX_LATENCY, settings.MAX_DATAGRAM_SIZE,
+                         timestamps=capture_writer is not None)
+
+
+def count_received(batch, receiver: BatchReceiver):
+    adapter_metrics.PACKETS_RECEIVED.inc(len(batch))
+    adapter_metrics.BYTES_RECEIVED.inc(sum(len(data) for data, _ in batch))
+    if capture_writer is not None:
+        capture_writer.write_batch(batch, receiver.timestamps)
+
+
+def handle_datagram(data, addr, coalescer: UpdateCoalescer):
+    """
+    Handles a single received datagram.
+    """
+    adapter_metrics.PACKETS_RECEIVED.inc()
+    adapter_metrics.BYTES_RECEIVED.inc(len(data))
+    if capture_writer is not None:
+        capture_writer.write(data, addr, time.time_ns())
+    limiter = source_limiter
+    if limiter is not None and not limiter.allow(addr):
+        coalescer.maybe_flush()
+        return
+    if settings.LOG_PACKETS:
+        print(f"\nReceived {len(data)} bytes from {addr}:")
+        print(f"Raw bytes: {data}")
+
+    try:
+        handle_message(data, coalescer.bind(dispatch_index))
+    except ValueError as e:
+        adapter_metrics.count_invalid_message(e)
+        print("Got invalid message: ", e)
+    coalescer.maybe_flush()
+
+
+def receive_single(sock):
+    coalescer = UpdateCoalescer(settings.COALESCE_WINDOW)
+    sock.settimeout(1.0)  # Set timeout to 1 second (for gracefully exiting)
+    while not shutdown:
+        try:
+            data, addr = sock.recvfrom(settings.MAX_DATAGRAM_SIZE)
+        except socket.timeout:
+            # Just loop again and check shutdown flag
+            coalescer.maybe_flush()
+            continue
+        handle_datagram(data, addr, coalescer)
+    coalescer.flush()
+
+
+def receive_batches(sock):
+    receiver = create_batch_receiver(sock)
+    coalescer = UpdateCoalescer(settings.COALESCE_WINDOW)
+    while not shutdown:
+        # Wake up every second (at most) to check the shutdown flag
+        batch = receiver.receive(timeout=1.0)
+        if batch:
+            count_received(batch, receiver)
+            # The index is read once per batch, since it might be swapped by a reload
+            handle_batch(shed_flooding_sources(batch), coalescer.bind(dispatch_index))
+        coalescer.maybe_flush()
+    coalescer.flush()
+
+
+def consume_queue(ingest_queue: IngestQueue):
+    """
+    Handles datagrams from the queue, until it's closed and drained (runs in every sink thread).
+    """
+    coalescer = UpdateCoalescer(settings.COALESCE_WINDOW)
+    while True:
+        batch = ingest_queue.get_many(settings.BATCH_SIZE, timeout=1.0)
+        if batch:
+            handle_batch(batch, coalescer.bind(dispatch_index))
+        elif ingest_queue.closed:
+            coalescer.flush()
+            return
+        coalescer.maybe_flush()
+
+
+def receive_queued(sock):
+    """
+    Receives into a bounded queue, which is handled by separate sink threads (so that slow sinks never stall
+    the receiving, and overload is handled by the queue's policy instead of by the kernel).
+    """
+    ingest_queue = IngestQueue(settings.QUEUE_SIZE, settings.QUEUE_POLICY)
+    sinks = [threading.Thread(target=consume_queue, args=(ingest_queue,), name=f"sink-{index}")
+             for index in range(settings.SINK_THREADS)]
+    for sink in sinks:
+        sink.start()
+
+    receiver = create_batch_receiver(sock)
+    try:
+        while not shutdown:
+            batch = receiver.receive(timeout=1.0)
+            if batch:
+                count_received(batch, receiver)
+                # Flooding sources are shed before the queue, so that they don't crowd the others out of it. The
+                # receive buffers are reused, so the datagrams are copied into the queue
+                ingest_queue.put_many([(bytes(data), addr) for data, addr in shed_flooding_sources(batch)])
+    finally:
+        ingest_queue.close()
+        for sink in sinks:
+            sink.join()
+
+
+def reload_metrics():
+    """
+    Applies changes of the event registry and the dictionary, without pausing the ingestion.
+
+    The new dispatch index is built aside and swapped in at once (the receive loop picks it up on its next message).
+    """
+    global dispatch_index
+    registry = load_registry(EVENT_REGISTRY_PATH)
+    create_metric_families(registry)
+    load_rate_limits(registry)
+    dispatch_index = create_dispatch_index(load_dictionary())
+    print("Reloaded the event registry and the dictionary")
+
+
+def dashboard_file_hashes() -> dict:
+    """
+    The content hash of every dashboard file, by path: from the build manifest of `make config` when there is one
+    (so that unchanged files aren't even read), or else of the files themselves.
+    """
+    hashes = reload.manifest_hashes(MANIFEST_PATH, [DASHBOARDS_PATH])
+    if hashes is None:
+        hashes = {str(path): dashboard_content_hash(load_dashboard(path)) for path in Path(DASHBOARDS_PATH).iterdir()}
+    return hashes
+
+
+def upload_changed_dashboards():
+    """
+    Uploads only the dashboards that were added or changed since they were last uploaded.
+
+    Raises if some failed to upload, whose hashes aren't recorded (so that they're uploaded again next time).
+    """
+    hashes = dashboard_file_hashes()
+    changed = [path for path, content_hash in hashes.items() if uploaded_dashboard_hashes.get(path) != content_hash]
+    failed_paths = set()
+    if changed:
+        dashboards = {path: load_dashboard(path) for path in changed}
+        uploaded, failed = upload_module_dashboards(list(dashboards.values()),
+                                                    concurrency=settings.DASHBOARD_UPLOAD_CONCURRENCY)
+        failed = set(failed)
+        failed_paths = {path for path, dashboard in dashboards.items() if dashboard["title"] in failed}
+        print(f"Uploaded {uploaded} changed dashboards (out of {len(changed)} checked)")
+
+    uploaded_dashboard_hashes.clear()
+    uploaded_dashboard_hashes.update({path: content_hash for path, content_hash in hashes.items()
+                                      if path not in failed_paths})
+    if failed_paths:
+        raise RuntimeError(f"Failed to upload {len(failed_paths)} dashboards")
+
+
+def reload_dashboards():
+    """
+    Uploads the changed dashboards (when the watcher sees a change), reporting failed uploads by the dashboards phase.
+    """
+    try:
+        upload_changed_dashboards()
+    except Exception as e:
+        readiness.PHASES.set("dashboards", readiness.RETRYING, str(e))
+        raise
+    readiness.PHASES.set("dashboards", readiness.READY)
+
+
+def open_capture():
+    global capture_writer
+    if settings.CAPTURE_PATH:
+        capture_writer = CaptureWriter(settings.CAPTURE_PATH, settings.CAPTURE_MAX_BYTES)
+        print(f"Capturing the received datagrams into {settings.CAPTURE_PATH}")
+
 
+def open_udp_socket(reuse_port=False) -> socket.socket:
     # Create a UDP socket
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if reuse_port:
+        # Several workers bind the same port, and the kernel balances the senders between them
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 
     # Bind to the IP and port
     sock.bind((LISTEN_IP, LISTEN_PORT))
-    sock.settimeout(1.0)  # Set timeout to 1 second (for gracefully exiting)
-    print(f"Listening for UDP packets on {LISTEN_IP}:{LISTEN_PORT}...")
+    readiness.PHASES.set("listener", readiness.READY, f"UDP {LISTEN_IP}:{LISTEN_PORT}")
+    mode = "asyncio" if settings.RUNTIME == "asyncio" else f"{settings.RECEIVE_MODE} mode"
+    print(f"Listening for UDP packets on {LISTEN_IP}:{LISTEN_PORT} ({mode})...")
+    return sock
+
+
+def main_metric_updates(reuse_port=False):
+    global shutdown, dispatch_index
+    dispatch_index = create_dispatch_index(load_dictionary())
+    open_capture()
+    sock = open_udp_socket(reuse_port=reuse_port)
 
+    stream_threads = start_stream_transports(reuse_port=reuse_port)
     try:
-        while not shutdown:
-            try:
-                data, addr = sock.recvfrom(4096)
-                print(f"Received data from {addr}: {data}")
-            except socket.timeout:
-                # Just loop again and check shutdown flag
-                continue
-
-            print(f"\nReceived {len(data)} bytes from {addr}:")
-            print(f"Raw bytes: {data}")
-
-            try:
-                event = converter.convert_incoming_message(message=data, conversion_map=hash_converter)
-                print(event)
-                push_event(event)
-            except ValueError as e:
-                print("Got invalid message: ", e)
+        if settings.QUEUE_SIZE:
+            receive_queued(sock)
+        elif settings.RECEIVE_MODE == "batched":
+            receive_batches(sock)
+        else:
+            receive_single(sock)
     except KeyboardInterrupt:
         print("\nExiting...")
     finally:
         sock.close()
+        shutdown = True
+        for thread in stream_threads:
+            thread.join()
+        if capture_writer is not None:
+            capture_writer.close()
+
+
+def collect_emitted_metrics() -> list:
+    """
+    The families of the emitted metrics (without the adapter's own metrics), for remote-write.
+    """
+    emitted = list(compact_store.collect()) if settings.METRICS_STORE == "compact" else []
+    # Distributions (and every family, with prometheus_client) collect themselves
+    return emitted + [metric for family in list(metric_families.values())
+                      if not isinstance(family, (CompactCounter, CompactGauge)) for metric in family.collect()]
+
+
+def start_metrics_watcher():
+    global metrics_watcher
+    metrics_watcher = ConfigWatcher("metrics", [EVENT_REGISTRY_PATH, DICTIONARY_PATH, DICTIONARY_INDEX_PATH],
+                                    reload_metrics, settings.RELOAD_INTERVAL, manifest_path=MANIFEST_PATH)
+    metrics_watcher.start()
+
+
+def create_sinks() -> list:
+    """
+    Creates the Loki shipper (and the remote-write sink, when configured), and returns them.
+    """
+    global loki_shipper, remote_write_sink
+    loki_shipper = LokiShipper(
+        LOKI_BASE_URL,
+        batch_size=settings.LOKI_BATCH_SIZE,
+        flush_interval=settings.LOKI_FLUSH_INTERVAL,
+        max_pending=settings.LOKI_MAX_PENDING,
+    )
+    sinks = [loki_shipper]
+    if settings.REMOTE_WRITE_URL:
+        remote_write_sink = RemoteWriteSink(
+            settings.REMOTE_WRITE_URL,
+            collect_emitted_metrics,
+            flush_interval=settings.REMOTE_WRITE_INTERVAL,
+            max_retries=settings.REMOTE_WRITE_MAX_RETRIES,
+        )
+        sinks.append(remote_write_sink)
+    return sinks
+
+
+def run_receiver(reuse_port=False):
+    """
+    Receives and handles packets until shutdown (runs in every worker, when there are several).
+    """
+    start_metrics_watcher()
+    sinks = create_sinks()
+    for sink in sinks:
+        sink.start()
+    try:
+        main_metric_updates(reuse_port=reuse_port)
+    finally:
+        for sink in sinks:
+            sink.stop()
+
+
+def provision_dashboards():
+    """
+    Uploads the dashboards (in the background, retrying until Grafana is reachable), and then watches them.
+    """
+    delay = PROVISION_INITIAL_RETRY
+    while not shutdown:
+        try:
+            upload_changed_dashboards()
+            break
+        except Exception as e:
+            print(f"❌ Failed to provision the dashboards (retrying in {delay} seconds): {e}")
+            readiness.PHASES.set("dashboards", readiness.RETRYING, str(e))
+            time.sleep(delay)
+            delay = min(delay * 2, PROVISION_MAX_RETRY)
+    else:
+        return
 
+    start_dashboards_watcher()
+
+
+def start_dashboards_watcher():
+    global dashboards_watcher
+    readiness.PHASES.set("dashboards", readiness.READY)
+    dashboards_watcher = ConfigWatcher("dashboards", [DASHBOARDS_PATH], reload_dashboards,
+                                       settings.RELOAD_INTERVAL, manifest_path=MANIFEST_PATH)
+    dashboards_watcher.start()
+
+
+class DatagramHandler(asyncio.DatagramProtocol):
+    """
+    Handles every datagram as soon as the event loop reads it (`asyncio` runtime).
+    """
+    def __init__(self, coalescer: UpdateCoalescer):
+        self.coalescer = coalescer
+
+    def datagram_received(self, data, addr):
+        handle_datagram(data, addr, self.coalescer)
+
+    def error_received(self, exc):
+        print(f"❌ Failed to receive a datagram: {exc}")
+
+
+async def flush_coalescer_periodically(coalescer: UpdateCoalescer):
+    """
+    Applies the coalesced updates once traffic stops (which `handle_datagram` only does when datagrams arrive).
+    """
+    while True:
+        await asyncio.sleep(coalescer.window)
+        coalescer.maybe_flush()
+
+
+async def provision_dashboards_async(executor: ThreadPoolExecutor, stopping: LoopEvent):
+    """
+    Same as `provision_dashboards`, as a task: Grafana's health is checked before every attempt, so that the
+    blocking requests never wait for a booting Grafana, and the backoff is cut short by stopping.
+    """
+    loop = asyncio.get_running_loop()
+    delay = PROVISION_INITIAL_RETRY
+    while not stopping.is_set():
+        try:
+            if not await loop.run_in_executor(executor, grafana_api_handling.is_grafana_ready):
+                raise RuntimeError("Grafana isn't ready")
+            await loop.run_in_executor(executor, upload_changed_dashboards)
+            break
+        except Exception as e:
+            print(f"❌ Failed to provision the dashboards (retrying in {delay} seconds): {e}")
+            readiness.PHASES.set("dashboards", readiness.RETRYING, str(e))
+            await stopping.wait(delay)
+            delay = min(delay * 2, PROVISION_MAX_RETRY)
+    else:
+        return
+    start_dashboards_watcher()
+
+
+async def run_adapter_async():
+    """
+    The `asyncio` runtime: UDP datagrams are handled by a `DatagramProtocol` as they arrive (without polling for the
+    shutdown), the sinks and the provisioning are tasks whose blocking requests run in a shared thread pool, and
+    SIGTERM stops everything at once.
+    """
+    global shutdown, dispatch_index
+    loop = asyncio.get_running_loop()
+    stopping = LoopEvent(loop)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopping.set)
+    loop.add_signal_handler(signal.SIGHUP, handle_reload_signal, signal.SIGHUP, None)
+    executor = ThreadPoolExecutor(max_workers=ASYNC_IO_THREADS, thread_name_prefix="async-io")
+
+    start_metrics_watcher()
+    sinks = create_sinks()
+    sink_tasks = [loop.create_task(sink.run_async(executor)) for sink in sinks]
+
+    dispatch_index = create_dispatch_index(load_dictionary())
+    open_capture()
+    coalescer = UpdateCoalescer(settings.COALESCE_WINDOW)
+    transport, _ = await loop.create_datagram_endpoint(partial(DatagramHandler, coalescer), sock=open_udp_socket())
+    background_tasks = [loop.create_task(provision_dashboards_async(executor, stopping))]
+    if coalescer.window:
+        background_tasks.append(loop.create_task(flush_coalescer_periodically(coalescer)))
+    stream_threads = start_stream_transports()
+
+    await stopping.wait()
+    print("Received a stop signal, exiting...")
+    shutdown = True
+    transport.close()
+    for task in background_tasks:
+        task.cancel()
+    coalescer.flush()
+    for thread in stream_threads:
+        thread.join()
+    for sink in sinks:
+        sink.request_stop()
+    await asyncio.gather(*sink_tasks)
+    if capture_writer is not None:
+        capture_writer.close()
+    executor.shutdown(wait=False)
+
+
+def start_metrics_server():
+    metrics_registry = workers.create_metrics_registry() if settings.WORKERS > 1 else REGISTRY
+    metrics_registry.register(adapter_metrics.SocketDropsCollector(LISTEN_PORT))
+    store = compact_store if settings.METRICS_STORE == "compact" else None
+    start_http_server(METRICS_PORT, registry=metrics_registry, store=store, phases=readiness.PHASES)
+    readiness.PHASES.set("metrics_server", readiness.READY)
+    print(f"Prometheus metrics available at http://oxemon_adapter:{METRICS_PORT}/metrics "
+          f"(and readiness at /ready)")
+
+
+def run_services():
+    """
+    Serves the metrics and provisions Grafana until shutdown, in a process of its own next to the workers (so that
+    the supervising process never starts a thread, and every worker is forked from a single-threaded process).
+    """
+    start_metrics_server()
+    provision_dashboards()
+    while not shutdown:
+        time.sleep(1)
+
+
+def run_adapter():
+    """
+    Starts the adapter: the metrics and their endpoint come up first and packets are received right away, while
+    Grafana is provisioned in the background.
+    """
+    settings.validate()
 
-if __name__ == "__main__":
     registry = load_registry(EVENT_REGISTRY_PATH)
     create_metric_families(registry)
+    load_rate_limits(registry)
+    readiness.PHASES.set("metrics", readiness.READY)
 
-    dashboards = load_module_dashboards(DASHBOARDS_PATH)
-    upload_module_dashboards(dashboards)
-
-    start_http_server(8000)
-    print("Prometheus metrics available at http://oxemon_adapter:8000/metrics")
+    if settings.RUNTIME == "asyncio":
+        start_metrics_server()
+        asyncio.run(run_adapter_async())
+        return
 
     # To exit graefully when "docker-compose down"
     signal.signal(signal.SIGTERM, handle_signal)
     signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGHUP, handle_reload_signal)
 
-    main_metric_updates()
+    if settings.WORKERS > 1:
+        # The workers bind the port as soon as they start
+        readiness.PHASES.set("listener", readiness.READY, f"{settings.WORKERS} workers")
+        workers.run_workers(settings.WORKERS, run_receiver, should_stop=lambda: shutdown, services=run_services)
+    else:
+        start_metrics_server()
+        threading.Thread(target=provision_dashboards, name="dashboards-provisioning", daemon=True).start()
+        run_receiver()
+
+
+if __name__ == "__main__":
+    run_adapter()
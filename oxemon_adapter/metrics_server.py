@@ -0,0 +1,57 @@
+"""
+The adapter's HTTP endpoint (port 8000): `/metrics` for Prometheus, and `/ready` for the startup phases.
+"""
+import gzip
+import json
+import threading
+from http.server import ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from prometheus_client import REGISTRY, generate_latest
+from prometheus_client.exposition import CONTENT_TYPE_LATEST, MetricsHandler, gzip_accepted
+
+from compact_metrics import CompactMetricStore
+from readiness import StartupPhases
+
+
+class AdapterMetricsHandler(MetricsHandler):
+    """
+    Serves the metrics of `registry` (followed by the compact `store`'s, when there is one), and the readiness of
+    the startup `phases`.
+    """
+    store: CompactMetricStore = None
+    phases: StartupPhases = None
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/ready" and self.phases is not None:
+            report = self.phases.report()
+            self._send(200 if report["ready"] else 503, "application/json", json.dumps(report).encode())
+        elif self.store is not None:
+            output = generate_latest(self.registry) + self.store.render().encode()
+            self._send(200, CONTENT_TYPE_LATEST, output)
+        else:
+            super().do_GET()
+
+    def _send(self, status: int, content_type: str, output: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        if gzip_accepted(self.headers.get("Accept-Encoding")):
+            output = gzip.compress(output)
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        self.wfile.write(output)
+
+
+def start_http_server(port: int, addr: str = "0.0.0.0", registry=REGISTRY, store: CompactMetricStore = None,
+                      phases: StartupPhases = None):
+    """
+    Same as prometheus_client's `start_http_server`, while also serving the compact store and the readiness.
+    """
+    handler = type("AdapterMetricsHandler", (AdapterMetricsHandler,),
+                   {"registry": registry, "store": store, "phases": phases})
+    server = ThreadingHTTPServer((addr, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    return server, thread
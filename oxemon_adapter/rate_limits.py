@@ -0,0 +1,187 @@
+"""
+Rate limits of the emitters, so that one flooding agent (e.g. emitting in a hot loop) can't starve the others.
+
+Both limits are token buckets configured in the event registry:
+- Every source address is limited by `source_rate_limits` (its own entry, or `default`). Its excess datagrams are
+  shed as soon as they're received, before they're decoded, and counted by source.
+- A (module, event) is limited by the `rate_limits` of its event. Its excess emits are shed before their metric is
+  updated (their header is decoded by then, they may share a datagram with other emits), and counted by coupling.
+"""
+import time
+from collections import Counter as Tally
+from typing import Dict, Optional
+
+from prometheus_client import Counter
+
+from adapter_metrics import SHED_DATAGRAMS, SHED_EMITS
+
+# The top-level key of the per-source limits in the event registry (every other key is an event)
+SOURCE_RATE_LIMITS_KEY = "source_rate_limits"
+DEFAULT_SOURCE = "default"
+
+# Buckets of sources that are idle are forgotten beyond this many (they'd be full anyway), along with their series of
+# shed datagrams, which bounds the memory (and the exported series) that a flood from many (e.g. spoofed) addresses
+# takes
+MAX_TRACKED_SOURCES = 10000
+
+
+class TokenBucket:
+    """
+    Allows `rate` events per second on average, and bursts of up to `burst` events. Not thread-safe, threads racing
+    on a bucket only make its limit slightly inexact.
+    """
+    __slots__ = ("rate", "burst", "tokens", "updated", "_counter", "_labels", "_shed")
+
+    def __init__(self, rate: float, burst: float, counter: Counter, labels: dict):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        # The shed events are counted by a child of `counter`, which is only created once something is shed
+        self._counter = counter
+        self._labels = labels
+        self._shed = None
+
+    def take(self) -> bool:
+        """
+        Takes a token if there's one (the event is allowed).
+        """
+        now = time.monotonic()
+        tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if tokens >= 1:
+            self.tokens = tokens - 1
+            return True
+        self.tokens = tokens
+        return False
+
+    def count_shed(self, amount: int = 1):
+        if self._shed is None:
+            self._shed = self._counter.labels(**self._labels)
+        self._shed.inc(amount)
+
+    def allow(self) -> bool:
+        """
+        Takes a token if there's one (the event is allowed), or counts the event as shed.
+        """
+        if self.take():
+            return True
+        self.count_shed()
+        return False
+
+    def is_full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+    def forget(self):
+        """
+        Removes the series of the shed events, once the bucket is no longer tracked.
+        """
+        if self._shed is not None:
+            self._counter.remove(*self._labels.values())
+            self._shed = None
+
+
+def create_bucket(limit: dict, counter: Counter, labels: dict) -> TokenBucket:
+    """
+    Creates the bucket of a limit from the event registry (`rate` per second, and a `burst` of a second by default).
+    """
+    rate = float(limit["rate"])
+    return TokenBucket(rate, float(limit.get("burst", rate)), counter, labels)
+
+
+class _Unlimited:
+    """
+    The bucket of a source without a limit.
+    """
+    @staticmethod
+    def take() -> bool:
+        return True
+
+    allow = take
+
+    @staticmethod
+    def is_full(now: float) -> bool:
+        return True
+
+    @staticmethod
+    def forget():
+        pass
+
+
+_UNLIMITED = _Unlimited()
+
+
+class SourceLimiter:
+    """
+    The token buckets of the source addresses, created as they're first seen. Used by a single receiving thread.
+    """
+    def __init__(self, limits: Dict[str, dict]):
+        self.default: Optional[dict] = limits.get(DEFAULT_SOURCE)
+        self.overrides = {str(host): limit for host, limit in limits.items() if host != DEFAULT_SOURCE}
+        self._buckets: Dict[str, object] = {}
+
+    def allow(self, addr: tuple) -> bool:
+        bucket = self._buckets.get(addr[0]) or self._add_source(addr[0])
+        return bucket.allow()
+
+    def filter(self, batch: list) -> list:
+        """
+        The `(data, addr)` of a batch, without those whose sources are over their limit (counted once per batch).
+        """
+        buckets = self._buckets
+        allowed, shed = [], []
+        for item in batch:
+            host = item[1][0]
+            bucket = buckets.get(host) or self._add_source(host)
+            if bucket.take():
+                allowed.append(item)
+            else:
+                shed.append(bucket)
+        if shed:
+            for bucket, amount in Tally(shed).items():
+                bucket.count_shed(amount)
+        return allowed
+
+    def _add_source(self, host: str):
+        if len(self._buckets) >= MAX_TRACKED_SOURCES:
+            self._forget_idle()
+        limit = self.overrides.get(host, self.default)
+        bucket = _UNLIMITED if limit is None else create_bucket(limit, SHED_DATAGRAMS, {"source": host})
+        self._buckets[host] = bucket
+        return bucket
+
+    def _forget_idle(self):
+        now = time.monotonic()
+        kept = {}
+        for host, bucket in self._buckets.items():
+            if bucket.is_full(now):
+                bucket.forget()
+            else:
+                kept[host] = bucket
+        if len(kept) >= MAX_TRACKED_SOURCES:
+            # Every source is busy, their buckets start over
+            for bucket in kept.values():
+                bucket.forget()
+            kept.clear()
+        self._buckets = kept
+
+
+def create_source_limiter(registry_data: dict) -> Optional[SourceLimiter]:
+    """
+    The limiter of the registry's `source_rate_limits`, or `None` when it has none (so nothing is checked).
+    """
+    limits = registry_data.get(SOURCE_RATE_LIMITS_KEY)
+    return SourceLimiter(limits) if limits else None
+
+
+def emit_rate_limits(registry_data: dict) -> Dict[tuple, dict]:
+    """
+    The limits of the registry's (module, event) couplings, as `{(event name, module name): limit}`.
+    """
+    return {(event_id, module_id): limit
+            for event_id, event_data in registry_data.items() if event_id != SOURCE_RATE_LIMITS_KEY
+            for module_id, limit in event_data.get("rate_limits", {}).items()}
+
+
+def create_emit_bucket(limit: dict, event_name: str, module_name: str) -> TokenBucket:
+    return create_bucket(limit, SHED_EMITS, {"module": module_name, "event": event_name})
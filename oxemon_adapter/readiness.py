@@ -0,0 +1,43 @@
+"""
+Tracks the startup phases of the adapter, which are reported by the `/ready` endpoint.
+"""
+import threading
+import time
+from typing import Iterable, Optional
+
+PENDING = "pending"
+READY = "ready"
+RETRYING = "retrying"
+
+
+class StartupPhases:
+    """
+    The state of every startup phase. The adapter is ready once all the `required` phases are.
+    """
+    def __init__(self, names: Iterable[str], required: Iterable[str]):
+        self._start_time = time.monotonic()
+        self._phases = {name: {"state": PENDING, "detail": None, "seconds": None} for name in names}
+        self._required = set(required)
+        self._lock = threading.Lock()
+
+    def set(self, name: str, state: str, detail: Optional[str] = None):
+        with self._lock:
+            self._phases[name] = {
+                "state": state,
+                "detail": detail,
+                "seconds": round(time.monotonic() - self._start_time, 3),  # Since the adapter started
+            }
+
+    def is_ready(self) -> bool:
+        with self._lock:
+            return all(self._phases[name]["state"] == READY for name in self._required)
+
+    def report(self) -> dict:
+        with self._lock:
+            phases = {name: dict(phase) for name, phase in self._phases.items()}
+        return {"ready": self.is_ready(), "phases": phases}
+
+
+# Ingestion only needs the metrics and the listener, dashboards are provisioned in the background
+PHASES = StartupPhases(["metrics", "metrics_server", "listener", "dashboards"],
+                       required=["metrics", "metrics_server", "listener"])
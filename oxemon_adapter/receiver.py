@@ -0,0 +1,68 @@
+import select
+import socket
+import time
+from typing import List, Tuple
+
+
+class BatchReceiver:
+    """
+    Drains all pending datagrams of a socket into a pool of preallocated buffers.
+
+    The returned datagrams are memoryviews into the pool, so they are only valid until the next call to `receive`.
+    With `timestamps`, the arrival time of every datagram of the batch (as returned by `time.time_ns`) is kept in
+    `timestamps`, in the same order.
+    """
+    def __init__(self, sock: socket.socket, batch_size: int, max_latency: float, max_datagram_size: int,
+                 timestamps: bool = False):
+        self._sock = sock
+        self._sock.setblocking(False)
+        self._batch_size = batch_size
+        self._max_latency = max_latency
+        self._views = [memoryview(bytearray(max_datagram_size)) for _ in range(batch_size)]
+        self._batch = []
+        self.timestamps = [] if timestamps else None
+
+    def _drain(self):
+        """
+        Reads datagrams until the socket is empty or the batch is full.
+        """
+        batch = self._batch
+        views = self._views
+        recvfrom_into = self._sock.recvfrom_into
+        timestamps = self.timestamps
+        while len(batch) < self._batch_size:
+            view = views[len(batch)]
+            try:
+                size, addr = recvfrom_into(view)
+            except (BlockingIOError, InterruptedError):
+                return
+            batch.append((view[:size], addr))
+            if timestamps is not None:
+                timestamps.append(time.time_ns())
+
+    def receive(self, timeout: float) -> List[Tuple[memoryview, tuple]]:
+        """
+        Waits up to `timeout` seconds for datagrams, and returns a (possibly empty) batch of `(data, addr)`.
+
+        Once the first datagram arrives, waits at most `max_latency` seconds for the batch to fill up.
+        """
+        self._batch.clear()
+        if self.timestamps is not None:
+            self.timestamps.clear()
+
+        readable, _, _ = select.select([self._sock], [], [], timeout)
+        if not readable:
+            return self._batch
+
+        deadline = time.monotonic() + self._max_latency
+        self._drain()
+        while len(self._batch) < self._batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            readable, _, _ = select.select([self._sock], [], [], remaining)
+            if not readable:
+                break
+            self._drain()
+
+        return self._batch
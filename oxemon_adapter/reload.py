@@ -0,0 +1,100 @@
+import json
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional
+
+# Written by `make config` (see `utils/build_manifest.py`, which shares these), last and atomically, after the files
+# it lists
+MANIFEST_NAME = "build_manifest.json"
+MANIFEST_VERSION = 1
+
+
+def files_signature(paths: Iterable[str]) -> tuple:
+    """
+    A cheap signature of the given files (and of the files in the given directories), which changes whenever
+    one of them is modified, added or removed.
+    """
+    signature = []
+    for path in map(Path, paths):
+        files = sorted(path.iterdir()) if path.is_dir() else [path]
+        for file in files:
+            try:
+                stat = file.stat()
+            except FileNotFoundError:
+                continue
+            signature.append((str(file), stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def manifest_hashes(manifest_path: str, paths: Iterable[str]) -> Optional[Dict[str, str]]:
+    """
+    The content hashes of the given files (and of the files in the given directories) as recorded in the build
+    manifest, by path. None when there's no (valid) manifest, e.g. for a configuration folder written by hand.
+    """
+    manifest_path = Path(manifest_path)
+    try:
+        manifest = json.loads(manifest_path.read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+
+    paths = [Path(path) for path in paths]
+    hashes = {}
+    for artifact, artifact_hash in manifest["artifacts"].items():
+        artifact_path = manifest_path.parent / artifact
+        if any(artifact_path == path or path in artifact_path.parents for path in paths):
+            hashes[str(artifact_path)] = artifact_hash
+    return hashes
+
+
+def configuration_signature(paths: Iterable[str], manifest_path: Optional[str] = None) -> tuple:
+    """
+    The signature of the given paths: their hashes in the build manifest when there is one (so that only actual
+    changes count, and only once the whole build is written), or else their files' times.
+    """
+    hashes = manifest_hashes(manifest_path, paths) if manifest_path else None
+    if hashes is None:
+        return files_signature(paths)
+    return tuple(sorted(hashes.items()))
+
+
+class ConfigWatcher:
+    """
+    Calls `on_change` (from a background thread) whenever one of the watched paths changes, or a reload is requested
+    (e.g. on SIGHUP). The paths are polled every `interval` seconds, 0 only reloads on request.
+
+    With a `manifest_path`, changes are detected by the hashes in the build manifest (see `configuration_signature`).
+    """
+    def __init__(self, name: str, paths: Iterable[str], on_change: Callable[[], None], interval: float,
+                 manifest_path: Optional[str] = None):
+        self.paths = list(paths)
+        self.on_change = on_change
+        self.interval = interval
+        self.manifest_path = manifest_path
+        self._signature = configuration_signature(self.paths, self.manifest_path)
+        self._requested = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"{name}-watcher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def request_reload(self):
+        # Only sets an event, so it's safe to call from a signal handler
+        self._requested.set()
+
+    def _run(self):
+        while True:
+            requested = self._requested.wait(self.interval or None)
+            self._requested.clear()
+
+            signature = configuration_signature(self.paths, self.manifest_path)
+            if not requested and signature == self._signature:
+                continue
+            self._signature = signature
+
+            try:
+                self.on_change()
+            except Exception as e:
+                # A broken configuration must not take the adapter down, the previous one stays in use
+                print(f"❌ Failed to reload {self.paths}: {e!r}")
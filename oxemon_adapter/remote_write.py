@@ -0,0 +1,274 @@
+"""
+Pushes the emitted metrics to Prometheus with the remote-write protocol (the `OXEMON_REMOTE_WRITE_URL` option).
+
+Every flush interval, the current value of every series that changed since it was last pushed is sent as one
+`WriteRequest` (protobuf, compressed with snappy). Every series is sent again every `FULL_RESEND_INTERVAL`, so that
+unchanged series don't go stale in Prometheus.
+
+The protobuf messages are tiny, so they're encoded by hand, and snappy is pure Python unless `python-snappy` is
+installed (it's much faster, but the payloads are small and mostly repetitive).
+"""
+import asyncio
+import struct
+import threading
+import time
+from concurrent.futures import Executor
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from adapter_metrics import REMOTE_WRITE_LATENCY, REMOTE_WRITE_FAILURES, REMOTE_WRITE_SAMPLES
+from loop_event import LoopEvent
+
+try:
+    from snappy import compress as _snappy_compress
+except ImportError:
+    _snappy_compress = None
+
+HEADERS = {
+    "Content-Type": "application/x-protobuf",
+    "Content-Encoding": "snappy",
+    "X-Prometheus-Remote-Write-Version": "0.1.0",
+}
+
+# Every series is pushed at least this often (in seconds), even if its value didn't change
+FULL_RESEND_INTERVAL = 60
+
+# Failed pushes are retried with exponential backoff (in seconds)
+INITIAL_RETRY = 0.1
+MAX_RETRY = 5
+
+SeriesKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _varint(value: int) -> bytes:
+    encoded = bytearray()
+    while value > 0x7f:
+        encoded.append(value & 0x7f | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def _length_delimited(tag: bytes, content: bytes) -> bytes:
+    return tag + _varint(len(content)) + content
+
+
+def encode_labels(key: SeriesKey) -> bytes:
+    """
+    The `labels` fields of a `TimeSeries` (the metric name is the `__name__` label, and labels are sorted by name).
+    """
+    name, labels = key
+    encoded = []
+    for label, value in sorted((("__name__", name), *labels)):
+        label_message = _length_delimited(b"\x0a", label.encode()) + _length_delimited(b"\x12", value.encode())
+        encoded.append(_length_delimited(b"\x0a", label_message))
+    return b"".join(encoded)
+
+
+def encode_write_request(series: List[Tuple[bytes, float]], timestamp_ms: int) -> bytes:
+    """
+    Encodes a `WriteRequest` of one sample (at `timestamp_ms`) for every `(encoded labels, value)`.
+    """
+    timestamp = b"\x10" + _varint(timestamp_ms)
+    sample_prefix = b"\x12" + _varint(9 + len(timestamp)) + b"\x09"
+    pack = struct.Struct("<d").pack
+    return b"".join(
+        _length_delimited(b"\x0a", labels + sample_prefix + pack(value) + timestamp) for labels, value in series
+    )
+
+
+def _snappy_literal(data) -> bytes:
+    length = len(data) - 1
+    if length < 60:
+        return bytes([length << 2]) + data
+    size = (length.bit_length() + 7) // 8
+    return bytes([(59 + size) << 2]) + length.to_bytes(size, "little") + data
+
+
+def _snappy_copy(offset: int, length: int) -> bytes:
+    copies = []
+    while length > 0:
+        # A copy (with a 2-byte offset) is at most 64 bytes long
+        chunk = min(length, 64)
+        copies.append(struct.pack("<BH", (chunk - 1) << 2 | 2, offset))
+        length -= chunk
+    return b"".join(copies)
+
+
+def _match_length(block: bytes, source: int, target: int) -> int:
+    length, end = 4, len(block)
+    step = 64
+    while step:
+        while target + length + step <= end:
+            if block[source + length:source + length + step] != block[target + length:target + length + step]:
+                break
+            length += step
+        step //= 4
+    return length
+
+
+def snappy_block_compress(data: bytes) -> bytes:
+    """
+    Compresses with the snappy block format (as remote-write requires), in pure Python: a greedy matcher of
+    4-byte sequences, over blocks of 64 KB (so every copy fits a 2-byte offset).
+    """
+    if _snappy_compress is not None:
+        return _snappy_compress(data)
+    output = [_varint(len(data))]
+    for block_start in range(0, len(data), 2 ** 16):
+        block = data[block_start:block_start + 2 ** 16]
+        table: Dict[bytes, int] = {}
+        literal_start = position = 0
+        misses = 32
+        end = len(block) - 4
+        while position <= end:
+            key = block[position:position + 4]
+            candidate = table.get(key)
+            table[key] = position
+            if candidate is None:
+                # Like snappy, skip ahead faster and faster through data that doesn't compress
+                position += misses >> 5
+                misses += 1
+                continue
+            length = _match_length(block, candidate, position)
+            if literal_start < position:
+                output.append(_snappy_literal(block[literal_start:position]))
+            output.append(_snappy_copy(position - candidate, length))
+            position += length
+            literal_start = position
+            misses = 32
+        if literal_start < len(block):
+            output.append(_snappy_literal(block[literal_start:]))
+    return b"".join(output)
+
+
+class RemoteWriteSink:
+    """
+    Pushes the samples returned by `collect` (prometheus_client metric families) from a background thread, every
+    `flush_interval` seconds, over pooled connections. A push that fails is retried with backoff (up to
+    `max_retries` times), and its series are pushed again on the next flush if it still fails.
+    """
+    def __init__(self, url: str, collect: Callable[[], Iterable], *, flush_interval: float, max_retries: int,
+                 timeout: float = 5):
+        self.url = url
+        self.collect = collect
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+        self._pushed_values: Dict[SeriesKey, float] = {}
+        self._encoded_labels: Dict[SeriesKey, bytes] = {}
+        self._last_full_push = 0
+        self._stopped = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="remote-write", daemon=True)
+
+        self._session = requests.Session()
+        self._session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self._session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self._session.headers.update(HEADERS)
+
+    def start(self):
+        self._thread.start()
+
+    def request_stop(self):
+        """
+        Makes the pushing (thread or task) push the latest values, and return.
+        """
+        self._stopped.set()
+        self._wakeup.set()
+
+    def stop(self):
+        """
+        Stops the pushing thread, after pushing the latest values.
+        """
+        self.request_stop()
+        self._thread.join()
+        self._session.close()
+
+    async def run_async(self, executor: Executor):
+        """
+        Pushes from an asyncio task instead of the pushing thread (with the pushes running in `executor`), until
+        `request_stop` is called.
+        """
+        loop = asyncio.get_running_loop()
+        wakeup = self._wakeup = LoopEvent(loop)
+        next_flush = time.monotonic() + self.flush_interval
+        while not await wakeup.wait(max(0, next_flush - time.monotonic())):
+            await loop.run_in_executor(executor, self.flush)
+            next_flush = max(next_flush + self.flush_interval, time.monotonic())
+        await loop.run_in_executor(executor, self.flush)
+        self._session.close()
+
+    def _changed_series(self, full: bool) -> Dict[SeriesKey, float]:
+        pushed = self._pushed_values
+        changed = {}
+        for metric in self.collect():
+            for sample in metric.samples:
+                if sample.name.endswith("_created"):
+                    continue
+                key = (sample.name, tuple(sorted(sample.labels.items())))
+                if full or pushed.get(key) != sample.value:
+                    changed[key] = sample.value
+        return changed
+
+    def flush(self):
+        now = time.time()
+        full = now - self._last_full_push >= FULL_RESEND_INTERVAL
+        changed = self._changed_series(full)
+        if not changed:
+            return
+
+        encoded_labels = self._encoded_labels
+        if full:
+            # Removed series are forgotten
+            encoded_labels = self._encoded_labels = {key: encoded_labels[key]
+                                                     for key in changed if key in encoded_labels}
+        series = []
+        for key, value in changed.items():
+            labels = encoded_labels.get(key)
+            if labels is None:
+                labels = encoded_labels[key] = encode_labels(key)
+            series.append((labels, value))
+        body = snappy_block_compress(encode_write_request(series, int(now * 1000)))
+
+        if self._push(body, len(series)):
+            REMOTE_WRITE_SAMPLES.inc(len(series))
+            if full:
+                self._pushed_values = changed
+                self._last_full_push = now
+            else:
+                self._pushed_values.update(changed)
+
+    def _push(self, body: bytes, samples: int) -> bool:
+        delay = INITIAL_RETRY
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                # Stopping cuts the backoff short (the values are pushed one last time)
+                self._stopped.wait(delay)
+                delay = min(delay * 2, MAX_RETRY)
+            try:
+                with REMOTE_WRITE_LATENCY.time():
+                    response = self._session.post(self.url, data=body, timeout=self.timeout)
+            except requests.RequestException as e:
+                error = str(e)
+            else:
+                if response.status_code < 300:
+                    return True
+                error = f"{response.status_code} {response.text}"
+                # Prometheus rejects these for good (e.g. out of order samples), only overload is retried
+                if response.status_code < 500 and response.status_code != 429:
+                    break
+        REMOTE_WRITE_FAILURES.inc()
+        print(f"❌ Failed to push {samples} samples to {self.url}: {error}")
+        return False
+
+    def _run(self):
+        # Flushes are scheduled at a fixed rate, so that collecting many series doesn't delay the next ones
+        next_flush = time.monotonic() + self.flush_interval
+        while not self._wakeup.wait(max(0, next_flush - time.monotonic())):
+            self.flush()
+            next_flush = max(next_flush + self.flush_interval, time.monotonic())
+        self.flush()
@@ -0,0 +1,131 @@
+"""
+Replays a capture (see `capture.py`, recorded with `OXEMON_CAPTURE_PATH`) at its original pace, N times faster, or
+as fast as possible.
+
+The datagrams are either sent over UDP (e.g. to a running adapter), or handled in this process by the adapter's own
+pipeline (decoding, dispatching and updating the metrics, with the configuration in `--config`, while logs are
+discarded), which makes it easy to profile the pipeline on real traffic.
+
+Run from the `oxemon_adapter` folder:
+    python replay.py capture.oxcap --speed 10x --udp 127.0.0.1:1414
+    python replay.py capture.oxcap --speed max --config ../my_config
+"""
+import socket
+import time
+from argparse import ArgumentParser, ArgumentTypeError
+from pathlib import Path
+
+import main
+import settings
+from capture import CaptureReader
+from coalescer import UpdateCoalescer
+
+REPLAY_BATCH_SIZE = 256
+# Sending is at most this late (in seconds) before the pacing sleeps, so that sleeping doesn't cost a syscall per
+# datagram at high rates
+PACING_GRANULARITY = 0.001
+
+
+class DiscardingShipper:
+    def push(self, module: str, line: str):
+        pass
+
+
+def parse_speed(speed: str) -> float:
+    """
+    "max" (0, as fast as possible), or a factor of the original pace ("1", "10x", "0.5").
+    """
+    if speed == "max":
+        return 0
+    try:
+        factor = float(speed[:-1] if speed.endswith("x") else speed)
+    except ValueError:
+        raise ArgumentTypeError(f"Invalid speed '{speed}', expected 'max' or a factor (e.g. '10x')")
+    if factor <= 0:
+        raise ArgumentTypeError(f"The speed must be positive, got {speed}")
+    return factor
+
+
+def parse_address(address: str) -> tuple:
+    host, _, port = address.rpartition(":")
+    return host, int(port)
+
+
+def paced_batches(reader: CaptureReader, speed: float, batch_size: int = REPLAY_BATCH_SIZE):
+    """
+    Yields the records of a capture as batches of `(data, addr)`, each once it's due: when as much time has passed
+    since the replay started as between the first record and its own (divided by `speed`, 0 never waits).
+    """
+    batch = []
+    start = first_timestamp = None
+    for timestamp, addr, data in reader:
+        if speed:
+            if start is None:
+                start, first_timestamp = time.perf_counter(), timestamp
+            delay = (timestamp - first_timestamp) / 1e9 / speed - (time.perf_counter() - start)
+            if delay > PACING_GRANULARITY:
+                if batch:
+                    yield batch
+                    batch = []
+                time.sleep(delay)
+        batch.append((data, addr))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def replay_udp(reader: CaptureReader, speed: float, address: tuple) -> int:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sendto = sock.sendto
+    sent = 0
+    for batch in paced_batches(reader, speed):
+        for data, _ in batch:
+            sendto(data, address)
+        sent += len(batch)
+    sock.close()
+    return sent
+
+
+def replay_in_process(reader: CaptureReader, speed: float, config_directory: Path) -> int:
+    main.EVENT_REGISTRY_PATH = str(config_directory / "event_registry.yaml")
+    main.DICTIONARY_PATH = str(config_directory / "oxemon_dictionary.json")
+    main.DICTIONARY_INDEX_PATH = str(config_directory / "oxemon_dictionary.idx")
+    main.create_metric_families(main.load_registry(main.EVENT_REGISTRY_PATH))
+    main.loki_shipper = DiscardingShipper()
+    dispatch_index = main.create_dispatch_index(main.load_dictionary())
+
+    coalescer = UpdateCoalescer(settings.COALESCE_WINDOW)
+    handled = 0
+    for batch in paced_batches(reader, speed):
+        main.handle_batch(batch, coalescer.bind(dispatch_index))
+        coalescer.maybe_flush()
+        handled += len(batch)
+    coalescer.flush()
+    return handled
+
+
+def parse_args():
+    parser = ArgumentParser(description="Replay a capture of emit datagrams")
+    parser.add_argument("capture", type=Path)
+    parser.add_argument("--speed", type=parse_speed, default=1,
+                        help="'max', or a factor of the original pace (e.g. '1', '10x'), default: 1")
+    parser.add_argument("--udp", type=parse_address, metavar="HOST:PORT",
+                        help="Send the datagrams to this address, instead of handling them in this process")
+    parser.add_argument("--config", type=Path, default=Path("config"),
+                        help="The configuration folder (of `make config`) to handle the datagrams with")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    settings.LOG_PACKETS = False
+    with CaptureReader(arguments.capture) as capture_reader:
+        start = time.perf_counter()
+        if arguments.udp:
+            count = replay_udp(capture_reader, arguments.speed, arguments.udp)
+        else:
+            count = replay_in_process(capture_reader, arguments.speed, arguments.config)
+        duration = time.perf_counter() - start
+    print(f"Replayed {count} datagrams in {duration:.2f}s ({count / max(duration, 1e-9):.0f} datagrams/sec)")
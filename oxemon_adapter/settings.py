@@ -0,0 +1,181 @@
+"""
+Runtime options of the adapter.
+
+Every option is read from an environment variable (set them under `environment:` of `oxemon_adapter` in
+`docker-compose.yaml`), see "Adapter Options" in the README.
+"""
+import os
+import shutil
+import termios
+
+
+def _env_str(name: str, default: str) -> str:
+    return os.environ.get(name, default).strip().lower()
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.environ.get(name, default))
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    return _env_str(name, str(default)) in ("1", "true", "yes", "on")
+
+
+# Print every received packet and metric update (useful for debugging, expensive under load)
+LOG_PACKETS = _env_bool("OXEMON_LOG_PACKETS", True)
+
+
+# How the adapter runs: "threads" (a blocking receive loop, with a thread per sink), or "asyncio" (an event loop
+# receiving UDP with a `DatagramProtocol`, and running the sinks and the provisioning as tasks)
+RUNTIME = _env_str("OXEMON_RUNTIME", "threads")
+VALID_RUNTIMES = {"threads", "asyncio"}
+
+# How datagrams are read from the socket: "single" (one `recvfrom` per wakeup) or "batched"
+RECEIVE_MODE = _env_str("OXEMON_RECEIVE_MODE", "single")
+VALID_RECEIVE_MODES = {"single", "batched"}
+
+# Maximal amount of datagrams handed to the converter at once (batched mode)
+BATCH_SIZE = _env_int("OXEMON_BATCH_SIZE", 256)
+
+# Maximal time (in milliseconds) a received datagram waits for its batch to fill up (batched mode)
+BATCH_MAX_LATENCY = _env_float("OXEMON_BATCH_MAX_LATENCY_MS", 5) / 1000
+
+# Size of every receive buffer, larger datagrams are truncated
+MAX_DATAGRAM_SIZE = _env_int("OXEMON_MAX_DATAGRAM_SIZE", 4096)
+
+# A serial device (e.g. /dev/ttyUSB0) to receive emits from as well, empty to not use one
+SERIAL_DEVICE = os.environ.get("OXEMON_SERIAL_DEVICE", "").strip()
+
+# Baud rate of the serial device
+SERIAL_BAUDRATE = _env_int("OXEMON_SERIAL_BAUDRATE", 115200)
+
+# A TCP port to receive emit streams on as well, 0 to not listen on TCP
+TCP_PORT = _env_int("OXEMON_TCP_PORT", 0)
+
+# Capacity (in datagrams) of the queue between receiving and handling, 0 handles datagrams inline
+QUEUE_SIZE = _env_int("OXEMON_QUEUE_SIZE", 0)
+
+# What is dropped when the queue is full: "drop_oldest", "drop_newest" or "prioritize_metrics" (logs go first)
+QUEUE_POLICY = _env_str("OXEMON_QUEUE_POLICY", "drop_oldest")
+VALID_QUEUE_POLICIES = {"drop_oldest", "drop_newest", "prioritize_metrics"}
+
+# Amount of threads handling datagrams from the queue
+SINK_THREADS = _env_int("OXEMON_SINK_THREADS", 1)
+
+# Log lines are shipped to Loki once this many are pending...
+LOKI_BATCH_SIZE = _env_int("OXEMON_LOKI_BATCH_SIZE", 500)
+
+# ...or every this many milliseconds
+LOKI_FLUSH_INTERVAL = _env_float("OXEMON_LOKI_FLUSH_INTERVAL_MS", 1000) / 1000
+
+# Maximal amount of log lines kept while Loki is unreachable or slow (the oldest are dropped first)
+LOKI_MAX_PENDING = _env_int("OXEMON_LOKI_MAX_PENDING", 100000)
+
+# A remote-write endpoint (e.g. http://prometheus:9090/api/v1/write) to push the emitted metrics to, empty to not push
+REMOTE_WRITE_URL = os.environ.get("OXEMON_REMOTE_WRITE_URL", "").strip()
+
+# The changed metrics are pushed every this many milliseconds
+REMOTE_WRITE_INTERVAL = _env_float("OXEMON_REMOTE_WRITE_INTERVAL_MS", 1000) / 1000
+
+# How many times a failed push is retried (with exponential backoff) before its samples wait for the next push
+REMOTE_WRITE_MAX_RETRIES = _env_int("OXEMON_REMOTE_WRITE_MAX_RETRIES", 3)
+
+# Counter/label updates are summed (or the last value kept) for this many milliseconds, and applied at once.
+# Much cheaper under load, while invisible at the scrape interval. 0 applies every update immediately
+COALESCE_WINDOW = _env_float("OXEMON_COALESCE_WINDOW_MS", 0) / 1000
+
+# The percentiles of distributions are of the values emitted in the last this many seconds, 0 for all of them
+DISTRIBUTION_WINDOW = _env_float("OXEMON_DISTRIBUTION_WINDOW_S", 60)
+
+# Where the emitted metrics are kept: "prometheus_client" (an object per metric), or "compact" (a flat array of
+# values, much lighter and faster to scrape with thousands of couplings, but only for a single worker)
+METRICS_STORE = _env_str("OXEMON_METRICS_STORE", "prometheus_client")
+VALID_METRICS_STORES = {"prometheus_client", "compact"}
+
+# Only one in every this many messages is timed for `oxemon_adapter_stage_latency_seconds`
+LATENCY_SAMPLE_INTERVAL = _env_int("OXEMON_LATENCY_SAMPLE_INTERVAL", 16)
+
+# How often (in seconds) the configuration folder is checked for changes, 0 only reloads on SIGHUP
+RELOAD_INTERVAL = _env_float("OXEMON_RELOAD_INTERVAL_S", 2)
+
+# Amount of dashboards uploaded to Grafana at the same time
+DASHBOARD_UPLOAD_CONCURRENCY = _env_int("OXEMON_DASHBOARD_UPLOAD_CONCURRENCY", 8)
+
+# A file to append every received datagram to (with its arrival time and source), empty to not capture
+CAPTURE_PATH = os.environ.get("OXEMON_CAPTURE_PATH", "").strip()
+
+# Capturing stops once the capture file reaches this size (in MB)
+CAPTURE_MAX_BYTES = _env_int("OXEMON_CAPTURE_MAX_MB", 1024) * 2 ** 20
+
+# Amount of receiver processes sharing the UDP port (with SO_REUSEPORT), 1 receives in the main process
+WORKERS = _env_int("OXEMON_WORKERS", 1)
+
+# Where the workers store their metric values, so they can be aggregated for `/metrics`
+MULTIPROCESS_METRICS_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR", "/tmp/oxemon_metrics")
+
+if WORKERS > 1 or "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+    # prometheus_client picks its value storage when it's first imported (and the adapter's own metrics create
+    # their files right away), so the directory is set up before that, clearing the values of a previous run
+    shutil.rmtree(MULTIPROCESS_METRICS_DIR, ignore_errors=True)
+    os.makedirs(MULTIPROCESS_METRICS_DIR)
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = MULTIPROCESS_METRICS_DIR
+
+
+def validate():
+    if RUNTIME not in VALID_RUNTIMES:
+        raise ValueError(f"Invalid OXEMON_RUNTIME '{RUNTIME}', expected one of {VALID_RUNTIMES}")
+    if RUNTIME == "asyncio" and (WORKERS > 1 or QUEUE_SIZE):
+        raise ValueError("The asyncio runtime runs in a single process without a queue, OXEMON_WORKERS must be 1 "
+                         "and OXEMON_QUEUE_SIZE 0")
+    if RECEIVE_MODE not in VALID_RECEIVE_MODES:
+        raise ValueError(f"Invalid OXEMON_RECEIVE_MODE '{RECEIVE_MODE}', expected one of {VALID_RECEIVE_MODES}")
+    if BATCH_SIZE < 1:
+        raise ValueError(f"OXEMON_BATCH_SIZE must be positive, got {BATCH_SIZE}")
+    if BATCH_MAX_LATENCY < 0:
+        raise ValueError(f"OXEMON_BATCH_MAX_LATENCY_MS can't be negative, got {BATCH_MAX_LATENCY * 1000}")
+    if METRICS_STORE not in VALID_METRICS_STORES:
+        raise ValueError(f"Invalid OXEMON_METRICS_STORE '{METRICS_STORE}', expected one of {VALID_METRICS_STORES}")
+    if METRICS_STORE == "compact" and WORKERS > 1:
+        raise ValueError("The compact metrics store only supports a single process, OXEMON_WORKERS must be 1")
+    if COALESCE_WINDOW < 0:
+        raise ValueError(f"OXEMON_COALESCE_WINDOW_MS can't be negative, got {COALESCE_WINDOW * 1000}")
+    if DISTRIBUTION_WINDOW < 0:
+        raise ValueError(f"OXEMON_DISTRIBUTION_WINDOW_S can't be negative, got {DISTRIBUTION_WINDOW}")
+    if LATENCY_SAMPLE_INTERVAL < 1:
+        raise ValueError(f"OXEMON_LATENCY_SAMPLE_INTERVAL must be positive, got {LATENCY_SAMPLE_INTERVAL}")
+    if RELOAD_INTERVAL < 0:
+        raise ValueError(f"OXEMON_RELOAD_INTERVAL_S can't be negative, got {RELOAD_INTERVAL}")
+    if DASHBOARD_UPLOAD_CONCURRENCY < 1:
+        raise ValueError(f"OXEMON_DASHBOARD_UPLOAD_CONCURRENCY must be positive, got {DASHBOARD_UPLOAD_CONCURRENCY}")
+    if WORKERS < 1:
+        raise ValueError(f"OXEMON_WORKERS must be positive, got {WORKERS}")
+    if SERIAL_DEVICE and WORKERS > 1:
+        raise ValueError("A serial device can only be read by a single process, OXEMON_WORKERS must be 1")
+    if REMOTE_WRITE_URL and WORKERS > 1:
+        raise ValueError("Remote-write pushes the values of a single process, OXEMON_WORKERS must be 1")
+    if REMOTE_WRITE_INTERVAL <= 0 or REMOTE_WRITE_MAX_RETRIES < 0:
+        raise ValueError("OXEMON_REMOTE_WRITE_INTERVAL_MS must be positive, and OXEMON_REMOTE_WRITE_MAX_RETRIES "
+                         "can't be negative")
+    if CAPTURE_PATH and WORKERS > 1:
+        raise ValueError("A capture file can only be written by a single process, OXEMON_WORKERS must be 1")
+    if CAPTURE_MAX_BYTES <= 0:
+        raise ValueError(f"OXEMON_CAPTURE_MAX_MB must be positive, got {CAPTURE_MAX_BYTES // 2 ** 20}")
+    if CAPTURE_PATH and MAX_DATAGRAM_SIZE > 65535:
+        # The length of a captured datagram is a UInt16
+        raise ValueError(f"Captured datagrams are at most 65535 bytes, OXEMON_MAX_DATAGRAM_SIZE is {MAX_DATAGRAM_SIZE}")
+    if not hasattr(termios, f"B{SERIAL_BAUDRATE}"):
+        raise ValueError(f"Unsupported OXEMON_SERIAL_BAUDRATE {SERIAL_BAUDRATE}")
+    if not 0 <= TCP_PORT <= 65535:
+        raise ValueError(f"Invalid OXEMON_TCP_PORT {TCP_PORT}")
+    if QUEUE_POLICY not in VALID_QUEUE_POLICIES:
+        raise ValueError(f"Invalid OXEMON_QUEUE_POLICY '{QUEUE_POLICY}', expected one of {VALID_QUEUE_POLICIES}")
+    if QUEUE_SIZE < 0 or SINK_THREADS < 1:
+        raise ValueError("OXEMON_QUEUE_SIZE can't be negative, and OXEMON_SINK_THREADS must be positive")
+    if LOKI_BATCH_SIZE < 1 or LOKI_MAX_PENDING < LOKI_BATCH_SIZE:
+        raise ValueError("OXEMON_LOKI_MAX_PENDING must be at least OXEMON_LOKI_BATCH_SIZE (which must be positive)")
+    if LOKI_FLUSH_INTERVAL <= 0:
+        raise ValueError(f"OXEMON_LOKI_FLUSH_INTERVAL_MS must be positive, got {LOKI_FLUSH_INTERVAL * 1000}")
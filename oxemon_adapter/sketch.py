@@ -0,0 +1,223 @@
+"""
+Percentiles of `distribution` events.
+
+Every emitted value of a distribution is a sample (e.g. the duration of one request), and its percentiles are
+estimated with a DDSketch: a histogram of logarithmically sized buckets, so that every percentile is within
+`RELATIVE_ACCURACY` of the real one. The buckets are a dense array, bounded to `MAX_BUCKETS` by merging the lowest
+ones together (only the lowest percentiles lose accuracy, and only when the values span more than
+`gamma ** MAX_BUCKETS`), so a series takes the same memory however many values it receives.
+
+The percentiles are of the last `OXEMON_DISTRIBUTION_WINDOW_S` seconds: the window is a ring of `AGE_BUCKETS`
+sketches, the oldest of which is cleared every `window / AGE_BUCKETS`, and they're merged when collected.
+"""
+import math
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+from operator import add
+from typing import Dict, List, Sequence
+
+from prometheus_client import REGISTRY
+from prometheus_client.core import GaugeMetricFamily, SummaryMetricFamily
+
+RELATIVE_ACCURACY = 0.01
+MAX_BUCKETS = 2048
+AGE_BUCKETS = 6
+
+# The exported percentiles (their `quantile` label), the maximum is exported as `<name>_max`
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class DDSketch:
+    """
+    A mergeable sketch of non-negative values, with percentiles within `relative_accuracy`.
+    """
+    __slots__ = ("gamma", "_multiplier", "max_buckets", "counts", "offset", "zero_count", "count", "max")
+
+    def __init__(self, relative_accuracy: float = RELATIVE_ACCURACY, max_buckets: int = MAX_BUCKETS):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._multiplier = 1 / math.log(self.gamma)
+        self.max_buckets = max_buckets
+        # `counts[i]` is the amount of values in `(gamma ** (offset + i - 1), gamma ** (offset + i)]`
+        self.counts = array("Q")
+        self.offset = 0
+        self.zero_count = 0
+        self.count = 0
+        self.max = 0
+
+    def add(self, value: float):
+        self.count += 1
+        if value > self.max:
+            self.max = value
+        if value <= 1e-9:
+            self.zero_count += 1
+            return
+        position = math.ceil(math.log(value) * self._multiplier) - self.offset
+        if 0 <= position < len(self.counts):
+            self.counts[position] += 1
+        else:
+            self._add_to_bucket(position + self.offset, 1)
+
+    def _add_to_bucket(self, index: int, amount: int):
+        counts = self.counts
+        if not counts:
+            self.offset = index
+            counts.append(0)
+        elif index < self.offset:
+            grow = min(self.offset - index, self.max_buckets - len(counts))
+            # Beyond the bound, lower values are counted in the lowest bucket
+            self.counts = counts = array("Q", bytes(8 * grow)) + counts
+            self.offset -= grow
+        elif index >= self.offset + len(counts):
+            lowest = index - self.max_buckets + 1
+            if lowest > self.offset:
+                # The lowest buckets are merged into the lowest one that's kept
+                collapsed = lowest - self.offset
+                if collapsed >= len(counts):
+                    counts = array("Q", [sum(counts)])
+                else:
+                    merged = sum(counts[:collapsed + 1])
+                    counts = counts[collapsed:]
+                    counts[0] = merged
+                self.offset = lowest
+            counts.frombytes(bytes(8 * (index - self.offset + 1 - len(counts))))
+            self.counts = counts
+        counts[max(index - self.offset, 0)] += amount
+
+    def merge(self, other: "DDSketch"):
+        """
+        Adds the values of `other` (which must have the same relative accuracy) to this sketch.
+        """
+        if other.counts:
+            low, high = other.offset, other.offset + len(other.counts) - 1
+            if self.counts:
+                low, high = min(low, self.offset), max(high, self.offset + len(self.counts) - 1)
+            if high - low < self.max_buckets:
+                # Both fit in the bound: the buckets are added as a whole (much faster than one by one)
+                self._add_to_bucket(low, 0)
+                self._add_to_bucket(high, 0)
+                start = other.offset - self.offset
+                end = start + len(other.counts)
+                self.counts[start:end] = array("Q", map(add, self.counts[start:end], other.counts))
+            else:
+                for position, amount in enumerate(other.counts):
+                    if amount:
+                        self._add_to_bucket(other.offset + position, amount)
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def quantiles(self, quantiles: Sequence[float]) -> List[float]:
+        """
+        Estimates the given quantiles, NaN while there are no values.
+        """
+        if not self.count:
+            return [math.nan] * len(quantiles)
+        estimates = []
+        # `cumulative[i + 1]` is the amount of values up to (and in) the `i`th bucket
+        cumulative = list(accumulate(self.counts, initial=self.zero_count))
+        for quantile in quantiles:
+            position = bisect_right(cumulative, quantile * (self.count - 1)) - 1
+            if position < 0:
+                estimates.append(0)
+            else:
+                # The middle of the bucket (in relative terms), and never more than the real maximum
+                estimate = 2 * self.gamma ** (self.offset + position) / (self.gamma + 1)
+                estimates.append(min(estimate, self.max))
+        return estimates
+
+    def clear(self):
+        self.counts = array("Q")
+        self.zero_count = self.count = 0
+        self.max = 0
+
+
+class DistributionSeries:
+    """
+    The distribution of one (event, module), like a prometheus_client `Summary` child.
+    """
+    def __init__(self, window: float):
+        self._lock = threading.Lock()
+        # Without a window, a single sketch holds every value
+        self._sketches = [DDSketch() for _ in range(AGE_BUCKETS if window else 1)]
+        self._current = 0
+        self._age_period = window / AGE_BUCKETS if window else math.inf
+        self._rotate_at = time.monotonic() + self._age_period
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value: float):
+        with self._lock:
+            now = time.monotonic()
+            if now >= self._rotate_at:
+                self._rotate(now)
+            self._sketches[self._current].add(value)
+            self.count += 1
+            self.sum += value
+
+    def _rotate(self, now: float):
+        periods = int((now - self._rotate_at) // self._age_period) + 1
+        for _ in range(min(periods, len(self._sketches))):
+            self._current = (self._current + 1) % len(self._sketches)
+            self._sketches[self._current].clear()
+        self._rotate_at += periods * self._age_period
+
+    def snapshot(self) -> tuple:
+        """
+        Returns the `(QUANTILES estimates, maximum, count, sum)`, the estimates and the maximum being of the window
+        (`None` when it has no values).
+        """
+        merged = DDSketch()
+        with self._lock:
+            now = time.monotonic()
+            if now >= self._rotate_at:
+                self._rotate(now)
+            for sketch in self._sketches:
+                merged.merge(sketch)
+            count, total = self.count, self.sum
+        if not merged.count:
+            return None, None, count, total
+        return merged.quantiles(QUANTILES), merged.max, count, total
+
+
+class DistributionFamily:
+    """
+    A family of distributions which differ by their "module" label (the same interface as prometheus_client's
+    metrics), collected as a summary (`<name>{quantile=...}`, `<name>_count` and `<name>_sum`) and a
+    `<name>_max` gauge.
+    """
+    def __init__(self, name: str, documentation: str, window: float, registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.window = window
+        self._children: Dict[str, DistributionSeries] = {}
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, module: str) -> DistributionSeries:
+        child = self._children.get(module)
+        if child is None:
+            child = self._children[module] = DistributionSeries(self.window)
+        return child
+
+    def remove(self, module: str):
+        del self._children[module]
+
+    def describe(self):
+        return [SummaryMetricFamily(self.name, self.documentation, labels=["module"]),
+                GaugeMetricFamily(f"{self.name}_max", self.documentation, labels=["module"])]
+
+    def collect(self):
+        summary, maximum = self.describe()
+        for module, child in list(self._children.items()):
+            estimates, max_value, count, total = child.snapshot()
+            # Without values in the window, there are no percentiles (rather than NaN, which remote-write would
+            # push again and again)
+            if estimates is not None:
+                for quantile, estimate in zip(QUANTILES, estimates):
+                    summary.add_sample(self.name, {"module": module, "quantile": str(quantile)}, estimate)
+                maximum.add_metric([module], max_value)
+            summary.add_metric([module], count, total)
+        return [summary, maximum]
@@ -0,0 +1,111 @@
+"""
+Splits a byte stream (serial, TCP) back into emits.
+
+Unlike UDP, streams don't preserve message boundaries, so emits may arrive split between reads (or several in one
+read). Since emits are self-delimiting (the header's event type defines the body's length), they are decoded
+straight out of the receive buffer as soon as they're complete.
+"""
+import struct
+from typing import Callable, List, Optional
+
+import icd
+from adapter_metrics import STREAM_SKIPPED_BYTES
+
+# The largest possible emit (a log with 255 UInt64 parameters) is about 2KiB, so this leaves room for many reads
+DEFAULT_CAPACITY = 256 * 1024
+
+
+class StreamFramer:
+    """
+    Incrementally decodes emits from a stream.
+
+    Data is read directly into the framer's buffer (`writable` and `commit`), and `records` decodes every complete
+    emit without copying it. When the stream is corrupt (an unexpected event type, or ids rejected by `is_known`),
+    bytes are skipped one at a time until a valid header is found again.
+
+    Frames (see `icd.EmitFrame`) are accepted as well, their records are handled like any other emit in the stream.
+
+    Args:
+        capacity: Size of the receive buffer.
+        is_known: Checks the `(module_id, event_id)` of every header, which makes resynchronising much more reliable
+            than only checking the event type.
+    """
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, is_known: Optional[Callable[[int, int], bool]] = None):
+        self._buffer = bytearray(capacity)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+        self._is_known = is_known
+        self.skipped_bytes = 0
+
+    def writable(self) -> memoryview:
+        """
+        Returns the free part of the buffer, to read into (e.g. with `recv_into` or `os.readv`).
+        """
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._end == len(self._buffer):
+            # Move the incomplete emit to the beginning of the buffer (it's always small)
+            pending = self._end - self._start
+            self._buffer[:pending] = self._view[self._start:self._end]
+            self._start, self._end = 0, pending
+        return self._view[self._end:]
+
+    def commit(self, size: int):
+        """
+        Marks `size` bytes, which were read into `writable()`, as received.
+        """
+        self._end += size
+
+    def feed(self, data: bytes):
+        """
+        Copies `data` into the buffer (for sources that can't read into a buffer).
+        """
+        while data:
+            writable = self.writable()
+            size = min(len(writable), len(data))
+            writable[:size] = data[:size]
+            self.commit(size)
+            data = data[size:]
+
+    def _is_valid_header(self, module_id: int, event_id: int, event_type: int) -> bool:
+        if event_type not in icd.DECODERS:
+            return False
+        # Frame headers carry no ids
+        return event_type == icd.FRAME_OPCODE or self._is_known is None or self._is_known(module_id, event_id)
+
+    def records(self) -> List[icd.EmitRecord]:
+        """
+        Decodes all the complete emits in the buffer (the rest waits for more data).
+        """
+        records = []
+        unpack_header = icd.HEADER_LAYOUT.unpack_from
+        start, end = self._start, self._end
+        with self._view[:end] as data:
+            while end - start >= icd.HEADER_SIZE:
+                module_id, event_id, event_type = unpack_header(data, start)
+                if not self._is_valid_header(module_id, event_id, event_type):
+                    start += 1
+                    self._count_skipped()
+                    continue
+
+                body_type, decode_body = icd.DECODERS[event_type]
+                try:
+                    body, record_end = decode_body(data, start + icd.HEADER_SIZE)
+                except struct.error:
+                    break  # The rest of the emit wasn't received yet
+
+                if body_type is not icd.EmitFrame:
+                    records.append(icd.EmitRecord(module_id, event_id, body_type, body))
+                elif body[0] != icd.FRAME_VERSION:
+                    start += 1
+                    self._count_skipped()
+                    continue
+                start = record_end
+
+        self._start = start
+        return records
+
+    def _count_skipped(self):
+        self.skipped_bytes += 1
+        STREAM_SKIPPED_BYTES.inc()
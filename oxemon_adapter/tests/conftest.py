@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The adapter's modules import each other by their flat names, as when it runs from its folder
+sys.path.append(str(Path(__file__).resolve().parents[1]))
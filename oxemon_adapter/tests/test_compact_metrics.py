@@ -0,0 +1,23 @@
+from compact_metrics import CompactCounter, CompactGauge, CompactMetricStore
+
+
+def test_removed_children_dont_update_the_series_reusing_their_slot():
+    store = CompactMetricStore(capacity=4)
+    counter = CompactCounter("requests", "Requests", store)
+    gauge = CompactGauge("state", "State", store)
+    old_counter, old_gauge = counter.labels("server"), gauge.labels("server")
+    old_slots = {old_counter.slot, old_gauge.slot}
+
+    # As after a reload: the children are removed, and their slots are reused by new series
+    counter.remove("server")
+    gauge.remove("server")
+    new_counter, new_gauge = counter.labels("client"), gauge.labels("client")
+    assert {new_counter.slot, new_gauge.slot} == old_slots
+
+    # The old dispatch index (or a coalescer's flush) still updates the removed children
+    old_counter.inc(5)
+    old_gauge.set(7)
+    assert store.values[new_counter.slot] == 0 and store.values[new_gauge.slot] == 0
+    assert store.render() == ('# HELP requests_total Requests\n# TYPE requests_total counter\n'
+                              'requests_total{module="client"} 0.0\n'
+                              '# HELP state State\n# TYPE state gauge\nstate{module="client"} 0.0\n')
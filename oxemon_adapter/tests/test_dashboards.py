@@ -0,0 +1,49 @@
+import pytest
+
+import main
+import readiness
+
+
+@pytest.fixture
+def dashboards(monkeypatch):
+    """
+    Two dashboard files, uploaded by a fake Grafana which fails the titles in `failing`.
+    """
+    files = {"config/dashboards/a.json": "hash a", "config/dashboards/b.json": "hash b"}
+    grafana = {"failing": set(), "uploads": []}
+
+    def upload(dashboards, concurrency):
+        titles = [dashboard["title"] for dashboard in dashboards]
+        grafana["uploads"].append(titles)
+        failed = [title for title in titles if title in grafana["failing"]]
+        return len(titles) - len(failed), failed
+
+    monkeypatch.setattr(main, "dashboard_file_hashes", lambda: dict(files))
+    monkeypatch.setattr(main, "load_dashboard", lambda path: {"title": path.rsplit("/", 1)[1]})
+    monkeypatch.setattr(main, "upload_module_dashboards", upload)
+    monkeypatch.setattr(main, "uploaded_dashboard_hashes", {})
+    return grafana
+
+
+def test_failed_dashboards_are_uploaded_again(dashboards):
+    dashboards["failing"] = {"b.json"}
+    with pytest.raises(RuntimeError):
+        main.upload_changed_dashboards()
+    assert main.uploaded_dashboard_hashes == {"config/dashboards/a.json": "hash a"}
+
+    # Only the one that failed is uploaded again
+    dashboards["failing"] = set()
+    main.upload_changed_dashboards()
+    assert dashboards["uploads"] == [["a.json", "b.json"], ["b.json"]]
+    assert set(main.uploaded_dashboard_hashes) == {"config/dashboards/a.json", "config/dashboards/b.json"}
+
+
+def test_failed_reload_isnt_ready(dashboards):
+    dashboards["failing"] = {"a.json"}
+    with pytest.raises(RuntimeError):
+        main.reload_dashboards()
+    assert readiness.PHASES.report()["phases"]["dashboards"]["state"] == readiness.RETRYING
+
+    dashboards["failing"] = set()
+    main.reload_dashboards()
+    assert readiness.PHASES.report()["phases"]["dashboards"]["state"] == readiness.READY
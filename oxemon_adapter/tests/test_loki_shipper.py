@@ -0,0 +1,128 @@
+import gzip
+import json
+from types import SimpleNamespace
+
+import pytest
+import requests
+from prometheus_client import REGISTRY
+
+from loki_shipper import LokiShipper
+
+
+class FakeSession:
+    """
+    Answers the pushes with the given statuses (or raises the given exceptions), and keeps the pushed lines.
+    """
+    def __init__(self, *answers, during_post=None):
+        self.answers = list(answers)
+        self.during_post = during_post
+        self.pushes = []
+
+    def post(self, url, data, timeout):
+        payload = json.loads(gzip.decompress(data))
+        self.pushes.append([line for stream in payload["streams"] for _, line in stream["values"]])
+        if self.during_post:
+            self.during_post()
+        answer = self.answers.pop(0) if self.answers else 204
+        if isinstance(answer, Exception):
+            raise answer
+        return SimpleNamespace(status_code=answer, text="")
+
+    def close(self):
+        pass
+
+
+def dropped_lines() -> float:
+    return REGISTRY.get_sample_value("oxemon_adapter_loki_dropped_lines_total")
+
+
+def create_shipper(session: FakeSession, batch_size: int = 2, max_pending: int = 10) -> LokiShipper:
+    shipper = LokiShipper("http://loki", batch_size=batch_size, flush_interval=1, max_pending=max_pending)
+    shipper._session = session
+    return shipper
+
+
+def pending_lines(shipper: LokiShipper) -> list:
+    return [line for _, _, line in shipper._pending]
+
+
+def retry_now(shipper: LokiShipper):
+    shipper._retry_at = 0
+
+
+def test_push_drops_the_oldest_lines_beyond_max_pending():
+    shipper = create_shipper(FakeSession(), max_pending=3)
+    before = dropped_lines()
+    for index in range(5):
+        shipper.push("module", f"line {index}")
+    assert pending_lines(shipper) == ["line 2", "line 3", "line 4"]
+    assert dropped_lines() - before == 2
+
+
+def test_failed_batch_is_put_back_in_order():
+    session = FakeSession(503)
+    shipper = create_shipper(session)
+    for index in range(4):
+        shipper.push("module", f"line {index}")
+
+    shipper.flush()
+    assert session.pushes == [["line 0", "line 1"]]
+    assert pending_lines(shipper) == ["line 0", "line 1", "line 2", "line 3"]
+
+    # Backing off, nothing is pushed until the retry is due
+    shipper.flush()
+    assert len(session.pushes) == 1
+
+    retry_now(shipper)
+    shipper.flush()
+    assert session.pushes[1:] == [["line 0", "line 1"], ["line 2", "line 3"]]
+    assert not shipper._pending
+
+
+def test_put_back_drops_and_counts_the_oldest_lines_that_no_longer_fit():
+    shipper = None
+
+    def push_meanwhile():
+        shipper.push("module", "new 0")
+        shipper.push("module", "new 1")
+
+    shipper = create_shipper(FakeSession(500, during_post=push_meanwhile), batch_size=3, max_pending=4)
+    for index in range(4):
+        shipper.push("module", f"line {index}")
+    before = dropped_lines()
+
+    shipper.flush()
+    # The batch is older than the lines pushed while it failed, so its first lines are dropped
+    assert pending_lines(shipper) == ["line 2", "line 3", "new 0", "new 1"]
+    assert dropped_lines() - before == 2
+
+
+@pytest.mark.parametrize("answer", [500, 503, 429, requests.ConnectionError("refused")])
+def test_overload_and_connection_errors_are_retried(answer):
+    session = FakeSession(answer)
+    shipper = create_shipper(session)
+    shipper.push("module", "line 0")
+    shipper.push("module", "line 1")
+    before = dropped_lines()
+
+    shipper.flush()
+    assert pending_lines(shipper) == ["line 0", "line 1"]
+    retry_now(shipper)
+    shipper.flush()
+    assert session.pushes == [["line 0", "line 1"]] * 2
+    assert not shipper._pending and dropped_lines() == before
+
+
+@pytest.mark.parametrize("status", [400, 413])
+def test_rejected_batch_is_dropped_and_counted(status):
+    session = FakeSession(status)
+    shipper = create_shipper(session)
+    for index in range(4):
+        shipper.push("module", f"line {index}")
+    before = dropped_lines()
+
+    # The next batch isn't held up by the rejected one (nor by a backoff)
+    shipper.flush()
+    assert session.pushes == [["line 0", "line 1"], ["line 2", "line 3"]]
+    assert not shipper._pending
+    assert dropped_lines() - before == 2
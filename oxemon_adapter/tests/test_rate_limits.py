@@ -0,0 +1,22 @@
+from prometheus_client import REGISTRY
+
+import rate_limits
+
+
+def shed_sources() -> set:
+    return {sample.labels["source"] for family in REGISTRY.collect()
+            if family.name == "oxemon_adapter_shed_datagrams" for sample in family.samples
+            if sample.name.endswith("_total")}
+
+
+def test_forgotten_sources_remove_their_series(monkeypatch):
+    monkeypatch.setattr(rate_limits, "MAX_TRACKED_SOURCES", 10)
+    limiter = rate_limits.SourceLimiter({"default": {"rate": 1, "burst": 1}})
+    hosts = [f"10.1.0.{index}" for index in range(50)]
+    for host in hosts:
+        # The second datagram of every source is shed
+        assert limiter.allow((host, 1)) and not limiter.allow((host, 1))
+
+    tracked = set(limiter._buckets)
+    assert len(tracked) <= rate_limits.MAX_TRACKED_SOURCES
+    assert shed_sources() & set(hosts) == tracked
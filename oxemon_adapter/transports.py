@@ -0,0 +1,149 @@
+"""
+Stream transports, which receive emits alongside the UDP listener: a serial device and a TCP listener.
+
+Every transport runs in its own thread, reads straight into a `StreamFramer` and hands the decoded emits to
+`handle_records` (which is also called with no emits when the transport is idle, e.g. to flush pending updates).
+"""
+import os
+import select
+import selectors
+import socket
+import termios
+import time
+import tty
+from typing import Callable, List
+
+import adapter_metrics
+import icd
+from stream_framer import StreamFramer
+
+RecordsHandler = Callable[[List[icd.EmitRecord]], None]
+IdsChecker = Callable[[int, int], bool]
+
+# How long to wait before reopening a serial device that is missing or was closed
+REOPEN_INTERVAL = 1.0
+# How often (in seconds) the transports check whether they should stop
+POLL_INTERVAL = 1.0
+
+
+def _open_serial(path: str, baudrate: int) -> int:
+    fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    if os.isatty(fd):
+        tty.setraw(fd)
+        attributes = termios.tcgetattr(fd)
+        attributes[4] = attributes[5] = getattr(termios, f"B{baudrate}")  # Input and output speeds
+        termios.tcsetattr(fd, termios.TCSANOW, attributes)
+    return fd
+
+
+def _read_serial(fd: int, framer: StreamFramer, handle_records: RecordsHandler, should_stop: Callable[[], bool]):
+    """
+    Reads from an open serial device until it's closed (by the other side) or the transport should stop.
+    """
+    while not should_stop():
+        readable, _, _ = select.select([fd], [], [], POLL_INTERVAL)
+        if not readable:
+            handle_records([])
+            continue
+        try:
+            size = os.readv(fd, [framer.writable()])
+        except BlockingIOError:
+            continue
+        except OSError:
+            return  # EIO once the other side of a pty is closed
+        if not size:
+            return
+        framer.commit(size)
+        adapter_metrics.BYTES_RECEIVED.inc(size)
+        handle_records(framer.records())
+
+
+def serve_serial(path: str, baudrate: int, is_known: IdsChecker, handle_records: RecordsHandler,
+                 should_stop: Callable[[], bool]):
+    """
+    Receives emits from a serial device (or a pty), reopening it whenever it disappears.
+    """
+    while not should_stop():
+        try:
+            fd = _open_serial(path, baudrate)
+        except (OSError, termios.error) as e:
+            print(f"❌ Failed to open the serial device {path}: {e}")
+            time.sleep(REOPEN_INTERVAL)
+            continue
+
+        print(f"Listening for emits on the serial device {path} ({baudrate} baud)...")
+        adapter_metrics.STREAM_CONNECTIONS.inc()
+        try:
+            # A new framer, since the stream might have been cut in the middle of an emit
+            _read_serial(fd, StreamFramer(is_known=is_known), handle_records, should_stop)
+        finally:
+            adapter_metrics.STREAM_CONNECTIONS.dec()
+            os.close(fd)
+        if not should_stop():
+            time.sleep(REOPEN_INTERVAL)
+
+
+def serve_tcp(address: tuple, is_known: IdsChecker, handle_records: RecordsHandler, should_stop: Callable[[], bool],
+              reuse_port: bool = False):
+    """
+    Receives emits from any amount of TCP connections (every connection is a separate stream).
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    listener.bind(address)
+    listener.listen()
+    listener.setblocking(False)
+    print(f"Listening for TCP connections on {address[0]}:{address[1]}...")
+
+    selector = selectors.DefaultSelector()
+    selector.register(listener, selectors.EVENT_READ)
+    try:
+        while not should_stop():
+            events = selector.select(POLL_INTERVAL)
+            if not events:
+                handle_records([])
+            for key, _ in events:
+                if key.fileobj is listener:
+                    _accept(listener, selector, is_known)
+                else:
+                    _receive(key.fileobj, key.data, selector, handle_records)
+    finally:
+        for key in list(selector.get_map().values()):
+            if key.fileobj is not listener:
+                _close(key.fileobj, selector)
+        selector.close()
+        listener.close()
+
+
+def _accept(listener: socket.socket, selector: selectors.BaseSelector, is_known: IdsChecker):
+    try:
+        connection, _ = listener.accept()
+    except BlockingIOError:
+        return
+    connection.setblocking(False)
+    selector.register(connection, selectors.EVENT_READ, StreamFramer(is_known=is_known))
+    adapter_metrics.STREAM_CONNECTIONS.inc()
+
+
+def _receive(connection: socket.socket, framer: StreamFramer, selector: selectors.BaseSelector,
+             handle_records: RecordsHandler):
+    try:
+        size = connection.recv_into(framer.writable())
+    except BlockingIOError:
+        return
+    except OSError:
+        size = 0
+    if not size:
+        _close(connection, selector)
+        return
+    framer.commit(size)
+    adapter_metrics.BYTES_RECEIVED.inc(size)
+    handle_records(framer.records())
+
+
+def _close(connection: socket.socket, selector: selectors.BaseSelector):
+    selector.unregister(connection)
+    connection.close()
+    adapter_metrics.STREAM_CONNECTIONS.dec()
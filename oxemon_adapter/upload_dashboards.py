@@ -1,63 +1,127 @@
 import requests
 import json
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
 from pathlib import Path
-import time
+from typing import List, Tuple
+from requests.adapters import HTTPAdapter
 from grafana_api_handling import create_grafana_api_key
 
 
 GRAFANA_URL = "http://grafana:3000"
 
 
-def check_dashboard_exists(title: str, grafana_api_header: dict):
-    try:
-        response = requests.get(f"{GRAFANA_URL}/api/search?query={title}", headers=grafana_api_header, timeout=5)
-        if response.status_code != 200:
-            return None
-        results = response.json()
+# The content hash of an uploaded dashboard is kept in its tags, so unchanged dashboards are never re-uploaded
+HASH_TAG_PREFIX = "oxemon-hash:"
+SEARCH_PAGE_SIZE = 5000  # The maximum Grafana allows
 
-        for existing_dashboards in results:
-            if existing_dashboards.get("title") == title and existing_dashboards.get("type") == "dash-db":
-                return existing_dashboards.get("uid")
-        return None
-    except Exception as e:
-        print(f"Error while checking dashboard: {e}")
-        return None
-    
-
-def upload_module_dashboards(module_dashboards_data: list, folder_id=0, overwrite=True):
-    grafana_api_key = create_grafana_api_key()
-    print(grafana_api_key)
-    api_header = {
+
+def create_grafana_session(grafana_api_key: str, pool_size: int) -> requests.Session:
+    """
+    A session whose connections are reused by all the requests (and shared by up to `pool_size` threads).
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({
         "Authorization": f"Bearer {grafana_api_key}",
         "Content-Type": "application/json"
+    })
+    return session
+
+
+def search_dashboards(session: requests.Session) -> dict:
+    """
+    Fetches all the existing dashboards at once (by pages), by their title.
+    """
+    existing_dashboards = {}
+    page = 1
+    while True:
+        response = session.get(f"{GRAFANA_URL}/api/search",
+                               params={"type": "dash-db", "limit": SEARCH_PAGE_SIZE, "page": page}, timeout=10)
+        response.raise_for_status()
+        results = response.json()
+        for result in results:
+            existing_dashboards[result["title"]] = result
+        if len(results) < SEARCH_PAGE_SIZE:
+            return existing_dashboards
+        page += 1
+
+
+def _stored_hash(existing_dashboard: dict):
+    for tag in existing_dashboard.get("tags", []):
+        if tag.startswith(HASH_TAG_PREFIX):
+            return tag[len(HASH_TAG_PREFIX):]
+    return None
+
+
+def _with_hash_tag(dashboard: dict, content_hash: str) -> dict:
+    tags = [tag for tag in dashboard.get("tags", []) if not tag.startswith(HASH_TAG_PREFIX)]
+    return dict(dashboard, tags=tags + [HASH_TAG_PREFIX + content_hash])
+
+
+def upload_dashboard(session: requests.Session, dashboard: dict, folder_id=0, overwrite=True) -> bool:
+    payload = {
+        "dashboard": dashboard,
+        "folderId": folder_id,
+        "overwrite": overwrite
     }
+
+    try:
+        response = session.post(f"{GRAFANA_URL}/api/dashboards/db", data=json.dumps(payload), timeout=10)
+    except requests.RequestException as e:
+        print(f"❌ Failed to upload dashboard {dashboard['title']}: {e}")
+        return False
+
+    if response.status_code != 200:
+        print(f"❌ Failed to upload dashboard {dashboard['title']}: {response.status_code}")
+        print(response.text)
+        return False
+    return True
+
+
+def upload_module_dashboards(module_dashboards_data: list, folder_id=0, overwrite=True, concurrency=8,
+                             grafana_api_key=None) -> Tuple[int, List[str]]:
+    """
+    Uploads the given dashboards (concurrently), skipping the ones that are already in Grafana with the same content.
+
+    Returns the amount of dashboards that were uploaded, and the titles of those that failed to.
+    """
+    if grafana_api_key is None:
+        grafana_api_key = create_grafana_api_key()
+    session = create_grafana_session(grafana_api_key, concurrency)
+
+    existing_dashboards = search_dashboards(session)
+    uploads = []
     for dashboard in module_dashboards_data:
-        existing_dashboard_uid = check_dashboard_exists(dashboard["title"], api_header)
-        if existing_dashboard_uid:
-            dashboard["uid"] = existing_dashboard_uid
+        content_hash = dashboard_content_hash(dashboard)
+        existing_dashboard = existing_dashboards.get(dashboard["title"])
+        if existing_dashboard is None:
+            uploads.append(_with_hash_tag(dashboard, content_hash))
+        elif _stored_hash(existing_dashboard) != content_hash:
+            uploads.append(dict(_with_hash_tag(dashboard, content_hash), uid=existing_dashboard["uid"]))
 
-        payload = {
-            "dashboard": dashboard,
-            "folderId": folder_id,
-            "overwrite": overwrite
-        }
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="dashboard-upload") as executor:
+        results = list(executor.map(lambda dashboard: upload_dashboard(session, dashboard, folder_id, overwrite),
+                                    uploads))
+    session.close()
+    failed = [dashboard["title"] for dashboard, uploaded in zip(uploads, results) if not uploaded]
+    return len(uploads) - len(failed), failed
 
-        response = requests.post(f"{GRAFANA_URL}/api/dashboards/db", headers=api_header, data=json.dumps(payload),
-                                 timeout=10)
 
-        if response.status_code != 200:
-            print(f"❌ Failed to upload dashboard: {response.status_code}")
-            print(response.text)
+def dashboard_content_hash(dashboard: dict) -> str:
+    return sha256(json.dumps(dashboard, sort_keys=True).encode()).hexdigest()
 
 
 def load_module_dashboards(dashboards_directory: str):
     """
     Saves the given dashboards in some directory.
     """
-    dashboards = []
-    for dashboard_path in Path(dashboards_directory).iterdir():
-        with dashboard_path.open("r") as f:
-            dashboards.append(json.load(f))
+    return [load_dashboard(dashboard_path) for dashboard_path in Path(dashboards_directory).iterdir()]
+
 
-    return dashboards
+def load_dashboard(dashboard_path) -> dict:
+    with open(dashboard_path, "r") as f:
+        return json.load(f)
 
@@ -0,0 +1,77 @@
+import multiprocessing
+import os
+from functools import partial
+from typing import Callable, Optional
+
+from prometheus_client import CollectorRegistry, multiprocess
+
+# The currently running workers (only in the supervising process)
+worker_processes = []
+
+
+def create_metrics_registry() -> CollectorRegistry:
+    """
+    Creates a registry which aggregates the metrics of all the workers (for the `/metrics` endpoint).
+    """
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def signal_workers(signum: int):
+    """
+    Forwards a signal to all the workers.
+    """
+    for process in worker_processes:
+        if process.pid is not None and process.is_alive():
+            os.kill(process.pid, signum)
+
+
+def _worker_main(target: Callable):
+    # The forked worker must not consider its siblings as its own workers
+    worker_processes.clear()
+    target()
+
+
+def run_workers(worker_count: int, target: Callable, should_stop: Callable[[], bool],
+                services: Optional[Callable] = None):
+    """
+    Forks `worker_count` processes running `target(reuse_port=True)` (and one running `services()`, if given), and
+    supervises them until `should_stop()`.
+
+    Workers are forked with `fork`, so the calling process must not have started any thread (a thread holding a
+    lock while forking would leave it locked forever in the worker), anything running in threads goes in `services`.
+    Workers that die unexpectedly are restarted. On exit, the workers are sent SIGTERM and joined.
+    """
+    context = multiprocessing.get_context("fork")
+    # (description, process name, target) of every process
+    targets = [(f"receiver worker {index}", f"oxemon-receiver-{index}", partial(target, reuse_port=True))
+               for index in range(worker_count)]
+    if services is not None:
+        targets.append(("services process", "oxemon-services", services))
+
+    def start_worker(index: int):
+        description, name, worker_target = targets[index]
+        process = context.Process(target=_worker_main, args=(worker_target,), name=name)
+        process.start()
+        print(f"Started the {description} (pid {process.pid})")
+        return process
+
+    processes = worker_processes
+    processes[:] = [start_worker(index) for index in range(len(targets))]
+    try:
+        while not should_stop():
+            for index, process in enumerate(processes):
+                process.join(timeout=1.0 / len(processes))
+                if process.is_alive() or should_stop():
+                    continue
+                print(f"The {targets[index][0]} (pid {process.pid}) exited with {process.exitcode}, restarting it")
+                multiprocess.mark_process_dead(process.pid)
+                processes[index] = start_worker(index)
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+            multiprocess.mark_process_dead(process.pid)
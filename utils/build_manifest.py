@@ -0,0 +1,69 @@
+"""
+The build manifest of `make config`: the content hashes of its inputs and of every artifact it generated.
+
+It lets `configure.py` rebuild only what its changed inputs affect (and prune what's no longer generated), and
+the adapter detect changes of its configuration by comparing hashes instead of file times.
+"""
+import json
+import os
+import sys
+from hashlib import sha256
+from pathlib import Path
+from typing import Iterable
+
+# The manifest's name and version are defined by the adapter, which reads it
+sys.path.append(str(Path(__file__).resolve().parents[1] / "oxemon_adapter"))
+from reload import MANIFEST_NAME, MANIFEST_VERSION  # noqa: E402
+
+
+def content_hash(content: bytes) -> str:
+    return sha256(content).hexdigest()
+
+
+def file_hash(path: Path) -> str:
+    return content_hash(path.read_bytes())
+
+
+def entries_hash(*parts) -> str:
+    """
+    A hash of some configuration entries (anything serializable to JSON), which doesn't depend on dictionary order.
+    """
+    return content_hash(json.dumps(parts, sort_keys=True, default=str).encode())
+
+
+def sources_hash(paths: Iterable[str]) -> str:
+    """
+    A hash of the generator's own sources, so that updating `oxemon-frontend` rebuilds everything.
+    """
+    return content_hash(b"".join(Path(path).read_bytes() for path in sorted(paths)))
+
+
+def empty_manifest() -> dict:
+    return {"version": MANIFEST_VERSION, "generator": None, "inputs": {}, "dashboards": {}, "artifacts": {}}
+
+
+def load_manifest(output_directory: Path) -> dict:
+    """
+    Loads the manifest of a previous build into `output_directory`, or an empty one (which rebuilds everything).
+    """
+    try:
+        manifest = json.loads((output_directory / MANIFEST_NAME).read_text())
+    except (FileNotFoundError, ValueError):
+        return empty_manifest()
+    if manifest.get("version") != MANIFEST_VERSION:
+        return empty_manifest()
+    return manifest
+
+
+def write_atomically(path: Path, content: bytes):
+    """
+    Writes a file such that readers (e.g. the running adapter) never see it half-written.
+    """
+    temporary_path = path.with_name(f".{path.name}.tmp")
+    temporary_path.write_bytes(content)
+    os.replace(temporary_path, path)
+
+
+def save_manifest(manifest: dict, output_directory: Path):
+    # Saved last, after all the artifacts it lists were written
+    write_atomically(output_directory / MANIFEST_NAME, json.dumps(manifest, indent=2, sort_keys=True).encode())
@@ -1,11 +1,49 @@
-import shutil
+import json
+import sys
 import time
+from functools import partial
 from argparse import ArgumentParser
 from pathlib import Path
 from contextlib import contextmanager
+from typing import Optional
 
+from yaml import SafeLoader, load
+
+try:
+    from yaml import CSafeLoader as SafeLoader  # noqa: F811 (libyaml is much faster on large configurations)
+except ImportError:
+    pass
+
+import build_manifest
 import convert_input_config_to_event_registry
 import generate_grafana_dashboards_from_input_config
+from build_manifest import content_hash, entries_hash, write_atomically
+from generate_grafana_dashboards_from_input_config import (
+    ADAPTER_HEALTH_DASHBOARD_NAME,
+    DEFAULT_WORKERS,
+    create_adapter_health_dashboard,
+    create_module_dashboard,
+    dashboard_file_name,
+    group_entries_by_module,
+    write_dashboards,
+)
+
+# The dictionary index is compiled with the adapter's own module, which reads it
+sys.path.append(str(Path(__file__).resolve().parents[1] / "oxemon_adapter"))
+import dictionary_index  # noqa: E402
+
+EVENT_REGISTRY_NAME = "event_registry.yaml"
+DASHBOARDS_DIRECTORY_NAME = "dashboards"
+SOURCES_DIRECTORY_NAME = "src"
+DICTIONARY_INDEX_NAME = "oxemon_dictionary.idx"
+# A change in any of these rebuilds everything
+GENERATOR_SOURCES = [
+    __file__,
+    dictionary_index.__file__,
+    build_manifest.__file__,
+    convert_input_config_to_event_registry.__file__,
+    generate_grafana_dashboards_from_input_config.__file__,
+]
 
 
 def parse_args():
@@ -14,6 +52,8 @@ def parse_args():
     parser.add_argument("--dictionary", type=Path, required=True)
     parser.add_argument("--metrics", type=Path, required=True)
     parser.add_argument("--output", type=Path, required=True)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Processes which create and write the dashboards")
 
     arguments = parser.parse_args()
 
@@ -47,29 +87,158 @@ def log_step(name: str, *, verbose: bool = True):
         print(f"    time took: {end_time - start_time:.3f}s")
 
 
+class IncrementalBuild:
+    """
+    Writes the artifacts of a build into `output`, skipping those whose content is the same as in the previous
+    build (so that their modification time, and the adapter, aren't disturbed), and records them in a new manifest.
+    """
+    def __init__(self, output: Path, previous: dict, manifest: dict):
+        self.output = output
+        self.previous = previous
+        self.manifest = manifest
+        self.written = []
+        self.unchanged = 0
+
+    def is_built(self, artifact: str) -> bool:
+        return artifact in self.previous["artifacts"] and (self.output / artifact).exists()
+
+    def keep(self, artifact: str):
+        self.manifest["artifacts"][artifact] = self.previous["artifacts"][artifact]
+        self.unchanged += 1
+
+    def previous_hash(self, artifact: str) -> Optional[str]:
+        return self.previous["artifacts"][artifact] if self.is_built(artifact) else None
+
+    def record(self, artifact: str, artifact_hash: str, written: bool):
+        self.manifest["artifacts"][artifact] = artifact_hash
+        if written:
+            self.written.append(artifact)
+        else:
+            self.unchanged += 1
+
+    def write(self, artifact: str, content: bytes):
+        artifact_hash = content_hash(content)
+        written = artifact_hash != self.previous_hash(artifact)
+        if written:
+            path = self.output / artifact
+            path.parent.mkdir(parents=True, exist_ok=True)
+            write_atomically(path, content)
+        self.record(artifact, artifact_hash, written)
+
+    def prune(self) -> list:
+        """
+        Deletes the artifacts of the previous build which aren't generated anymore (e.g. dashboards of removed
+        modules), including dashboards of builds which predate the manifest.
+        """
+        stale = set(self.previous["artifacts"]) - set(self.manifest["artifacts"])
+        dashboards_directory = self.output / DASHBOARDS_DIRECTORY_NAME
+        if dashboards_directory.is_dir():
+            stale.update(f"{DASHBOARDS_DIRECTORY_NAME}/{path.name}" for path in dashboards_directory.iterdir()
+                         if path.name.endswith("_dashboard.json"))
+            stale -= set(self.manifest["artifacts"])
+        for artifact in sorted(stale):
+            (self.output / artifact).unlink(missing_ok=True)
+        return sorted(stale)
+
+
+def dashboard_sources(generator: str, monitoring_entries: dict):
+    """
+    Yields the title, the hash of the inputs and a function which creates it, of every dashboard.
+    """
+    for module_name, module_entries in group_entries_by_module(monitoring_entries).items():
+        yield (module_name, entries_hash(generator, module_name, module_entries),
+               partial(create_module_dashboard, module_name, module_entries))
+    yield ADAPTER_HEALTH_DASHBOARD_NAME, entries_hash(generator), create_adapter_health_dashboard
+
+
+def build_dashboards(build: IncrementalBuild, monitoring_entries: dict, workers: int):
+    """
+    Rebuilds only the dashboards of modules whose entries changed since the previous build (in parallel).
+    """
+    (build.output / DASHBOARDS_DIRECTORY_NAME).mkdir(exist_ok=True)
+    changed_artifacts, jobs = [], []
+    for title, inputs_hash, create in dashboard_sources(build.manifest["generator"], monitoring_entries):
+        artifact = f"{DASHBOARDS_DIRECTORY_NAME}/{dashboard_file_name(title)}"
+        build.manifest["dashboards"][title] = {"inputs": inputs_hash, "artifact": artifact}
+        if build.previous["dashboards"].get(title) == build.manifest["dashboards"][title] and build.is_built(artifact):
+            build.keep(artifact)
+        else:
+            changed_artifacts.append(artifact)
+            jobs.append((build.output / artifact, create, build.previous_hash(artifact)))
+
+    for artifact, (artifact_hash, written) in zip(changed_artifacts, write_dashboards(jobs, workers)):
+        build.record(artifact, artifact_hash, written)
+
+
+def configure(dictionary: Path, metrics: Path, output: Path, workers: int = DEFAULT_WORKERS) -> IncrementalBuild:
+    """
+    Builds the configuration folder, only regenerating what the changes since the previous build affect.
+    """
+    dictionary_content = dictionary.read_bytes()
+    metrics_content = metrics.read_bytes()
+    previous = build_manifest.load_manifest(output)
+    manifest = build_manifest.empty_manifest()
+    manifest["generator"] = build_manifest.sources_hash(GENERATOR_SOURCES)
+    manifest["inputs"] = {"dictionary": content_hash(dictionary_content), "metrics": content_hash(metrics_content)}
+    build = IncrementalBuild(output, previous, manifest)
+
+    # Compiled first, so that a dictionary with collisions leaves the output untouched
+    dictionary_unchanged = (previous["generator"] == manifest["generator"]
+                            and previous["inputs"].get("dictionary") == manifest["inputs"]["dictionary"])
+    if dictionary_unchanged and build.is_built(DICTIONARY_INDEX_NAME):
+        build.keep(DICTIONARY_INDEX_NAME)
+    else:
+        with log_step("Compile dictionary index"):
+            build.write(DICTIONARY_INDEX_NAME, dictionary_index.compile_dictionary(
+                json.loads(dictionary_content), dictionary_index.dictionary_source_hash(dictionary_content)
+            ))
+
+    with log_step("Copy source files for reproducability", verbose=False):
+        build.write(f"{SOURCES_DIRECTORY_NAME}/{dictionary.name}", dictionary_content)
+        build.write(f"{SOURCES_DIRECTORY_NAME}/{metrics.name}", metrics_content)
+
+    metrics_artifacts = [EVENT_REGISTRY_NAME] + [dashboard["artifact"] for dashboard in previous["dashboards"].values()]
+    metrics_unchanged = (previous["generator"] == manifest["generator"]
+                         and previous["inputs"].get("metrics") == manifest["inputs"]["metrics"])
+    if metrics_unchanged and all(map(build.is_built, metrics_artifacts)):
+        with log_step("Metrics configuration unchanged, keep the event registry and dashboards", verbose=False):
+            manifest["dashboards"] = previous["dashboards"]
+            for artifact in metrics_artifacts:
+                build.keep(artifact)
+    else:
+        with log_step("Load metrics configuration"):
+            monitoring_entries = load(metrics_content, Loader=SafeLoader)
+            convert_input_config_to_event_registry.validate_config(monitoring_entries)
+
+        with log_step("Create event registry"):
+            event_registry = convert_input_config_to_event_registry.convert_monitoring_entries_to_event_registry(
+                monitoring_entries
+            )
+            build.write(EVENT_REGISTRY_NAME,
+                        convert_input_config_to_event_registry.serialize_event_registry(event_registry))
+
+        with log_step("Create dashboard configurations"):
+            build_dashboards(build, monitoring_entries, workers)
+
+    with log_step("Copy dictionary file", verbose=False):
+        build.write(dictionary.name, dictionary_content)
+
+    with log_step("Prune stale files", verbose=False):
+        for artifact in build.prune():
+            print(f"    removed {artifact}")
+
+    build_manifest.save_manifest(manifest, output)
+    return build
+
+
 if __name__ == '__main__':
     args = parse_args()
 
     with log_step("Create output directory", verbose=False):
         args.output.mkdir(exist_ok=True)
 
-    with log_step("Copy source files for reproducability", verbose=False):
-        src_dir = args.output / "src"
-        src_dir.mkdir(exist_ok=True)
-        shutil.copy2(str(args.dictionary), str(src_dir))
-        shutil.copy2(str(args.metrics), str(src_dir))
-
-    with log_step("Create event registry"):
-        convert_input_config_to_event_registry.create_event_registry_from_config(
-            args.metrics,
-            args.output / "event_registry.yaml",
-        )
-
-    with log_step("Create dashboard configurations"):
-        generate_grafana_dashboards_from_input_config.create_module_dashboards_from_config(
-            args.metrics,
-            args.output / "dashboards"
-        )
-
-    with log_step("Copy dictionary file", verbose=False):
-        shutil.copy2(str(args.dictionary), str(args.output))
+    try:
+        build = configure(args.dictionary, args.metrics, args.output, args.workers)
+    except dictionary_index.DictionaryCollisionError as e:
+        sys.exit(f"❌ {e}")
+    print(f"Wrote {len(build.written)} changed files ({build.unchanged} unchanged)")
@@ -4,9 +4,25 @@ from collections import defaultdict
 from yaml import safe_load, safe_dump
 
 DEFAULT_EVENT_REGISTRY_PATH = "event_registry.yaml"
+# A top-level key of the rate limits of source addresses (every other top-level key is an entry), which is copied
+# to the event registry as is
+SOURCE_RATE_LIMITS_KEY = "source_rate_limits"
 REQUIRED_ENTRY_KEYS = ["type", "module_id", "event_id", "operations"]
-VALID_ENTRY_TYPES = {"counter", "gauge", "enum"}
-VALID_ENTRY_OPERATIONS = {"sum", "average", "rolling_average", "show_current"}
+VALID_ENTRY_TYPES = {"counter", "gauge", "enum", "distribution"}
+# Distributions are shown by their percentiles (over the adapter's sketch window), and only by them
+DISTRIBUTION_OPERATIONS = {"p50", "p90", "p99", "max"}
+VALID_ENTRY_OPERATIONS = {"sum", "average", "rolling_average", "show_current"} | DISTRIBUTION_OPERATIONS
+
+
+def validate_rate_limit(name: str, limit: dict):
+    """
+    Validates a token bucket limit: `rate` (per second) and an optional `burst` (defaults to the rate).
+    """
+    assert isinstance(limit, dict) and "rate" in limit, f"The rate limit of '{name}' must have a 'rate'"
+    for key, value in limit.items():
+        assert key in ("rate", "burst"), f"Invalid key '{key}' in the rate limit of '{name}'"
+        assert isinstance(value, (int, float)) and value > 0, f"'{key}' must be a positive number in '{name}'"
+    assert limit.get("burst", limit["rate"]) >= 1, f"'burst' must be at least 1 in '{name}'"
 
 
 def validate_entry(name: str, entry: dict):
@@ -25,18 +41,28 @@ def validate_entry(name: str, entry: dict):
     assert isinstance(entry["operations"], list), f"'operations' must be a list in '{name}'"
     for operation in entry["operations"]:
         assert operation in VALID_ENTRY_OPERATIONS, f"Invalid operation {operation} in '{name}'"
+        assert (operation in DISTRIBUTION_OPERATIONS) == (entry["type"] == "distribution"), \
+            f"Operation {operation} doesn't apply to the {entry['type']} type in '{name}'"
 
     if entry["type"] == "enum":
         assert "values" in entry, f"Missing 'values' for enum type in '{name}'"
         assert isinstance(entry["values"], dict), f"'values' must be a dict in '{name}'"
 
+    if "rate_limit" in entry:
+        validate_rate_limit(name, entry["rate_limit"])
+
 
 def validate_config(config_data: dict):
     """
     Validates the monitoring configuration data (YAML configuration).
     """
     for name, entry in config_data.items():
-        validate_entry(name, entry)
+        if name == SOURCE_RATE_LIMITS_KEY:
+            assert isinstance(entry, dict), f"'{SOURCE_RATE_LIMITS_KEY}' must be a dict of source addresses"
+            for source, limit in entry.items():
+                validate_rate_limit(f"{SOURCE_RATE_LIMITS_KEY}: {source}", limit)
+        else:
+            validate_entry(name, entry)
 
 
 def convert_monitoring_entries_to_event_registry(monitoring_entries: dict) -> dict:
@@ -44,22 +70,30 @@ def convert_monitoring_entries_to_event_registry(monitoring_entries: dict) -> di
     Creates an "event-centric" dictionary from a given dictionary of monitoring entries.
     """
     registry = defaultdict(lambda: {"modules": []})
-    for entry in monitoring_entries.values():
+    for name, entry in monitoring_entries.items():
+        if name == SOURCE_RATE_LIMITS_KEY:
+            registry[SOURCE_RATE_LIMITS_KEY] = entry
+            continue
         event_id = entry["event_id"]
         registry[event_id]["type"] = entry["type"]
         registry[event_id]["modules"].append(entry["module_id"])
         if entry["type"] == "enum":
             registry[event_id]["values"] = entry["values"]
+        if "rate_limit" in entry:
+            registry[event_id].setdefault("rate_limits", {})[entry["module_id"]] = entry["rate_limit"]
 
     return dict(registry)
 
 
+def serialize_event_registry(event_registry_data: dict) -> bytes:
+    return safe_dump(event_registry_data, sort_keys=False).encode()
+
+
 def save_event_registry(event_registry_data: dict, file_path: str):
     """
     Saves the event registry data to some file.
     """
-    with open(file_path, "w") as f:
-        safe_dump(event_registry_data, f, sort_keys=False)
+    Path(file_path).write_bytes(serialize_event_registry(event_registry_data))
 
 
 def create_event_registry_from_config(monitoring_entries_config_path: str, event_registry_path: str):
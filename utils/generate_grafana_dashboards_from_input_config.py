@@ -1,27 +1,58 @@
+import os
 from pathlib import Path
 from argparse import ArgumentParser
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import requests
 from hashlib import sha256
-from copy import deepcopy
-from json import dump, dumps
+from json import dumps
+from typing import Callable, Iterable, Iterator, Optional
 from yaml import safe_load
-from convert_input_config_to_event_registry import validate_config
+from build_manifest import content_hash, write_atomically
+from convert_input_config_to_event_registry import SOURCE_RATE_LIMITS_KEY, validate_config
 
 PROMETHEUS_SOURCE_UID = "prometheus_ds"
 LOKI_SOURCE_UID = "loki_ds"
 DEFAULT_DASHBOARDS_DIRECTORY_NAME = "dashboards"
 PANEL_HEIGHT = 8
 PANEL_WIDTH = 12
-TEMPLATE_PANEL = {
-    "id": "id",
-    "type": "timeseries",
-    "title": "title",
-    "datasource": {"type": "prometheus", "uid": PROMETHEUS_SOURCE_UID},
-    "targets": [{"expr": "expr", "legendFormat": "{{module}}", "interval": "", "refId": "refId"}],
-    "gridPos": {"h": PANEL_HEIGHT, "w": PANEL_WIDTH, "x": 0, "y": 0},
-    "fieldConfig": {"defaults": {"mappings": []}},
-}
+# Many dashboards are built and written by a pool of up to this many processes (building them is CPU-bound)
+DEFAULT_WORKERS = os.cpu_count() or 1
+# How many dashboards every worker builds at a time
+WORKER_CHUNK_SIZE = 16
+# Below this many dashboards (a few milliseconds each), starting a pool costs more than it saves
+POOL_MIN_JOBS = 64
+
+ADAPTER_HEALTH_DASHBOARD_NAME = "oxemon adapter health"
+# (title, PromQL expression, legend) of every panel in the adapter's health dashboard
+ADAPTER_HEALTH_PANELS = [
+    ("Packets per second", "sum(rate(oxemon_adapter_packets_received_total[1m]))", "packets"),
+    ("Bytes per second", "sum(rate(oxemon_adapter_bytes_received_total[1m]))", "bytes"),
+    ("Decode errors per second", "sum by (reason) (rate(oxemon_adapter_decode_errors_total[1m]))", "{{reason}}"),
+    ("Unknown ids per second", "sum by (kind) (rate(oxemon_adapter_unknown_ids_total[1m]))", "{{kind}}"),
+    ("Ignored (unconfigured) events per second", "sum(rate(oxemon_adapter_ignored_events_total[1m]))", "ignored"),
+    ("Shed (rate limited) datagrams per second",
+     "sum by (source) (rate(oxemon_adapter_shed_datagrams_total[1m]))", "{{source}}"),
+    ("Shed (rate limited) emits per second",
+     "sum by (module, event) (rate(oxemon_adapter_shed_emits_total[1m]))", "{{module}} {{event}}"),
+    ("Kernel socket drops per second", "rate(oxemon_adapter_socket_drops_total[1m])", "drops"),
+    ("Ingest queue depth", "sum(oxemon_adapter_queue_depth)", "depth"),
+    ("Ingest queue drops per second", "sum by (kind) (rate(oxemon_adapter_queue_drops_total[1m]))", "{{kind}}"),
+    ("Stage latency p50",
+     "histogram_quantile(0.5, sum by (stage, le) (rate(oxemon_adapter_stage_latency_seconds_bucket[1m])))",
+     "{{stage}}"),
+    ("Stage latency p99",
+     "histogram_quantile(0.99, sum by (stage, le) (rate(oxemon_adapter_stage_latency_seconds_bucket[1m])))",
+     "{{stage}}"),
+    ("Loki push latency p99",
+     "histogram_quantile(0.99, sum by (le) (rate(oxemon_adapter_loki_push_seconds_bucket[1m])))", "p99"),
+    ("Loki push failures per second", "sum(rate(oxemon_adapter_loki_push_failures_total[1m]))", "failures"),
+    ("Dropped log lines per second", "sum(rate(oxemon_adapter_loki_dropped_lines_total[1m]))", "dropped"),
+    ("Remote-write push latency p99",
+     "histogram_quantile(0.99, sum by (le) (rate(oxemon_adapter_remote_write_seconds_bucket[1m])))", "p99"),
+    ("Remote-write failures per second", "sum(rate(oxemon_adapter_remote_write_failures_total[1m]))", "failures"),
+]
 
 
 # Very basic sanitization for Prometheus metric names (same as in `generate_grafana_dashboards_from_input_config.py`)
@@ -43,6 +74,11 @@ def generate_promql_expression(metric_name: str, module_label: str, operation: s
         "rolling_average": f"rate({default_promql_expression}[1m])",
         "sum": f"sum({default_promql_expression})",
         "show_current": default_promql_expression,
+        # Distributions are summaries (their percentiles are estimated by the adapter) with a `_max` gauge
+        "p50": f'{metric_name}{{module="{module_label}",quantile="0.5"}}',
+        "p90": f'{metric_name}{{module="{module_label}",quantile="0.9"}}',
+        "p99": f'{metric_name}{{module="{module_label}",quantile="0.99"}}',
+        "max": f'{metric_name}_max{{module="{module_label}"}}',
     }
     return possible_promql_expressions.get(operation, default_promql_expression)
 
@@ -78,14 +114,26 @@ def create_dashboard(name: str, panels: list) -> dict:
     }
 
  
+def create_panel(panel_id: int, title: str, expression: str, legend: str = "{{module}}", x: int = 0, y: int = 0,
+                 mappings: list = None) -> dict:
+    """
+    Creates a timeseries panel (built afresh rather than deep-copied from a template, which is several times slower).
+    """
+    return {
+        "id": panel_id,
+        "type": "timeseries",
+        "title": title,
+        "datasource": {"type": "prometheus", "uid": PROMETHEUS_SOURCE_UID},
+        "targets": [{"expr": expression, "legendFormat": legend, "interval": "", "refId": "refId"}],
+        "gridPos": {"h": PANEL_HEIGHT, "w": PANEL_WIDTH, "x": x, "y": y},
+        "fieldConfig": {"defaults": {"mappings": [] if mappings is None else mappings}},
+    }
+
+
 def create_log_panel(panel_id: int, module_name: str):
-    log_panel = deepcopy(TEMPLATE_PANEL)
+    log_panel = create_panel(panel_id, f"{module_name} - logs", f"{{module=\"{module_name}\"}}", x=PANEL_WIDTH)
     log_panel["type"] = "logs"
-    log_panel["id"] = panel_id
-    log_panel["title"] = f"{module_name} - logs"
-    log_panel["datasource"]["type"] = "loki"
-    log_panel["datasource"]["uid"] = LOKI_SOURCE_UID
-    log_panel["gridPos"]["x"] = PANEL_WIDTH
+    log_panel["datasource"] = {"type": "loki", "uid": LOKI_SOURCE_UID}
     log_panel["options"] = {
         "dedupStrategy": "none",
         "enableInfiniteScrolling": False,
@@ -97,22 +145,46 @@ def create_log_panel(panel_id: int, module_name: str):
         "sortOrder": "Descending",
         "wrapLogMessage": False
         }
-    log_panel["targets"][0]["expr"] = f"{{module=\"{module_name}\"}}"
 
     return log_panel
 
 
-def convert_monitoring_entries_to_module_dashboards(monitoring_entries: dict) -> list:
+def create_adapter_health_dashboard() -> dict:
     """
-    Creates a list of module-centric dashboards from a given dictionary of monitoring entries.
+    Creates a dashboard of the adapter's own metrics (throughput, errors, drops and latencies).
     """
-    module_panels = defaultdict(list)
-    panel_id = 0
+    panels = [
+        create_panel(panel_id, title, expression, legend,
+                     x=(panel_id % 2) * PANEL_WIDTH, y=(panel_id // 2) * PANEL_HEIGHT)
+        for panel_id, (title, expression, legend) in enumerate(ADAPTER_HEALTH_PANELS)
+    ]
 
+    return create_dashboard(ADAPTER_HEALTH_DASHBOARD_NAME, panels)
+
+
+def group_entries_by_module(monitoring_entries: dict) -> dict:
+    """
+    Groups the monitoring entries by their module, as `{module: {entry name: entry}}` (in their original order).
+    """
+    module_entries = defaultdict(dict)
     for entry_name, entry in monitoring_entries.items():
-        base_panel = deepcopy(TEMPLATE_PANEL)
-        if entry["type"] == "enum":
-            base_panel["fieldConfig"]["defaults"]["mappings"] = generate_grafana_enum_mapping_from_config_entry(entry)
+        if entry_name != SOURCE_RATE_LIMITS_KEY:
+            module_entries[entry["module_id"]][entry_name] = entry
+
+    return dict(module_entries)
+
+
+def create_module_dashboard(module_name: str, module_entries: dict) -> dict:
+    """
+    Creates the dashboard of a single module from its monitoring entries (so that it depends on nothing else).
+
+    The module's panels are laid out from the top of its own dashboard, one under the other, with its logs on the
+    side.
+    """
+    panels = []
+    for entry_name, entry in module_entries.items():
+        # Shared by the entry's panels, they're only serialized
+        mappings = generate_grafana_enum_mapping_from_config_entry(entry) if entry["type"] == "enum" else None
         metric_name = replace_whitespace(entry["event_id"])
         module_label_name = replace_whitespace(entry["module_id"])
         if entry["type"] == "counter":
@@ -120,20 +192,101 @@ def convert_monitoring_entries_to_module_dashboards(monitoring_entries: dict) ->
         metric_operations = entry.get("operations", ["value"])
         for operation in metric_operations:
             operation = replace_whitespace(operation)
-            panel = deepcopy(base_panel)
-            panel["id"] = panel_id
-            panel["title"] = f"{entry_name} - {operation}"
-            panel["targets"][0]["expr"] = generate_promql_expression(metric_name, module_label_name, operation)
-            panel["targets"][0]["title"] = panel["title"]
-            panel["gridPos"]["y"] = panel_id * PANEL_HEIGHT
-            module_panels[entry["module_id"]].append(panel)
-            panel_id += 1
+            panel_id = len(panels)
+            title = f"{entry_name} - {operation}"
+            panel = create_panel(panel_id, title,
+                                 generate_promql_expression(metric_name, module_label_name, operation),
+                                 y=panel_id * PANEL_HEIGHT, mappings=mappings)
+            panel["targets"][0]["title"] = title
+            panels.append(panel)
 
-    for module in module_panels.keys():
-        module_panels[module].append(create_log_panel(panel_id, module))
-        panel_id += 1
+    panels.append(create_log_panel(len(panels), module_name))
+    return create_dashboard(module_name, panels)
+
+
+def convert_monitoring_entries_to_module_dashboards(monitoring_entries: dict) -> list:
+    """
+    Creates a list of module-centric dashboards from a given dictionary of monitoring entries.
+    """
+    return [create_module_dashboard(module_name, module_entries)
+            for module_name, module_entries in group_entries_by_module(monitoring_entries).items()]
 
-    return [create_dashboard(module_name, panels) for module_name, panels in module_panels.items()]
+
+def dashboard_file_name(dashboard_title: str) -> str:
+    return f"{dashboard_title.replace(' ', '_')}_dashboard.json"
+
+
+def serialize_dashboard(dashboard: dict) -> bytes:
+    """
+    Serializes a dashboard with a panel per line, which is still readable and diffable, but is encoded by json's C
+    encoder (`indent` is only supported by its pure-Python encoder, which is several times slower).
+    """
+    fields = []
+    for key, value in dashboard.items():
+        if key == "panels" and value:
+            value_json = "[\n" + ",\n".join(f"    {dumps(panel)}" for panel in value) + "\n  ]"
+        else:
+            value_json = dumps(value)
+        fields.append(f"  {dumps(key)}: {value_json}")
+    return ("{\n" + ",\n".join(fields) + "\n}\n").encode()
+
+
+def write_dashboard(path: Path, create: Callable[[], dict], previous_hash: Optional[str] = None) -> tuple:
+    """
+    Creates a dashboard and writes it to `path`, unless its content has the `previous_hash`.
+
+    Returns the content's hash, and whether it was written.
+    """
+    content = serialize_dashboard(create())
+    dashboard_hash = content_hash(content)
+    if dashboard_hash == previous_hash:
+        return dashboard_hash, False
+    write_atomically(path, content)
+    return dashboard_hash, True
+
+
+def _write_dashboard_job(job: tuple) -> tuple:
+    return write_dashboard(*job)
+
+
+def pool_size(job_count: int, workers: int) -> int:
+    """
+    The amount of processes worth starting to write `job_count` dashboards, at most `workers` (1 writes them in
+    this process).
+    """
+    if job_count < POOL_MIN_JOBS:
+        return 1
+    return max(1, min(workers, -(-job_count // WORKER_CHUNK_SIZE)))
+
+
+def write_dashboards(jobs: Iterable[tuple], workers: int = DEFAULT_WORKERS) -> Iterator[tuple]:
+    """
+    Writes dashboards, given `(path, create, previous_hash)` jobs (see `write_dashboard`), yielding their results
+    in order.
+
+    Every dashboard is written as soon as it's created, and dropped, so only a few are held in memory at a time.
+    With enough dashboards for several `workers` (see `pool_size`), they are created and written by a pool of
+    processes (`create` must be picklable, e.g. a `partial` of a module-level function).
+    """
+    jobs = list(jobs)
+    workers = pool_size(len(jobs), workers)
+    if workers <= 1:
+        yield from map(_write_dashboard_job, jobs)
+        return
+    with ProcessPoolExecutor(workers) as executor:
+        yield from executor.map(_write_dashboard_job, jobs, chunksize=WORKER_CHUNK_SIZE)
+
+
+def dashboard_jobs(monitoring_entries: dict, dashboards_directory: str) -> list:
+    """
+    The `write_dashboards` jobs of all the dashboards (of every module, and of the adapter's health).
+    """
+    jobs = [(Path(dashboards_directory) / dashboard_file_name(module_name),
+             partial(create_module_dashboard, module_name, module_entries))
+            for module_name, module_entries in group_entries_by_module(monitoring_entries).items()]
+    jobs.append((Path(dashboards_directory) / dashboard_file_name(ADAPTER_HEALTH_DASHBOARD_NAME),
+                 create_adapter_health_dashboard))
+    return jobs
 
 
 def save_module_dashboards(module_dashboards_data: list, dashboards_directory: str):
@@ -141,20 +294,20 @@ def save_module_dashboards(module_dashboards_data: list, dashboards_directory: s
     Saves the given dashboards in some directory.
     """
     for dashboard in module_dashboards_data:
-        dashboard_file_path = Path(dashboards_directory) / f"{dashboard['title'].replace(' ', '_')}_dashboard.json"
-        with open(dashboard_file_path, "w") as f:
-            dump(dashboard, f, indent=2)
+        dashboard_file_path = Path(dashboards_directory) / dashboard_file_name(dashboard["title"])
+        dashboard_file_path.write_bytes(serialize_dashboard(dashboard))
 
 
-def create_module_dashboards_from_config(monitoring_entries_config_path: str, dashboards_directory: str):
+def create_module_dashboards_from_config(monitoring_entries_config_path: str, dashboards_directory: str,
+                                         workers: int = DEFAULT_WORKERS):
     """
     Creates module-centric dashboards from a given monitoring entries configuration file.
     """
     config_data = safe_load(Path(monitoring_entries_config_path).read_text())
     validate_config(config_data)
     Path(dashboards_directory).mkdir(parents=True, exist_ok=True)
-    module_dashboards = convert_monitoring_entries_to_module_dashboards(config_data)
-    save_module_dashboards(module_dashboards, dashboards_directory)
+    for _ in write_dashboards(dashboard_jobs(config_data, dashboards_directory), workers):
+        pass
 
 
 def parse_args():
@@ -163,6 +316,8 @@ def parse_args():
                         help="Input YAML config (e.g. monitor_config.yaml)")
     parser.add_argument("-o", "--output", type=Path, default=Path(DEFAULT_DASHBOARDS_DIRECTORY_NAME),
                         help="Output directory (e.g. outputs)")
+    parser.add_argument("-j", "--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Processes which create and write the dashboards")
     args = parser.parse_args()
 
     input_path = args.input
@@ -174,4 +329,4 @@ def parse_args():
 
 if __name__ == "__main__":
     arguments = parse_args()
-    create_module_dashboards_from_config(arguments.input, arguments.output)
+    create_module_dashboards_from_config(arguments.input, arguments.output, arguments.workers)